@@ -0,0 +1,158 @@
+"""
+support.py - helpers shared by the tests
+
+Run the tests from the folder holding tftpgui.py with:
+
+python -m unittest discover tests
+
+Provides classes:
+ServerTest - a TestCase with a server serving a temporary folder
+
+and functions:
+rrq(port, filename) - downloads a file, returns its content, or the error
+wrq(port, filename, data) - uploads data, returns "OK", or the error
+"""
+
+import os, socket, struct, shutil, tempfile, threading, time, unittest
+
+from tftp_package import tftp_engine, tftpcfg
+
+
+class TFTPError(Exception):
+    "Raised by the clients when the server sends an error"
+    pass
+
+
+def rrq(port, filename, blksize=None, timeout=2.0, mode="octet"):
+    """Downloads filename from the server on port, returns its content,
+       raises TFTPError if the server sends an error"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    request = "\x00\x01" + filename + "\x00" + mode + "\x00"
+    size = 512
+    if blksize:
+        request += "blksize\x00%s\x00" % blksize
+    sock.sendto(request, ("127.0.0.1", port))
+    blocks = []
+    expected = 1
+    try:
+        while True:
+            data, address = sock.recvfrom(65536)
+            if data[1] == "\x05":
+                raise TFTPError(data[4:-1])
+            if data[1] == "\x06":
+                size = blksize
+                sock.sendto("\x00\x04\x00\x00", address)
+                continue
+            block = struct.unpack("!H", data[2:4])[0]
+            if block == expected % 65536:
+                blocks.append(data[4:])
+                expected += 1
+            sock.sendto("\x00\x04" + data[2:4], address)
+            if block == (expected - 1) % 65536 and len(data) - 4 < size:
+                return "".join(blocks)
+    finally:
+        sock.close()
+
+
+def wrq(port, filename, data, tsize=None, timeout=2.0):
+    """Uploads data as filename to the server on port, returns "OK",
+       raises TFTPError if the server sends an error. If tsize is given
+       it is sent as the size of the file"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    # the blocks to send, the last shorter than 512 bytes, if need be empty
+    blocks = [data[index:index+512] for index in range(0, len(data)+1, 512)]
+    request = "\x00\x02" + filename + "\x00octet\x00"
+    if tsize is not None:
+        request += "tsize\x00%s\x00" % tsize
+    sock.sendto(request, ("127.0.0.1", port))
+    try:
+        address = None
+        for number in range(len(blocks)+1):
+            # wait for the acknowledgement of the block before
+            while True:
+                reply, address = sock.recvfrom(65536)
+                if reply[1] == "\x05":
+                    raise TFTPError(reply[4:-1])
+                if reply[1] == "\x04" and struct.unpack("!H", reply[2:4])[0] == number % 65536:
+                    break
+                if reply[1] == "\x06" and number == 0:
+                    # options acknowledged in place of block 0
+                    break
+            if number == len(blocks):
+                return "OK"
+            sock.sendto("\x00\x03" + struct.pack("!H", (number+1) % 65536) + blocks[number], address)
+    finally:
+        sock.close()
+
+
+def free_port():
+    "Returns a udp port on 127.0.0.1 which is free"
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class ServerTest(unittest.TestCase):
+    """Creates self.root and self.logs, temporary folders, and self.server,
+       a ServerState serving root on self.port, polled by a thread while
+       self.running. Set options, a dictionary of tuning options, to alter
+       the config"""
+
+    options = {}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.logs = tempfile.mkdtemp()
+        self.port = free_port()
+        cfgdict = tftpcfg.get_defaults()
+        cfgdict.update(tftprootfolder=self.root, logfolder=self.logs,
+                       listenport=self.port, listenipaddress="127.0.0.1")
+        cfgdict.update(self.options)
+        self.server = tftp_engine.ServerState(**cfgdict)
+        self.server.serving = True
+        self.server.poll()
+        self.running = True
+        self.thread = threading.Thread(target=self.run_server)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def run_server(self):
+        while self.running:
+            self.server.poll()
+            if not len(self.server):
+                time.sleep(0.005)
+
+    def tearDown(self):
+        self.running = False
+        self.thread.join(5.0)
+        self.server.shutdown()
+        shutil.rmtree(self.root, True)
+        shutil.rmtree(self.logs, True)
+
+    def write_file(self, name, data):
+        """Writes data to name, a path relative to the tftp root folder, under
+           a hidden name, then renamed, as a file is copied into the folder,
+           and waits until the server sees it"""
+        path = os.path.join(self.root, *name.split("/"))
+        folder, filename = os.path.split(path)
+        temppath = os.path.join(folder, "." + filename)
+        fp = open(temppath, "wb")
+        fp.write(data)
+        fp.close()
+        os.rename(temppath, path)
+        self.wait_seen(name, "file")
+
+    def make_folder(self, name):
+        "Creates the folder name in the tftp root folder, and waits until the server sees it"
+        os.mkdir(os.path.join(self.root, *name.split("/")))
+        self.wait_seen(name, "folder")
+
+    def wait_seen(self, name, kind):
+        "Waits until the server finds name is kind, file or folder, in its root index"
+        deadline = time.time() + self.server.indexinterval + 2.0
+        while self.server.lookup_path(name) != kind and time.time() < deadline:
+            time.sleep(0.01)
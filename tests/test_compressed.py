@@ -0,0 +1,133 @@
+"""
+test_compressed.py - tests files are served from compressed copies,
+compressed.ChunkCache and compressed.SizeIndex
+"""
+
+import os, shutil, tempfile, unittest, zlib
+
+from tftp_package import compressed
+
+
+def gzip_data(data):
+    "Returns data compressed in the gzip format"
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class CompressedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.logs = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+        shutil.rmtree(self.logs, True)
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, name)
+        fp = open(path, "wb")
+        fp.write(data)
+        fp.close()
+        return path
+
+    def read_all(self, cache, path):
+        reader = cache.open(path)
+        parts = []
+        while True:
+            data = reader.read(512)
+            parts.append(data)
+            if len(data) < 512:
+                break
+        size = reader.size
+        reader.close()
+        return "".join(parts), size
+
+    def test_decompressed(self):
+        data = os.urandom(100000) + "\x00"*600000 + os.urandom(5000)
+        path = self.write("image.bin.gz", gzip_data(data))
+        cache = compressed.ChunkCache(1024*1024)
+        self.assertEqual(self.read_all(cache, path), (data, len(data)))
+
+    def test_several_members(self):
+        first = os.urandom(300000)
+        second = "x"*300000
+        path = self.write("image.bin.gz", gzip_data(first) + gzip_data(second))
+        cache = compressed.ChunkCache(1024*1024)
+        self.assertEqual(self.read_all(cache, path)[0], first + second)
+
+    def test_bounded_expansion(self):
+        # 100 MB of zeros compress to about 100 KB
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        chunks = [compressor.compress("\x00"*1048576) for count in range(100)]
+        path = self.write("bomb.bin.gz", "".join(chunks) + compressor.flush())
+        cache = compressed.ChunkCache(1024*1024)
+        reader = cache.open(path)
+        self.assertEqual(reader.read(512), "\x00"*512)
+        # only a chunk has been decompressed
+        self.assertTrue(len(reader.decompression._pending) <= compressed.CHUNKSIZE)
+        reader.close()
+
+    def test_closed_with_last_reader(self):
+        data = os.urandom(300000)
+        paths = [self.write("image%s.bin.gz" % number, gzip_data(data)) for number in range(3)]
+        cache = compressed.ChunkCache(1024*1024)
+        first = cache.open(paths[0])
+        second = cache.open(paths[0])
+        # shared while both are open
+        self.assertTrue(first.decompression is second.decompression)
+        decompression = first.decompression
+        first.read(512)
+        first.close()
+        self.assertTrue(decompression.fp is not None)
+        second.close()
+        self.assertEqual(decompression.fp, None)
+        for path in paths:
+            self.assertEqual(self.read_all(cache, path)[0], data)
+        # nothing is held for files no longer read, but their chunks
+        self.assertEqual(cache._decompressions, {})
+        self.assertTrue(cache.size > 0)
+
+    def test_gzip_max_length(self):
+        decompressor = compressed._GzipDecompressor()
+        data = "\x00"*1000000
+        result = []
+        compressed_data = gzip_data(data)
+        while True:
+            piece = ""
+            if decompressor.needs_input:
+                piece, compressed_data = compressed_data[:1000], compressed_data[1000:]
+                if not piece:
+                    break
+            result.append(decompressor.decompress(piece, 4096))
+            self.assertTrue(len(result[-1]) <= 4096)
+        self.assertEqual("".join(result), data)
+
+    def test_size_index_in_log_folder(self):
+        data = os.urandom(1000)
+        path = self.write("image.bin.gz", gzip_data(data))
+        indexpath = os.path.join(self.logs, compressed.SIZEINDEX)
+        self.read_all(compressed.ChunkCache(1024*1024, indexpath), path)
+        # nothing is written to the served folder
+        self.assertEqual(os.listdir(self.folder), ["image.bin.gz"])
+        self.assertTrue(os.path.isfile(indexpath))
+        # the size is known by a new cache, before decompressing
+        reader = compressed.ChunkCache(1024*1024, indexpath).open(path)
+        self.assertEqual(reader.size, 1000)
+        reader.close()
+
+    def test_size_index_in_memory(self):
+        data = os.urandom(1000)
+        path = self.write("image.bin.gz", gzip_data(data))
+        cache = compressed.ChunkCache(1024*1024)
+        self.read_all(cache, path)
+        self.assertEqual(os.listdir(self.folder), ["image.bin.gz"])
+        self.assertEqual(cache.index.lookup(path, os.stat(path)), 1000)
+        # a changed file is decompressed again
+        self.write("image.bin.gz", gzip_data(data*2))
+        os.utime(path, (0, 0))
+        self.assertEqual(cache.index.lookup(path, os.stat(path)), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+test_drain.py - tests a server stopped with transfers in progress drains,
+and takes a new config, as the gui applies it, while draining, and that
+a listener may not be named main
+"""
+
+import os, shutil, socket, tempfile, time, unittest
+
+from tftp_package import tftp_engine, tftpcfg
+
+from support import ServerTest, rrq
+
+
+def wait_for(test, timeout=5.0):
+    "Waits up to timeout seconds for test() to return True, returns its result"
+    deadline = time.time() + timeout
+    while not test() and time.time() < deadline:
+        time.sleep(0.01)
+    return test()
+
+
+class DrainTest(ServerTest):
+
+    options = {"draintime": 30}
+
+    def run_server(self):
+        # the loop run with the gui, which applies new_config
+        tftp_engine.loop(self.server)
+
+    def tearDown(self):
+        self.server.break_loop = True
+        ServerTest.tearDown(self)
+
+    def start_transfer(self):
+        """Requests a file, without acknowledging the first block, so the
+           transfer stays in progress, returns the socket, server address
+           and first block"""
+        self.write_file("image.bin", "x"*2000)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(2.0)
+        self.addCleanup(sock.close)
+        sock.sendto("\x00\x01image.bin\x00octet\x00", ("127.0.0.1", self.port))
+        data, address = sock.recvfrom(65536)
+        return sock, address, data
+
+    def finish_transfer(self, sock, address, data):
+        "Acknowledges each block until the last"
+        while True:
+            sock.sendto("\x00\x04" + data[2:4], address)
+            if len(data) - 4 < 512:
+                return
+            data, address = sock.recvfrom(65536)
+
+    def test_drain(self):
+        transfer = self.start_transfer()
+        self.server.serving = False
+        self.assertTrue(wait_for(lambda: self.server.draining))
+        self.assertTrue(self.server.listening)
+        # new requests are refused
+        self.assertRaises(socket.timeout, rrq, self.port, "image.bin", timeout=0.5)
+        # the transfer in progress carries on, then the server stops
+        self.finish_transfer(*transfer)
+        self.assertTrue(wait_for(lambda: not self.server.listening))
+        self.assertFalse(self.server.draining)
+
+    def test_set_config_while_draining(self):
+        transfer = self.start_transfer()
+        self.server.serving = False
+        self.assertTrue(wait_for(lambda: self.server.draining))
+        cfgdict = self.server.get_config_dict()
+        cfgdict["missttl"] = 20
+        # left for the loop to apply
+        self.assertFalse(self.server.set_config(cfgdict))
+        self.assertTrue(wait_for(lambda: self.server.missttl == 20))
+        self.assertTrue(self.thread.isAlive())
+        self.assertTrue(self.server.draining)
+        self.finish_transfer(*transfer)
+        self.assertTrue(wait_for(lambda: not self.server.listening))
+
+    def test_set_config_reloaded(self):
+        cfgdict = self.server.get_config_dict()
+        cfgdict["missttl"] = 20
+        self.assertFalse(self.server.set_config(cfgdict))
+        # the gui saves cfgdict once the loop gives it in reloaded
+        self.assertTrue(wait_for(lambda: self.server.reloaded[1] is cfgdict))
+        self.assertTrue(self.server.reloaded[2])
+        self.assertEqual(self.server.missttl, 20)
+
+    def test_set_config_unable_to_bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        self.addCleanup(sock.close)
+        cfgdict = self.server.get_config_dict()
+        cfgdict["listenport"] = sock.getsockname()[1]
+        self.assertFalse(self.server.set_config(cfgdict))
+        self.assertTrue(wait_for(lambda: self.server.reloaded[1] is cfgdict))
+        # not applied, so the gui does not save it
+        self.assertFalse(self.server.reloaded[2])
+        self.assertEqual(self.server.listenport, self.port)
+        self.assertTrue(self.thread.isAlive())
+
+    def test_set_config_stopped(self):
+        self.server.serving = False
+        self.assertTrue(wait_for(lambda: not self.server.listening))
+        cfgdict = self.server.get_config_dict()
+        cfgdict["missttl"] = 20
+        # applied at once
+        self.assertTrue(self.server.set_config(cfgdict))
+        self.assertEqual(self.server.missttl, 20)
+
+
+class ListenerNameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.configfile = tftpcfg.CONFIGFILE
+        tftpcfg.CONFIGFILE = os.path.join(self.folder, "tftpgui.cfg")
+
+    def tearDown(self):
+        tftpcfg.CONFIGFILE = self.configfile
+        shutil.rmtree(self.folder, True)
+
+    def listeners(self, section):
+        fp = open(tftpcfg.CONFIGFILE, "w")
+        fp.write("[%s]\nlistenport = 6969\n" % section)
+        fp.close()
+        cfgdict = tftpcfg.get_defaults()
+        cfgdict.update(tftprootfolder=self.folder, logfolder=self.folder)
+        return tftpcfg.getlisteners(cfgdict)
+
+    def test_named(self):
+        self.assertEqual([name for name, cfgdict in self.listeners("Listener lab")], ["main", "lab"])
+
+    def test_main_rejected(self):
+        # main is the listener of the [IPsetup] section
+        self.assertRaises(tftpcfg.ConfigError, self.listeners, "Listener main")
+        self.assertRaises(tftpcfg.ConfigError, self.listeners, "Listener ")
+
+
+if __name__ == "__main__":
+    unittest.main()
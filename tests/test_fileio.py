@@ -0,0 +1,202 @@
+"""
+test_fileio.py - tests the writing of received files, fileio.FileWriter
+and fileio.AtomicFile
+"""
+
+import os, shutil, tempfile, time, unittest
+
+from tftp_package import fileio
+
+
+class FailingFile(object):
+    "A file whose writes fail once failafter bytes are written"
+
+    def __init__(self, failafter):
+        self.failafter = failafter
+        self.data = ""
+        self.closed = False
+        self.aborted = False
+
+    def write(self, data):
+        if len(self.data) + len(data) > self.failafter:
+            raise IOError("No space left on device")
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+
+def wait_done(writer, timeout=5.0):
+    "Waits for a FileWriter to close or abort its file"
+    deadline = time.time() + timeout
+    while not writer.done and time.time() < deadline:
+        time.sleep(0.005)
+
+
+class FileWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = fileio.WriterPool(1)
+
+    def tearDown(self):
+        self.pool.stop(5.0)
+
+    def test_written_and_closed(self):
+        fp = FailingFile(10000)
+        writer = self.pool.writer(fp, 4096)
+        for count in range(10):
+            writer.write("x"*512)
+        writer.close()
+        wait_done(writer)
+        self.assertTrue(writer.done)
+        self.assertEqual(writer.error, None)
+        self.assertEqual(fp.data, "x"*5120)
+        self.assertTrue(fp.closed)
+        self.assertFalse(fp.aborted)
+
+    def test_failed_write_aborts(self):
+        fp = FailingFile(1000)
+        writer = self.pool.writer(fp, 4096)
+        for count in range(4):
+            writer.write("x"*512)
+            # written one at a time, so the first succeeds
+            while writer.queued:
+                time.sleep(0.005)
+        writer.close()
+        wait_done(writer)
+        self.assertTrue(writer.done)
+        self.assertTrue(isinstance(writer.error, IOError))
+        self.assertTrue(fp.aborted)
+        self.assertFalse(fp.closed)
+
+    def test_abort(self):
+        fp = FailingFile(10000)
+        writer = self.pool.writer(fp, 4096)
+        writer.write("x"*512)
+        writer.abort()
+        wait_done(writer)
+        self.assertTrue(fp.aborted)
+        self.assertFalse(fp.closed)
+
+
+class AtomicFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.folder, "upload.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def read(self):
+        fp = open(self.filepath, "rb")
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+
+    def test_renamed_when_closed(self):
+        atomicfile = fileio.AtomicFile(self.filepath, size=5000)
+        atomicfile.write("abc"*100)
+        # only the temporary file exists while writing
+        self.assertFalse(os.path.exists(self.filepath))
+        self.assertEqual(len(os.listdir(self.folder)), 1)
+        atomicfile.close()
+        self.assertTrue(atomicfile.done)
+        # truncated to the data written, though 5000 bytes were reserved
+        self.assertEqual(self.read(), "abc"*100)
+        self.assertEqual(os.listdir(self.folder), ["upload.bin"])
+
+    def test_abort_leaves_nothing(self):
+        atomicfile = fileio.AtomicFile(self.filepath)
+        atomicfile.write("abc")
+        atomicfile.abort()
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_existing_file_kept(self):
+        atomicfile = fileio.AtomicFile(self.filepath)
+        atomicfile.write("new")
+        fp = open(self.filepath, "wb")
+        fp.write("old")
+        fp.close()
+        atomicfile.close()
+        self.assertFalse(atomicfile.done)
+        self.assertNotEqual(atomicfile.error, None)
+        self.assertEqual(self.read(), "old")
+        self.assertEqual(os.listdir(self.folder), ["upload.bin"])
+
+    def test_fsync(self):
+        atomicfile = fileio.AtomicFile(self.filepath, fsync=True)
+        atomicfile.write("abc")
+        atomicfile.close()
+        self.assertTrue(atomicfile.done)
+        self.assertEqual(self.read(), "abc")
+
+    def test_failed_write_through_writer(self):
+        # a write failing part way through leaves no file under the final name
+        pool = fileio.WriterPool(1)
+        try:
+            atomicfile = fileio.AtomicFile(self.filepath)
+            def write(data):
+                raise IOError("No space left on device")
+            atomicfile.write = write
+            writer = pool.writer(atomicfile, 4096)
+            writer.write("abc")
+            writer.close()
+            wait_done(writer)
+            self.assertNotEqual(writer.error, None)
+            self.assertEqual(os.listdir(self.folder), [])
+        finally:
+            pool.stop(5.0)
+
+
+class GroupSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folders = [tempfile.mkdtemp()]
+        # a folder on a second filesystem, if there is one
+        if os.path.isdir("/dev/shm"):
+            folder = tempfile.mkdtemp(dir="/dev/shm")
+            if os.stat(folder).st_dev != os.stat(self.folders[0]).st_dev:
+                self.folders.append(folder)
+            else:
+                os.rmdir(folder)
+        self.synced = []
+        self.syncfs = fileio._syncfs
+        fileio._syncfs = self.record_syncfs
+        self.syncer = fileio.GroupSync(delay=0.05)
+
+    def tearDown(self):
+        self.syncer.stop()
+        self.syncer.thread.join(5.0)
+        fileio._syncfs = self.syncfs
+        for folder in self.folders:
+            shutil.rmtree(folder, True)
+
+    def record_syncfs(self, fd):
+        self.synced.append(os.fstat(fd).st_dev)
+        return self.syncfs(fd)
+
+    def test_each_filesystem_synced(self):
+        files = []
+        for folder in self.folders:
+            for name in ("one.bin", "two.bin"):
+                atomicfile = fileio.AtomicFile(os.path.join(folder, name), syncer=self.syncer)
+                atomicfile.write(name)
+                atomicfile.close()
+                files.append(atomicfile)
+        deadline = time.time() + 5.0
+        while [atomicfile for atomicfile in files if not atomicfile.done] and time.time() < deadline:
+            time.sleep(0.005)
+        for atomicfile in files:
+            self.assertTrue(atomicfile.done)
+            self.assertEqual(open(atomicfile.filepath, "rb").read(), os.path.basename(atomicfile.filepath))
+        # one syncfs call for each filesystem
+        self.assertEqual(sorted(self.synced), sorted([os.stat(folder).st_dev for folder in self.folders]))
+
+
+if __name__ == "__main__":
+    unittest.main()
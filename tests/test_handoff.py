@@ -0,0 +1,152 @@
+"""
+test_handoff.py - tests transfers in progress when the server is restarted,
+by a SIGUSR2 signal, finish without delay, their packets being forwarded
+by the new process to the old
+"""
+
+import os, re, signal, socket, subprocess, sys, shutil, tempfile, time, unittest
+
+from tftp_package import handoff
+
+from support import free_port, rrq
+
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tftpgui.py")
+
+CONFIG = """[Folders]
+tftprootfolder = %s
+logfolder = %s
+[IPsetup]
+anyclient = 1
+clientipaddress = 192.168.0.0
+clientmask = 16
+listenport = %s
+listenipaddress = 127.0.0.1
+[Tuning]
+draintime = 60
+"""
+
+
+class HandoffTest(unittest.TestCase):
+
+    def setUp(self):
+        if not handoff.available() or not hasattr(signal, "SIGUSR2"):
+            self.skipTest("restart is not available on this system")
+        self.folder = tempfile.mkdtemp()
+        self.root = os.path.join(self.folder, "root")
+        self.logs = os.path.join(self.folder, "logs")
+        os.mkdir(self.root)
+        os.mkdir(self.logs)
+        self.port = free_port()
+        self.data = os.urandom(100000)
+        fp = open(os.path.join(self.root, "image.bin"), "wb")
+        fp.write(self.data)
+        fp.close()
+        configfile = os.path.join(self.folder, "tftpgui.cfg")
+        fp = open(configfile, "w")
+        fp.write(CONFIG % (self.root, self.logs, self.port))
+        fp.close()
+        self.pids = []
+        self.process = subprocess.Popen([sys.executable, PROGRAM, "--nogui", configfile],
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.pids.append(self.process.pid)
+        deadline = time.time() + 10.0
+        while time.time() < deadline:
+            try:
+                rrq(self.port, "image.bin", timeout=0.2)
+                return
+            except socket.timeout:
+                pass
+        self.fail("the server did not start")
+
+    def tearDown(self):
+        # killed, as a stopped server drains for up to draintime
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self.process.communicate()
+        shutil.rmtree(self.folder, True)
+
+    def log(self):
+        fp = open(os.path.join(self.logs, "tftplog"))
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+
+    def wait_log(self, pattern, timeout=10.0):
+        "Waits for pattern to appear in the log, returns the match"
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            match = re.search(pattern, self.log())
+            if match:
+                return match
+            time.sleep(0.05)
+        self.fail("%s not logged" % pattern)
+
+    def test_transfers_finish(self):
+        transfers = []
+        for count in range(2):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.settimeout(2.0)
+            self.addCleanup(sock.close)
+            sock.sendto("\x00\x01image.bin\x00octet\x00", ("127.0.0.1", self.port))
+            data, address = sock.recvfrom(65536)
+            transfers.append([sock, address, data, [data[4:]]])
+        self.process.send_signal(signal.SIGUSR2)
+        newpid = int(self.wait_log(r"new process (\d+)").group(1))
+        self.pids.append(newpid)
+        self.wait_log("taken over by the new process")
+        # each packet from the clients now goes through the new process,
+        # 390 blocks, which took 40 seconds when forwarded 10 a second
+        deadline = time.time() + 5.0
+        while transfers:
+            self.assertTrue(time.time() < deadline, "transfers stalled")
+            for transfer in transfers[:]:
+                sock, address, data, blocks = transfer
+                sock.sendto("\x00\x04" + data[2:4], address)
+                if len(data) - 4 < 512:
+                    transfers.remove(transfer)
+                    self.assertEqual("".join(blocks), self.data)
+                    continue
+                data, address = sock.recvfrom(65536)
+                blocks.append(data[4:])
+                transfer[1:3] = [address, data]
+        # the old process exits once drained, the new one serves
+        self.assertEqual(self.process.wait(), 0)
+        self.assertEqual(rrq(self.port, "image.bin"), self.data)
+
+
+class SpawnTest(unittest.TestCase):
+
+    def setUp(self):
+        if not handoff.available():
+            self.skipTest("restart is not available on this system")
+
+    def test_flags_restored(self):
+        import fcntl
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        own, peer = handoff.socket_pair()
+        self.addCleanup(own.close)
+        self.addCleanup(peer.close)
+        other = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(other.close)
+        flags = [fcntl.fcntl(fd, fcntl.F_GETFD) for fd in (sock.fileno(), peer.fileno(), other.fileno())]
+        # unable to start, the descriptors are as they were
+        self.assertRaises(OSError, handoff.spawn, [os.path.join(tempfile.gettempdir(), "no-such-program")], [sock], peer)
+        self.assertEqual([fcntl.fcntl(fd, fcntl.F_GETFD) for fd in (sock.fileno(), peer.fileno(), other.fileno())], flags)
+
+    def test_forwarded_through_pair(self):
+        own, peer = handoff.socket_pair()
+        self.addCleanup(own.close)
+        forwarder = handoff.Forwarder(peer)
+        self.addCleanup(forwarder.close)
+        forwarder.forward(69, ("10.0.0.1", 2000), "\x00\x04\x00\x01")
+        self.assertEqual(handoff.unpack_packet(own.recv(8192)), (69, ("10.0.0.1", 2000), "\x00\x04\x00\x01"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+test_journal.py - tests journal.JournalWriter, read_journal and the queries
+made of the journal
+"""
+
+import os, shutil, tempfile, unittest
+
+from tftp_package import journal
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def write(self, records):
+        writer = journal.JournalWriter(self.path)
+        for record in records:
+            writer.record(*record)
+        writer.close()
+
+    def test_read_back(self):
+        self.write([(("10.0.0.1", 2000), 69, False, "image.bin", 100000, 512, 2.0, 3, "ok"),
+                    (("10.0.0.2", 2001), 69, True, u"caf\xe9.txt", 10, 1024, 0.5, 0, "timeout")])
+        # appended to, not overwritten
+        self.write([(("10.0.0.1", 2002), 69, False, "missing", 0, 512, 0.0, 0, "not found")])
+        entries = list(journal.read_journal(self.path))
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(entries[0]["client"], "10.0.0.1")
+        self.assertEqual(entries[0]["port"], 2000)
+        self.assertFalse(entries[0]["upload"])
+        self.assertEqual(entries[0]["bytes"], 100000)
+        self.assertEqual(entries[0]["retransmits"], 3)
+        self.assertEqual(entries[1]["filename"], "caf\xc3\xa9.txt")
+        self.assertTrue(entries[1]["upload"])
+        self.assertEqual(entries[1]["outcome"], "timeout")
+        self.assertEqual(entries[2]["outcome"], "not found")
+
+    def test_record_cut_short(self):
+        self.write([(("10.0.0.1", 2000), 69, False, "image.bin", 1000, 512, 1.0, 0, "ok")] * 2)
+        fp = open(self.path, "r+b")
+        fp.truncate(os.path.getsize(self.path) - 3)
+        fp.close()
+        self.assertEqual(len(list(journal.read_journal(self.path))), 1)
+
+    def test_appended_after_record_cut_short(self):
+        record = (("10.0.0.1", 2000), 69, False, "image.bin", 1000, 512, 1.0, 0, "ok")
+        self.write([record] * 2)
+        fp = open(self.path, "r+b")
+        fp.truncate(os.path.getsize(self.path) - 3)
+        fp.close()
+        # as after a restart, the part record is cut off before appending
+        self.write([(("10.0.0.2", 2001), 69, True, "other.bin", 10, 512, 1.0, 0, "timeout")])
+        entries = list(journal.read_journal(self.path))
+        self.assertEqual([entry["filename"] for entry in entries], ["image.bin", "other.bin"])
+        self.assertEqual(entries[1]["client"], "10.0.0.2")
+        self.assertEqual(entries[1]["outcome"], "timeout")
+
+    def test_not_a_journal(self):
+        fp = open(self.path, "wb")
+        fp.write("something else")
+        fp.close()
+        self.assertRaises(ValueError, list, journal.read_journal(self.path))
+
+    def test_queries(self):
+        entries = [{"time": 100.0, "duration": 1.0, "client": "10.0.0.1", "bytes": 1024*100,
+                    "filename": "image.bin", "outcome": "ok", "retransmits": 1},
+                   {"time": 130.0, "duration": 1.0, "client": "10.0.0.2", "bytes": 1024*10,
+                    "filename": "image.bin", "outcome": "ok", "retransmits": 0},
+                   {"time": 170.0, "duration": 5.0, "client": "10.0.0.2", "bytes": 0,
+                    "filename": "other.bin", "outcome": "timeout", "retransmits": 4}]
+        counts = journal.outcome_counts(entries)
+        self.assertEqual((counts["ok"], counts["timeout"], counts["failed"]), (2, 1, 0))
+        self.assertEqual(journal.top_files(entries, 1), [("image.bin", 2, 1024*110, 0)])
+        self.assertEqual(journal.slowest_clients(entries, 2),
+                         [("10.0.0.2", 1, 10.0, 0), ("10.0.0.1", 1, 100.0, 1)])
+        rates = journal.failure_rates(entries, 60)
+        self.assertEqual([(start, number) for start, number, outcomes in rates], [(60.0, 1), (120.0, 2)])
+        self.assertEqual(rates[1][2]["timeout"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+test_misses.py - tests misses.MissCache and misses.MissLog
+"""
+
+import time, unittest
+
+from tftp_package import misses
+
+
+class MissCacheTest(unittest.TestCase):
+
+    def test_normalise(self):
+        self.assertEqual(misses.normalise("/pxelinux.cfg\\01-aa"), "pxelinux.cfg/01-aa")
+        self.assertEqual(misses.normalise("boot/image.bin"), "boot/image.bin")
+
+    def test_known_missing(self):
+        cache = misses.MissCache(10, 60)
+        self.assertFalse(cache.get("image.bin"))
+        cache.add("image.bin")
+        self.assertTrue(cache.get("image.bin"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_expired(self):
+        cache = misses.MissCache(10, 0.05)
+        cache.add("image.bin")
+        time.sleep(0.1)
+        self.assertFalse(cache.get("image.bin"))
+        self.assertEqual(len(cache), 0)
+
+    def test_oldest_discarded(self):
+        cache = misses.MissCache(2, 60)
+        for name in ("one", "two", "three"):
+            cache.add(name)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(cache.get("one"))
+        self.assertTrue(cache.get("three"))
+
+    def test_disabled(self):
+        for cache in (misses.MissCache(0, 60), misses.MissCache(10, 0)):
+            cache.add("image.bin")
+            self.assertFalse(cache.get("image.bin"))
+
+    def test_discard_created(self):
+        cache = misses.MissCache(10, 60)
+        for name in ("image.bin", "boot/one", "boot/two", "bootx", "other"):
+            cache.add(name)
+        # a compressed copy of image.bin
+        cache.discard("image.bin.gz")
+        self.assertFalse(cache.get("image.bin"))
+        # a new folder, and the files within it
+        cache.discard("boot")
+        self.assertFalse(cache.get("boot/one"))
+        self.assertFalse(cache.get("boot/two"))
+        self.assertTrue(cache.get("bootx"))
+        self.assertTrue(cache.get("other"))
+
+
+class MissLogTest(unittest.TestCase):
+
+    def test_repeats_counted(self):
+        lines = []
+        log = misses.MissLog(lines.append, 60)
+        log.record("10.0.0.1", "image.bin")
+        log.record("10.0.0.1", "image.bin")
+        log.record("10.0.0.2", "image.bin")
+        self.assertEqual(lines, ["10.0.0.1 requested image.bin: file not found"])
+        log.poll()
+        self.assertEqual(len(lines), 1)
+        log.flush()
+        self.assertTrue(lines[1].startswith("2 further requests for missing files from 2 clients"))
+        # logged again in the next interval
+        log.record("10.0.0.1", "image.bin")
+        self.assertEqual(len(lines), 3)
+
+    def test_every_request(self):
+        lines = []
+        log = misses.MissLog(lines.append, 0)
+        log.record("10.0.0.1", "image.bin")
+        log.record("10.0.0.1", "image.bin")
+        log.flush()
+        self.assertEqual(len(lines), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+test_netascii.py - tests netascii conversion, with CR LF and CR NUL pairs
+split across chunks, and netascii.EncodedCache
+"""
+
+import os, shutil, socket, tempfile, unittest
+
+from tftp_package import netascii
+
+from support import ServerTest, rrq
+
+
+TEXT = "one\ntwo\r\nthree\rfour\n\rend\r"
+
+
+def encode(data):
+    "Returns data, with local line ends, as netascii"
+    encoder = netascii.Encoder()
+    return encoder.encode(data) + encoder.flush()
+
+
+def chunked(codec, method, data, size):
+    "Passes data to the codec method in chunks of size bytes, returns the result"
+    result = [getattr(codec, method)(data[index:index+size]) for index in range(0, len(data), size)]
+    return "".join(result) + codec.flush()
+
+
+class ConversionTest(unittest.TestCase):
+
+    def test_encode_lf(self):
+        self.assertEqual(netascii.Encoder("\n").encode("a\nb\rc"), "a\r\nb\r\x00c")
+
+    def test_round_trip(self):
+        # a lone LF is not kept where the local line end is CR LF
+        for linesep, data in (("\n", TEXT), ("\r\n", "a\r\nb\r\nc\rd\r")):
+            whole = chunked(netascii.Encoder(linesep), "encode", data, len(data))
+            # every split of a pair across chunks gives the same result
+            for size in range(1, len(data) + 1):
+                self.assertEqual(chunked(netascii.Encoder(linesep), "encode", data, size), whole)
+            for size in range(1, len(whole) + 1):
+                self.assertEqual(chunked(netascii.Decoder(linesep), "decode", whole, size), data)
+
+    def test_crlf_local_line_end(self):
+        encoded = chunked(netascii.Encoder("\r\n"), "encode", "a\r\nb\rc", 2)
+        self.assertEqual(encoded, "a\r\nb\r\x00c")
+        self.assertEqual(chunked(netascii.Decoder("\r\n"), "decode", encoded, 1), "a\r\nb\rc")
+
+
+class EncodingReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "text.txt")
+        fp = open(self.path, "wb")
+        fp.write(TEXT*1000)
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def test_exact_blocks(self):
+        fp = open(self.path, "rb")
+        expected = netascii.encode_file(fp)
+        fp.close()
+        reader = netascii.EncodingReader(open(self.path, "rb"), chunksize=100)
+        self.assertEqual(reader.encoded_size(), len(expected))
+        blocks = []
+        while True:
+            block = reader.read(512)
+            blocks.append(block)
+            if len(block) < 512:
+                break
+        reader.close()
+        self.assertTrue(all(len(block) == 512 for block in blocks[:-1]))
+        self.assertEqual("".join(blocks), expected)
+
+    def test_cache(self):
+        cache = netascii.EncodedCache(1024*1024)
+        fp = open(self.path, "rb")
+        data = cache.get(self.path, fp)
+        fp.close()
+        fp = open(self.path, "rb")
+        self.assertTrue(cache.get(self.path, fp) is data)
+        fp.close()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # a changed file is encoded again
+        fp = open(self.path, "ab")
+        fp.write("more\n")
+        fp.close()
+        fp = open(self.path, "rb")
+        expected = netascii.encode_file(fp)
+        fp.seek(0)
+        self.assertEqual(cache.get(self.path, fp), expected)
+        fp.close()
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.size, len(expected))
+
+    def test_too_large_for_cache(self):
+        cache = netascii.EncodedCache(1000)
+        fp = open(self.path, "rb")
+        self.assertEqual(cache.get(self.path, fp), None)
+        fp.close()
+        self.assertEqual(cache.size, 0)
+
+
+class NetasciiTransferTest(ServerTest):
+    "Files sent as netascii, cached if no more than 8 KB"
+
+    options = {"netasciicache": 64}
+
+    def first_reply(self, filename):
+        "Requests filename as netascii with the tsize option, returns the first packet"
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(2.0)
+        self.addCleanup(sock.close)
+        sock.sendto("\x00\x01%s\x00netascii\x00tsize\x000\x00" % filename, ("127.0.0.1", self.port))
+        return sock.recvfrom(65536)[0]
+
+    def test_small(self):
+        self.write_file("small.txt", TEXT*100)
+        expected = encode(TEXT*100)
+        self.assertEqual(self.first_reply("small.txt"), "\x00\x06tsize\x00%s\x00" % len(expected))
+        self.assertEqual(rrq(self.port, "small.txt", mode="netascii"), expected)
+        # sent again from the cache
+        self.assertEqual(rrq(self.port, "small.txt", mode="netascii"), expected)
+        self.assertEqual(self.server.netascii_cache.hits, 2)
+
+    def test_large(self):
+        self.write_file("large.txt", TEXT*1000)
+        # the size is not found, reading the whole file, without an io pool
+        self.assertEqual(self.first_reply("large.txt")[:4], "\x00\x03\x00\x01")
+        self.assertEqual(rrq(self.port, "large.txt", mode="netascii"), encode(TEXT*1000))
+
+
+class PooledNetasciiTransferTest(NetasciiTransferTest):
+    "Files sent as netascii, encoded or sized in the io pool"
+
+    options = {"netasciicache": 64, "iothreads": 2}
+
+    def test_large(self):
+        self.write_file("large.txt", TEXT*1000)
+        expected = encode(TEXT*1000)
+        self.assertEqual(self.first_reply("large.txt"), "\x00\x06tsize\x00%s\x00" % len(expected))
+        self.assertEqual(rrq(self.port, "large.txt", mode="netascii"), expected)
+
+    def test_encode_path_changed(self):
+        path = os.path.join(self.root, "changed.txt")
+        self.write_file("changed.txt", TEXT)
+        stat = os.stat(path)
+        self.assertEqual(netascii.encode_path(path, stat, True), encode(TEXT))
+        self.assertEqual(netascii.encode_path(path, stat, False), len(encode(TEXT)))
+        self.write_file("changed.txt", TEXT*2)
+        self.assertEqual(netascii.encode_path(path, stat, True), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+test_netstats.py - tests the socket buffers are only sized if asked, and
+the kernel drop counts are read outside the engine thread
+"""
+
+import socket, threading, time, unittest
+
+from tftp_package import netstats
+
+from support import ServerTest
+
+
+def default_buffers():
+    "Returns the receive and send buffer sizes of a new UDP socket"
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        return netstats.set_buffers(sock, 0, 0)
+    finally:
+        sock.close()
+
+
+class BufferTest(ServerTest):
+
+    def test_system_default(self):
+        tftp_server = self.server.tftp_server
+        self.assertEqual((tftp_server.rcvbuf, tftp_server.sndbuf), default_buffers())
+        self.assertEqual((tftp_server.wanted_rcvbuf, tftp_server.wanted_sndbuf), (0, 0))
+
+
+class ExpectedClientsTest(ServerTest):
+
+    options = {"expectedclients": 64}
+
+    def test_sized(self):
+        tftp_server = self.server.tftp_server
+        self.assertEqual((tftp_server.wanted_rcvbuf, tftp_server.wanted_sndbuf), netstats.auto_buffers(64))
+        self.assertTrue(tftp_server.wanted_rcvbuf >= netstats.MIN_BUFFER)
+
+
+class DropsTest(ServerTest):
+
+    def test_read_by_thread(self):
+        threads = []
+        original = netstats.socket_queue
+        def socket_queue(sock):
+            threads.append(threading.currentThread())
+            return original(sock)
+        netstats.socket_queue = socket_queue
+        self.addCleanup(setattr, netstats, "socket_queue", original)
+        self.server._drops_check = 0.0
+        deadline = time.time() + 5.0
+        while not threads and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(threads), 1)
+        self.assertFalse(threads[0] is self.thread)
+        self.assertTrue(threads[0].getName().startswith("tftp-netstats"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+test_render.py - tests the render hooks, render.TemplateHook and
+render.ModuleHook, and files rendered by a running server
+"""
+
+import os, shutil, sys, tempfile, unittest
+
+from tftp_package import render
+
+from support import ServerTest, rrq
+
+
+class TemplateHookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, *name.split("/"))
+        fp = open(path, "wb")
+        fp.write(data)
+        fp.close()
+        return path
+
+    def test_scan(self):
+        os.mkdir(os.path.join(self.folder, "pxelinux.cfg"))
+        os.mkdir(os.path.join(self.folder, ".hidden"))
+        self.write("menu.template", "$ip")
+        self.write("pxelinux.cfg/default.template", "$iphex")
+        self.write(".hidden/secret.template", "$ip")
+        self.write("image.bin", "data")
+        hook = render.TemplateHook(self.folder)
+        # every file is passed to render until the first scan
+        self.assertTrue(hook.handles("image.bin"))
+        hook.scan()
+        self.assertEqual(hook.templates, frozenset(["menu", "pxelinux.cfg/default"]))
+        self.assertFalse(hook.handles("image.bin"))
+        self.assertEqual(hook.render("pxelinux.cfg/default", ("10.0.0.1", 2000)), "0A000001")
+        # declined if the template is not there
+        self.assertEqual(hook.render("image.bin", ("10.0.0.1", 2000)), None)
+
+    def test_root_index(self):
+        hook = render.TemplateHook(self.folder, lambda relpath: relpath == "menu.template")
+        self.assertTrue(hook.handles("menu"))
+        self.assertFalse(hook.handles("image.bin"))
+        hook.scan()
+        self.assertEqual(hook.templates, None)
+
+    def test_module_hook(self):
+        path = self.write("hook.py", "def render(filename, client_address):\n    return filename.upper()\n")
+        hook = render.ModuleHook(path)
+        self.assertTrue(hook.handles("image.bin"))
+        self.assertEqual(hook.render("image.bin", ("10.0.0.1", 2000)), "IMAGE.BIN")
+        self.assertFalse("tftpgui_renderhook" in sys.modules)
+
+    def test_module_errors(self):
+        for source in ("import sys\nsys.exit(1)\n", "def render(:\n", "x = 1\n"):
+            path = self.write("hook.py", source)
+            self.assertRaises((ImportError, SyntaxError), render.ModuleHook, path)
+
+
+class RenderTransferTest(ServerTest):
+
+    options = {"renderhook": "template"}
+
+    def test_rendered(self):
+        self.write_file("menu.template", "client $ip")
+        self.write_file("image.bin", "data")
+        self.assertEqual(rrq(self.port, "menu"), "client 127.0.0.1")
+        self.assertEqual(rrq(self.port, "image.bin"), "data")
+
+
+if __name__ == "__main__":
+    unittest.main()
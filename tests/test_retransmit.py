@@ -0,0 +1,65 @@
+"""
+test_retransmit.py - tests duplicate acknowledgements are never answered
+by sending the data again each time, and the fastretransmit option
+"""
+
+import socket, unittest
+
+from support import ServerTest
+
+
+class DuplicateTest(ServerTest):
+
+    def start_transfer(self):
+        """Requests a file, acknowledges the first block, and returns the
+           socket, the server address and the second block"""
+        self.write_file("image.bin", "x"*2000)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(2.0)
+        self.addCleanup(sock.close)
+        sock.sendto("\x00\x01image.bin\x00octet\x00", ("127.0.0.1", self.port))
+        data, address = sock.recvfrom(65536)
+        self.assertEqual(data[:4], "\x00\x03\x00\x01")
+        sock.sendto("\x00\x04\x00\x01", address)
+        data, address = sock.recvfrom(65536)
+        self.assertEqual(data[:4], "\x00\x03\x00\x02")
+        return sock, address
+
+    def received(self, sock):
+        "Returns the packets received within 0.2 seconds, less than the TTL"
+        packets = []
+        sock.settimeout(0.2)
+        try:
+            while True:
+                packets.append(sock.recvfrom(65536)[0])
+        except socket.timeout:
+            return packets
+
+    def test_duplicate_ack_ignored(self):
+        sock, address = self.start_transfer()
+        sock.sendto("\x00\x04\x00\x01", address)
+        sock.sendto("\x00\x04\x00\x01", address)
+        self.assertEqual(self.received(sock), [])
+        self.assertEqual(self.server.counters["duplicate_acks"], 2)
+        self.assertEqual(self.server.counters["fast_retransmits"], 0)
+
+
+class FastRetransmitTest(DuplicateTest):
+
+    options = {"fastretransmit": 1}
+
+    def test_duplicate_ack_ignored(self):
+        pass
+
+    def test_sent_again_once(self):
+        sock, address = self.start_transfer()
+        sock.sendto("\x00\x04\x00\x01", address)
+        sock.sendto("\x00\x04\x00\x01", address)
+        packets = self.received(sock)
+        # the second block is sent again at once, only once
+        self.assertEqual([packet[:4] for packet in packets], ["\x00\x03\x00\x02"])
+        self.assertEqual(self.server.counters["fast_retransmits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+test_snapshot.py - tests the state, version and snapshot of the transfers
+in progress, published by the engine thread for the gui and other threads
+"""
+
+import shutil, socket, sys, tempfile, threading, time, unittest
+
+from tftp_package import tftp_engine, tftpcfg
+
+from support import ServerTest
+
+
+def wait_for(test, timeout=5.0):
+    "Waits up to timeout seconds for test() to return True, returns its result"
+    deadline = time.time() + timeout
+    while not test() and time.time() < deadline:
+        time.sleep(0.01)
+    return test()
+
+
+class SnapshotTest(ServerTest):
+
+    def start_transfer(self):
+        "Requests a file, without acknowledging it, so the transfer stays in progress"
+        self.write_file("image.bin", "x"*2000)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(2.0)
+        self.addCleanup(sock.close)
+        sock.sendto("\x00\x01image.bin\x00octet\x00", ("127.0.0.1", self.port))
+        sock.recvfrom(65536)
+        return sock
+
+    def test_idle_version_unchanged(self):
+        version = self.server.state[0]
+        time.sleep(tftp_engine.SNAPSHOT_INTERVAL*2)
+        self.assertEqual(self.server.state, (version, ()))
+
+    def test_transfer_published(self):
+        version = self.server.state[0]
+        sock = self.start_transfer()
+        self.assertTrue(wait_for(lambda: self.server.state[1]))
+        self.assertTrue(self.server.state[0] > version)
+        # published as tuples, which the engine never alters
+        snapshot = self.server.state[1]
+        self.assertTrue(isinstance(snapshot, tuple))
+        self.assertTrue(isinstance(snapshot[0], tuple))
+        transfers = self.server.get_snapshot()
+        self.assertEqual(len(transfers), 1)
+        self.assertEqual(transfers[0]["filename"], "image.bin")
+        self.assertEqual(transfers[0]["size"], 2000)
+        self.assertFalse(transfers[0]["upload"])
+        self.assertEqual(transfers[0]["client"][1], sock.getsockname()[1])
+
+    def test_stopped_empty(self):
+        self.start_transfer()
+        self.assertTrue(wait_for(lambda: self.server.state[1]))
+        self.running = False
+        self.thread.join(5.0)
+        self.server.stop_serving()
+        self.assertEqual(self.server.state[1], ())
+        self.assertEqual(self.server.get_snapshot(), [])
+
+
+class PublishTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        cfgdict = tftpcfg.get_defaults()
+        cfgdict.update(tftprootfolder=self.folder, logfolder=self.folder, listenipaddress="127.0.0.1")
+        self.server = tftp_engine.ServerState(**cfgdict)
+        self.interval = sys.getcheckinterval()
+        # switch threads as often as possible
+        sys.setcheckinterval(1)
+
+    def tearDown(self):
+        sys.setcheckinterval(self.interval)
+        # the connections stood for by FakeConnection are not shut down
+        self.server.__dict__.pop("get_connections_list", None)
+        self.server.shutdown()
+        shutil.rmtree(self.folder, True)
+
+    def test_set_by_gui_thread(self):
+        connections = []
+        self.server.get_connections_list = lambda: connections
+        def gui():
+            for count in range(20000):
+                self.server.text = str(count)
+        version = self.server.version
+        thread = threading.Thread(target=gui)
+        thread.start()
+        # as the engine thread publishes a new snapshot
+        for count in range(20000):
+            connections[:] = [FakeConnection(count)]
+            self.server.take_snapshot()
+        thread.join()
+        # each change has its own version, published with the last snapshot
+        self.assertEqual(self.server.version, version + 40000)
+        self.assertEqual(self.server.state, (version + 40000, (FakeConnection(19999).row(),)))
+
+
+class FakeConnection(object):
+    "Stands for a transfer in progress, whose filename is its number"
+
+    def __init__(self, number):
+        self.rx_addr = ("127.0.0.1", 2000)
+        self.filename = str(number)
+        self.blksize = 512
+        self.start_time = 0.0
+        self.retransmits = 0
+
+    def bytes_transferred(self):
+        return 0
+
+    def transfer_size(self):
+        return None
+
+    def row(self):
+        return (self.rx_addr, self.filename, False, 0, None, 512, 0.0, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
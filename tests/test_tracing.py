@@ -0,0 +1,67 @@
+"""
+test_tracing.py - tests the latency histograms, tracing.Histogram, and
+their report as the server stops
+"""
+
+import os, unittest
+
+from tftp_package import tracing
+
+from support import ServerTest, rrq
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = tracing.Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        self.assertEqual(histogram.count, 100000)
+        self.assertEqual(histogram.max, 100000)
+        self.assertEqual(histogram.mean(), 50000)
+        # within 1/32 of the value, the resolution of the buckets
+        for percent in (1, 50, 90, 99):
+            value = 1000*percent
+            self.assertTrue(abs(histogram.percentile(percent) - value) <= value/32)
+        self.assertEqual(histogram.percentile(100), 100000)
+
+    def test_small_values_exact(self):
+        histogram = tracing.Histogram()
+        for value in (3, 1, 2, -5):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(25), 0)
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(100), 3)
+
+    def test_empty(self):
+        histogram = tracing.Histogram()
+        self.assertEqual(histogram.percentile(50), 0)
+        self.assertEqual(histogram.mean(), 0)
+
+
+class ReportTest(ServerTest):
+
+    options = {"latency": True}
+
+    def test_reported_once(self):
+        self.write_file("image.bin", os.urandom(2000))
+        rrq(self.port, "image.bin")
+        self.running = False
+        self.thread.join(5.0)
+        lines = []
+        add_text = self.server.add_text
+        def record(text_line, clear=False):
+            lines.append(text_line)
+            add_text(text_line, clear)
+        self.server.add_text = record
+        self.server.serving = False
+        self.server.stop_serving()
+        # stop_serving is called again by shutdown
+        self.server.shutdown()
+        reports = [line for line in lines if line.startswith("Latency")]
+        self.assertTrue(reports)
+        self.assertEqual(len(reports), len(set(reports)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+test_transfers.py - tests files are sent and received by a running server
+"""
+
+import os, socket, threading, unittest
+
+from support import ServerTest, TFTPError, rrq, wrq
+
+
+class TransferTest(ServerTest):
+
+    def test_download(self):
+        data = os.urandom(5000)
+        self.write_file("image.bin", data)
+        self.assertEqual(rrq(self.port, "image.bin"), data)
+
+    def test_download_blksize(self):
+        data = os.urandom(3*1024)
+        self.write_file("image.bin", data)
+        self.assertEqual(rrq(self.port, "image.bin", blksize=1024), data)
+
+    def test_not_found(self):
+        self.assertRaises(TFTPError, rrq, self.port, "missing.bin")
+
+    def test_upload(self):
+        data = os.urandom(2000)
+        self.assertEqual(wrq(self.port, "upload.bin", data), "OK")
+        fp = open(os.path.join(self.root, "upload.bin"), "rb")
+        try:
+            self.assertEqual(fp.read(), data)
+        finally:
+            fp.close()
+
+    def test_upload_tsize_too_large(self):
+        # the client claims a size far beyond what it sends, or the disc holds
+        data = os.urandom(1500)
+        self.assertEqual(wrq(self.port, "upload.bin", data, tsize=10**15), "OK")
+        self.assertEqual(os.path.getsize(os.path.join(self.root, "upload.bin")), 1500)
+
+    def test_subfolder_refused(self):
+        # subfolders are off by default, so the request is dropped
+        self.make_folder("pxelinux.cfg")
+        self.write_file("pxelinux.cfg/default", "default linux")
+        self.assertRaises(socket.timeout, rrq, self.port, "pxelinux.cfg/default", timeout=0.5)
+
+
+class TunedTransferTest(TransferTest):
+    "The same transfers, with the optional features turned on"
+
+    options = {"writebehind": True, "fsyncpolicy": "group", "decompress": True,
+               "subfolders": True, "rootindex": True, "inotify": True,
+               "misscache": 4096, "filecache": 64, "iothreads": 4,
+               "packetcache": 1024}
+
+    def test_subfolder_refused(self):
+        pass
+
+    def test_subfolder(self):
+        self.make_folder("pxelinux.cfg")
+        self.write_file("pxelinux.cfg/default", "default linux")
+        self.assertEqual(rrq(self.port, "pxelinux.cfg/default"), "default linux")
+
+
+class ConcurrentTransferTest(ServerTest):
+    "Transfers served at the same time, each in turn"
+
+    def test_concurrent_downloads(self):
+        files = {}
+        for size in (100, 30000, 600, 70000):
+            name = "file%s.bin" % size
+            files[name] = os.urandom(size)
+            self.write_file(name, files[name])
+        results = {}
+        def download(name):
+            results[name] = rrq(self.port, name)
+        threads = [threading.Thread(target=download, args=(name,)) for name in files]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10.0)
+        self.assertEqual(results, files)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+####### TFTPgui #######
+#
+# capture.py  - records the packets received by TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+capture.py - records every packet received, to be replayed later
+
+If the capturefile option is set, each packet read from a listening
+socket is appended to the capture file, with the time it arrived, the
+port it arrived on, and the client's address, so the traffic of a busy
+morning can be replayed against another build, see replay.py.
+
+The file starts with MAGIC, followed by a record for each packet: a
+header of RECORD, (time as a double, listen port, client ip address as
+four bytes, client port, length), then the packet.
+
+Provides class:
+CaptureWriter
+
+and function:
+read_capture(path) - yields (time, listen port, client address, packet)
+"""
+
+import os, socket, struct, time
+
+
+# the first bytes of a capture file
+MAGIC = "TFTPCAP1"
+
+# the header of each packet recorded
+RECORD = struct.Struct("!dH4sHH")
+
+
+class CaptureWriter(object):
+    """Appends the packets received to the file at path, until the file
+       reaches maxbytes. Used only by the engine thread, the file is
+       buffered, so is written in large writes"""
+
+    def __init__(self, path, maxbytes):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.fp = open(path, "ab", 65536)
+        self.size = self.fp.tell()
+        if not self.size:
+            self.fp.write(MAGIC)
+            self.size = len(MAGIC)
+        # set once the file has reached maxbytes
+        self.full = False
+
+    def record(self, listen_port, rx_addr, rx_data):
+        "Records rx_data, received from rx_addr on listen_port"
+        if self.full or self.fp is None:
+            return
+        header = RECORD.pack(time.time(), listen_port, socket.inet_aton(rx_addr[0]), rx_addr[1], len(rx_data))
+        try:
+            self.fp.write(header + rx_data)
+        except IOError:
+            # the disc is full, stop capturing
+            self.full = True
+            return
+        self.size += len(header) + len(rx_data)
+        if self.size >= self.maxbytes:
+            self.full = True
+            self.flush()
+
+    def flush(self):
+        if self.fp is not None:
+            try:
+                self.fp.flush()
+            except IOError:
+                self.full = True
+
+    def close(self):
+        if self.fp is not None:
+            self.flush()
+            self.fp.close()
+            self.fp = None
+
+
+def read_capture(path):
+    """Yields (time, listen port, (ip address, port), packet) for each packet
+       in the capture file at path, raises ValueError if it is not one.
+       A packet cut short, as the file was being written, is ignored"""
+    fp = open(path, "rb")
+    try:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a TFTPgui capture file" % path)
+        while True:
+            header = fp.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            when, listen_port, ip, port, length = RECORD.unpack(header)
+            packet = fp.read(length)
+            if len(packet) < length:
+                return
+            yield when, listen_port, (socket.inet_ntoa(ip), port), packet
+    finally:
+        fp.close()
@@ -0,0 +1,433 @@
+####### TFTPgui #######
+#
+# compressed.py  - serves compressed files for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+compressed.py - serves a file from a gzip or xz compressed copy
+
+If a client requests 'name', and only 'name.gz' or 'name.xz' exists,
+the compressed file is decompressed as the blocks are requested.
+
+Decompressed data is held in chunks in a ChunkCache shared by all
+readers, so clients fetching the same file at around the same time
+share the work of decompressing it.
+
+Data is decompressed a chunk at a time, never more, so a small file
+which decompresses to a huge size cannot fill the memory.
+
+The decompressed size cannot be known without decompressing the whole
+file, so once a file has been fully decompressed its size is recorded
+in an index file, SIZEINDEX in the log folder, from which the tsize
+option is answered for later requests.
+
+xz files need the lzma module, in Python 2 this is the optional
+backports.lzma package, without it only gzip files are served.
+
+Provides function:
+find_compressed(filepath) - returns a compressed copy of filepath
+
+and classes:
+ChunkCache - decompressed chunks of files, shared by all readers
+DecompressedReader - reads the decompressed file
+SizeIndex - the decompressed sizes of compressed files
+"""
+
+import os, zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# Size of each decompressed chunk held in the cache
+CHUNKSIZE = 262144
+
+# Compressed data is read this many bytes at a time
+READSIZE = 65536
+
+# Bytes of xz data decompressed at a time, where the lzma module cannot
+# limit the bytes it returns, which bounds the memory used to a few MB
+XZ_PIECE = 256
+
+# Name of the file in the log folder holding decompressed sizes
+SIZEINDEX = "tftpgui-sizes"
+
+
+class _GzipDecompressor(object):
+    """Decompresses the gzip format, of one or more members, returning
+       no more than max_length bytes at a time. needs_input is True
+       once all the data given has been decompressed"""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # compressed data given, but not yet decompressed
+        self._tail = ""
+        self.needs_input = True
+
+    def decompress(self, data, max_length):
+        "Returns up to max_length bytes decompressed from data, and any given before"
+        data = self._tail + data
+        result = self._decompressor.decompress(data, max_length)
+        self._tail = self._decompressor.unconsumed_tail
+        if self._decompressor.unused_data:
+            # gzip files may hold several members, one after the other
+            self._tail = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # if max_length bytes were returned, more may be held in the decompressor
+        self.needs_input = not self._tail and len(result) < max_length
+        return result
+
+
+class _XzDecompressor(object):
+    """Decompresses the xz format, as _GzipDecompressor. Where the lzma
+       module has no max_length, the data is decompressed XZ_PIECE bytes
+       at a time, so more than max_length bytes may be returned"""
+
+    def __init__(self):
+        self._decompressor = lzma.LZMADecompressor()
+        self._limited = hasattr(self._decompressor, "needs_input")
+        self._tail = ""
+        self.needs_input = True
+
+    def decompress(self, data, max_length):
+        "Returns bytes decompressed from data, and any given before"
+        if self._limited:
+            result = self._decompressor.decompress(data, max_length)
+            self.needs_input = self._decompressor.needs_input
+            return result
+        data = self._tail + data
+        self._tail = data[XZ_PIECE:]
+        self.needs_input = not self._tail
+        return self._decompressor.decompress(data[:XZ_PIECE])
+
+# suffix : function returning a new decompressor, in order of preference
+DECOMPRESSORS = [(".gz", _GzipDecompressor)]
+if lzma is not None:
+    DECOMPRESSORS.append((".xz", _XzDecompressor))
+
+
+def find_compressed(filepath, isfile=os.path.isfile):
+    """Returns the path of a compressed copy of filepath,
+       or None if there is none, isfile is the function used to
+       test if a path is a file"""
+    for suffix, decompressor in DECOMPRESSORS:
+        if isfile(filepath + suffix):
+            return filepath + suffix
+    return None
+
+
+def _new_decompressor(path):
+    "Returns a decompressor for the compressed file path"
+    for suffix, decompressor in DECOMPRESSORS:
+        if path.endswith(suffix):
+            return decompressor()
+    raise ValueError("Not a compressed file")
+
+
+class SizeIndex(object):
+    """The decompressed sizes of compressed files, held in the file path,
+       or only in memory if path is None. Each line of the file is
+       file path, size, modification time, decompressed size
+       separated by tabs. An entry is only used if the size and
+       modification time of the compressed file are unchanged"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        if path is None:
+            return
+        try:
+            fp = open(self.path, "r")
+            try:
+                for line in fp:
+                    parts = line.rstrip("\n").rsplit("\t", 3)
+                    if len(parts) == 4:
+                        self._entries[parts[0]] = (int(parts[1]), parts[2], int(parts[3]))
+            finally:
+                fp.close()
+        except (IOError, ValueError):
+            # No index, or unreadable, start with an empty one
+            pass
+
+    def lookup(self, filepath, stat):
+        "Returns the decompressed size of filepath, or None if unknown"
+        entry = self._entries.get(filepath)
+        if entry is None or entry[:2] != (stat.st_size, repr(stat.st_mtime)):
+            return None
+        return entry[2]
+
+    def record(self, filepath, stat, size):
+        "Records the decompressed size of filepath, and saves the index"
+        if "\n" in filepath:
+            return
+        self._entries[filepath] = (stat.st_size, repr(stat.st_mtime), size)
+        if self.path is None:
+            return
+        temppath = self.path + ".new"
+        try:
+            fp = open(temppath, "w")
+            try:
+                for key, entry in self._entries.items():
+                    fp.write("%s\t%s\t%s\t%s\n" % (key, entry[0], entry[1], entry[2]))
+            finally:
+                fp.close()
+            if os.name == "nt" and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(temppath, self.path)
+        except (IOError, OSError):
+            # the index is only an aid, failing to save it is not an error
+            pass
+
+
+class _Decompression(object):
+    """The decompression of one version of a compressed file, shared
+       by all its readers, producing chunks into the ChunkCache"""
+
+    def __init__(self, cache, path, stat, size):
+        self.cache = cache
+        self.path = path
+        self.key = (path, stat.st_size, stat.st_mtime, stat.st_ino)
+        self.stat = stat
+        # decompressed size, None until known
+        self.size = size
+        self.fp = None
+        # a _GzipDecompressor or _XzDecompressor
+        self.decompressor = None
+        # number of whole chunks produced by the current decompressor
+        self.produced = 0
+        self._pending = ""
+        # the last chunk produced, kept even if the cache has no room
+        self._last = (None, "")
+        # number of open DecompressedReaders
+        self.readers = 0
+
+    def _restart(self):
+        "Start decompressing from the beginning of the file"
+        if self.fp is None:
+            self.fp = open(self.path, "rb")
+        self.fp.seek(0)
+        self.decompressor = _new_decompressor(self.path)
+        self.produced = 0
+        self._pending = ""
+
+    def chunk(self, index):
+        """Returns decompressed chunk index, which is shorter than
+           CHUNKSIZE only for the last chunk, or empty beyond the end"""
+        if self.size is not None and index*CHUNKSIZE >= self.size:
+            return ""
+        if self._last[0] == index:
+            return self._last[1]
+        data = self.cache.get((self.key, index))
+        if data is not None:
+            return data
+        self.cache.misses += 1
+        if self.decompressor is None or index < self.produced:
+            # the chunk has been dropped from the cache, start again
+            self._restart()
+        while True:
+            data = self._next_chunk()
+            if data is None:
+                return ""
+            self.cache.put((self.key, self.produced-1), data)
+            self._last = (self.produced-1, data)
+            if self.produced-1 == index:
+                return data
+
+    def _next_chunk(self):
+        "Decompress the next chunk, returns None at the end of the file"
+        while len(self._pending) < CHUNKSIZE:
+            compressed = ""
+            if self.decompressor.needs_input:
+                compressed = self.fp.read(READSIZE)
+                if not compressed:
+                    break
+            # only as much as the chunk needs, however much data expands
+            self._pending += self.decompressor.decompress(compressed, CHUNKSIZE - len(self._pending))
+        data = self._pending[:CHUNKSIZE]
+        self._pending = self._pending[CHUNKSIZE:]
+        if len(data) < CHUNKSIZE:
+            # the end of the file, so the size is now known
+            size = self.produced*CHUNKSIZE + len(data)
+            if self.size is None:
+                self.size = size
+                self.cache.record_size(self.path, self.stat, size)
+            self.fp.close()
+            self.fp = None
+            self.decompressor = None
+            if not data:
+                return None
+        self.produced += 1
+        return data
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+class ChunkCache(object):
+    """Decompressed chunks of compressed files, up to maxbytes, discarding
+       the least recently used. Also holds the _Decompression of each file
+       currently being read, so readers of the same file share it, closed
+       and dropped when its last reader is closed"""
+
+    def __init__(self, maxbytes, indexpath=None):
+        self.maxbytes = maxbytes
+        self.size = 0
+        # dictionary of (decompression key, chunk index) : chunk
+        self._chunks = {}
+        # list of chunk keys, least recently used first
+        self._order = []
+        # dictionary of path : _Decompression, of the files being read
+        self._decompressions = {}
+        # the SizeIndex of the decompressed sizes, saved to indexpath
+        self.index = SizeIndex(indexpath)
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, path, stat=None):
+        """Returns a DecompressedReader of the compressed file path,
+           stat is the result of os.stat(path), if already known"""
+        if stat is None:
+            stat = os.stat(path)
+        decompression = self._decompressions.get(path)
+        if decompression is None or decompression.stat.st_mtime != stat.st_mtime \
+                or decompression.stat.st_size != stat.st_size \
+                or decompression.stat.st_ino != stat.st_ino:
+            size = self.index.lookup(path, stat)
+            decompression = _Decompression(self, path, stat, size)
+            self._decompressions[path] = decompression
+        decompression.readers += 1
+        return DecompressedReader(decompression)
+
+    def release(self, decompression):
+        """Called as a reader of decompression is closed, which is closed
+           and dropped once it has no readers, its chunks are kept"""
+        decompression.readers -= 1
+        if decompression.readers > 0:
+            return
+        decompression.close()
+        if self._decompressions.get(decompression.path) is decompression:
+            del self._decompressions[decompression.path]
+
+    def set_index(self, indexpath):
+        "Saves the decompressed sizes to indexpath, None to hold them only in memory"
+        if indexpath != self.index.path:
+            self.index = SizeIndex(indexpath)
+
+    def record_size(self, path, stat, size):
+        "Records the decompressed size of path in the index"
+        self.index.record(path, stat, size)
+
+    def get(self, key):
+        "Returns the chunk with key, or None if not held"
+        data = self._chunks.get(key)
+        if data is not None:
+            self.hits += 1
+            self._order.remove(key)
+            self._order.append(key)
+        return data
+
+    def put(self, key, data):
+        "Adds a chunk to the cache"
+        if key in self._chunks or len(data) > self.maxbytes:
+            return
+        self._chunks[key] = data
+        self._order.append(key)
+        self.size += len(data)
+        while self.size > self.maxbytes:
+            oldest = self._order.pop(0)
+            self.size -= len(self._chunks.pop(oldest))
+
+    def discard(self, path):
+        "Removes any chunks and decompression of path"
+        decompression = self._decompressions.pop(path, None)
+        if decompression is not None:
+            decompression.close()
+        for key in [key for key in self._order if key[0][0] == path]:
+            self._order.remove(key)
+            self.size -= len(self._chunks.pop(key))
+
+    def clear(self):
+        "Empties the cache"
+        for decompression in self._decompressions.values():
+            decompression.close()
+        self._decompressions = {}
+        self._chunks = {}
+        self._order = []
+        self.size = 0
+
+
+class DecompressedReader(object):
+    """A file like object reading a decompressed file,
+       from chunks shared with other readers"""
+
+    def __init__(self, decompression):
+        self.decompression = decompression
+        self.position = 0
+        # the chunk currently being read, as (index, data)
+        self._chunk = (None, "")
+
+    def get_size(self):
+        "The decompressed size, or None if not yet known"
+        return self.decompression.size
+
+    size = property(get_size)
+
+    def read(self, size):
+        "Returns up to size bytes, fewer only at the end of the file"
+        parts = []
+        wanted = size
+        while wanted > 0:
+            index, offset = divmod(self.position, CHUNKSIZE)
+            if self._chunk[0] != index:
+                self._chunk = (index, self.decompression.chunk(index))
+            data = self._chunk[1][offset:offset+wanted]
+            if not data:
+                break
+            parts.append(data)
+            wanted -= len(data)
+            self.position += len(data)
+        return "".join(parts)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.position = position
+
+    def close(self):
+        # the decompression is shared, and only closed with its last reader
+        if self.decompression is not None:
+            self.decompression.cache.release(self.decompression)
+        self.decompression = None
+        self._chunk = (None, "")
@@ -0,0 +1,145 @@
+####### TFTPgui #######
+#
+# events.py  - events published by the TFTPgui engine
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+events.py - events published by the engine to the programs embedding it
+
+A program running the server in-process, with ServerState.start_thread(),
+learns of each transfer by subscribing to its events with
+ServerState.subscribe(), rather than reading the status text:
+
+admitted - a request has been accepted, and a transfer started
+progress - a transfer is in progress, published every PROGRESS_INTERVAL
+           seconds for each transfer
+completed - a transfer has completed
+failed - a transfer has failed, or a file requested was not found,
+         the outcome is one of journal.OUTCOMES other than "ok"
+
+A Subscription either queues the events, to be read by another thread
+with get(), or calls a callback with each event, in the engine thread,
+which must return quickly. If the queue is full, events are dropped
+and counted, so a slow reader never holds up the engine.
+
+Provides classes:
+Event
+Subscription
+"""
+
+import time, Queue
+
+
+# the kinds of event
+EVENTS = ("admitted", "progress", "completed", "failed")
+
+# seconds between the progress events of each transfer
+PROGRESS_INTERVAL = 1.0
+
+# the events a Subscription queues, by default, before dropping them
+QUEUE_SIZE = 10000
+
+
+class Event(object):
+    """An event of kind, one of EVENTS, in a transfer with client, the
+       (ip address, port) of the client, of the listener named listener.
+       upload is True if the client is sending the file, bytes are the
+       bytes transferred so far, size the size of the file, if known,
+       otherwise None, duration the seconds since the request, retransmits
+       the packets sent again, and outcome, once completed or failed, one
+       of journal.OUTCOMES, otherwise None"""
+
+    def __init__(self, kind, listener, client, filename, upload, bytes=0, size=None,
+                 duration=0.0, retransmits=0, outcome=None):
+        self.kind = kind
+        self.time = time.time()
+        self.listener = listener
+        self.client = client
+        self.filename = filename
+        self.upload = upload
+        self.bytes = bytes
+        self.size = size
+        self.duration = duration
+        self.retransmits = retransmits
+        self.outcome = outcome
+
+    def __repr__(self):
+        return "<Event %s %s %s:%s %s bytes>" % (self.kind, self.filename, self.client[0],
+                                                 self.client[1], self.bytes)
+
+
+class Subscription(object):
+    """Receives the events of the kinds given, all if None, from a ServerState.
+       If callback is given, it is called with each event in the engine thread,
+       otherwise the events are queued, up to maxsize, for get()"""
+
+    def __init__(self, kinds=None, callback=None, maxsize=QUEUE_SIZE):
+        if kinds is not None:
+            kinds = frozenset(kinds)
+            for kind in kinds:
+                if kind not in EVENTS:
+                    raise ValueError("Unknown event %s" % kind)
+        self.kinds = kinds
+        self.callback = callback
+        self.queue = None
+        if callback is None:
+            self.queue = Queue.Queue(maxsize)
+        # the events dropped as the queue was full
+        self.dropped = 0
+
+    def wants(self, kind):
+        "Returns True if events of kind are subscribed to"
+        return self.kinds is None or kind in self.kinds
+
+    def deliver(self, event):
+        "Called by the engine thread with each event published"
+        if self.kinds is not None and event.kind not in self.kinds:
+            return
+        if self.callback is not None:
+            self.callback(event)
+            return
+        try:
+            self.queue.put_nowait(event)
+        except Queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        """Returns the next event queued, waiting up to timeout seconds,
+           for ever if None, returns None if none arrives"""
+        try:
+            return self.queue.get(True, timeout)
+        except Queue.Empty:
+            return None
+
+    def get_all(self):
+        "Returns a list of the events queued, without waiting"
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except Queue.Empty:
+                return events
@@ -0,0 +1,301 @@
+####### TFTPgui #######
+#
+# filecache.py  - keeps recently served files open for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+filecache.py - keeps the files most recently served open
+
+Opening a file resolves its path, which on a network share may be a
+round trip to the server, so an OpenFileCache keeps a descriptor for
+each recently served file open, with the result of its last stat.
+
+Every client reading a file shares its descriptor, each reads through
+its own SharedReader, which holds its own position and reads at that
+position, so the readers do not disturb each other.
+
+Files are read in chunks of chunksize bytes, aligned to the chunk size,
+and each block sent is a slice of the chunk. The most recent chunk of
+each file is held by the file, so clients reading the same part of a
+file at around the same time share it. The kernel is told the file is
+read sequentially, and asked to start reading each next chunk from disc
+while the current one is being sent.
+
+A file is checked with os.stat again once its stat is more than ttl
+seconds old, and if it has been replaced or changed, it is opened
+again. Clients already reading the old file carry on reading it.
+
+The cache is used by the engine thread, except for prepare(), which
+does the part of opening a file which may wait on the disc, so it can
+be called in another thread. Given a fileio.ThreadPool, descriptors
+are also closed in it.
+
+Provides classes:
+OpenFileCache
+SharedReader
+"""
+
+import os, time
+
+from tftp_package import fileio
+
+
+# flags used to open files, files are read in binary mode
+_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_BINARY", 0)
+
+
+def _version(st):
+    "The details of a stat result which change if the file is changed or replaced"
+    return (st.st_size, st.st_mtime, st.st_ino, st.st_dev)
+
+
+class _OpenFile(object):
+    """An open descriptor of a file, closed when it has been
+       removed from the cache, and its last reader is closed"""
+
+    def __init__(self, path, closer=os.close):
+        self.path = path
+        # the function used to close the descriptor
+        self.closer = closer
+        self.fd = os.open(path, _OPEN_FLAGS)
+        try:
+            self.stat = os.fstat(self.fd)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.version = _version(self.stat)
+        # time the stat was last checked
+        self.checked = time.time()
+        # number of open SharedReaders
+        self.readers = 0
+        # False once removed from the cache
+        self.cached = True
+        # the chunk most recently read by any reader, as (offset, data)
+        self.chunk = (None, "")
+        fileio.fadvise(self.fd, 0, 0, fileio.POSIX_FADV_SEQUENTIAL)
+
+    def release(self):
+        "Called when a reader is closed"
+        self.readers -= 1
+        self._close_if_unused()
+
+    def uncache(self):
+        "Called when removed from the cache"
+        self.cached = False
+        self._close_if_unused()
+
+    def _close_if_unused(self):
+        if self.fd is not None and not self.cached and self.readers <= 0:
+            self.closer(self.fd)
+            self.fd = None
+            self.chunk = (None, "")
+
+    def read_chunk(self, offset, chunksize):
+        "Returns chunksize bytes from offset, fewer only at the end of the file"
+        if self.chunk[0] == offset:
+            return self.chunk[1]
+        os.lseek(self.fd, offset, os.SEEK_SET)
+        parts = []
+        wanted = chunksize
+        while wanted > 0:
+            part = os.read(self.fd, wanted)
+            if not part:
+                break
+            parts.append(part)
+            wanted -= len(part)
+        data = "".join(parts)
+        if len(data) == chunksize:
+            # start the next chunk being read from disc
+            fileio.fadvise(self.fd, offset+chunksize, chunksize, fileio.POSIX_FADV_WILLNEED)
+        self.chunk = (offset, data)
+        return data
+
+
+class OpenFileCache(object):
+    """Keeps up to maxfiles files open, closing the least recently used,
+       each is checked with os.stat if its stat is more than ttl seconds old.
+       Files are read chunksize bytes at a time, and if pool is given,
+       a fileio.ThreadPool, descriptors are closed by it"""
+
+    def __init__(self, maxfiles, ttl, chunksize=262144, pool=None):
+        self.maxfiles = maxfiles
+        self.ttl = ttl
+        self.chunksize = chunksize
+        self.pool = pool
+        # dictionary of path : _OpenFile
+        self._files = {}
+        # list of paths, least recently used first
+        self._order = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    def close_fd(self, fd):
+        "Closes the descriptor fd, in the pool if there is one"
+        if self.pool is not None:
+            self.pool.submit(os.close, fd)
+        else:
+            os.close(fd)
+
+    def prepare(self, path):
+        """Does the part of open(path) which may wait on the disc, and may
+           be called in another thread. Returns a newly opened file, or None
+           if the file held is current, to be passed to open()"""
+        openfile = self._files.get(path)
+        if openfile is not None:
+            if time.time() - openfile.checked <= self.ttl:
+                return None
+            try:
+                current = _version(os.stat(path))
+            except OSError:
+                current = None
+            if current == openfile.version:
+                openfile.checked = time.time()
+                return None
+        return _OpenFile(path, self.close_fd)
+
+    def release_prepared(self, openfile):
+        "Closes a file returned by prepare(), which is no longer wanted"
+        if openfile is not None:
+            openfile.uncache()
+
+    def open(self, path, prepared=None):
+        """Returns a SharedReader of path, raises OSError if it cannot be opened,
+           prepared is the result of prepare(path), if it has been called"""
+        if prepared is not None:
+            # replaces any file held
+            self.discard(path)
+            self.misses += 1
+            self._files[path] = prepared
+            self._order.append(path)
+            while len(self._order) > self.maxfiles:
+                self.discard(self._order[0])
+            return SharedReader(prepared, self.chunksize)
+        openfile = self._files.get(path)
+        if openfile is not None:
+            now = time.time()
+            if now - openfile.checked > self.ttl:
+                try:
+                    current = _version(os.stat(path))
+                except OSError:
+                    current = None
+                if current == openfile.version:
+                    openfile.checked = now
+                else:
+                    # changed or replaced, so open it again
+                    self.discard(path)
+                    openfile = None
+        if openfile is None:
+            self.misses += 1
+            openfile = _OpenFile(path, self.close_fd)
+            self._files[path] = openfile
+        else:
+            self.hits += 1
+            self._order.remove(path)
+        self._order.append(path)
+        while len(self._order) > self.maxfiles:
+            self.discard(self._order[0])
+        return SharedReader(openfile, self.chunksize)
+
+    def discard(self, path):
+        "Removes path, which is closed once no longer read"
+        openfile = self._files.pop(path, None)
+        if openfile is not None:
+            self._order.remove(path)
+            openfile.uncache()
+
+    def fresh(self, path):
+        "Returns True if path is open, and its stat is no more than ttl seconds old"
+        openfile = self._files.get(path)
+        return openfile is not None and time.time() - openfile.checked <= self.ttl
+
+    def clear(self):
+        "Removes every file"
+        for path in self._order[:]:
+            self.discard(path)
+
+
+class SharedReader(object):
+    """A file like object reading from a descriptor shared with other
+       readers, each read is made at the reader's own position, and
+       is sliced from a chunk of chunksize bytes"""
+
+    def __init__(self, openfile, chunksize):
+        self.openfile = openfile
+        openfile.readers += 1
+        self.chunksize = chunksize
+        # the stat of the file when opened
+        self.stat = openfile.stat
+        self.size = openfile.stat.st_size
+        self.position = 0
+        # the chunk being read, as (offset, data)
+        self._chunk = (None, "")
+
+    def read(self, size=-1):
+        """Returns up to size bytes from the current position,
+           or if size is negative, the rest of the file"""
+        if size < 0:
+            size = max(os.fstat(self.openfile.fd).st_size - self.position, 0)
+        offset, data = self._chunk
+        start = self.position - (offset or 0)
+        if offset is not None and start >= 0 and start + size <= len(data):
+            # the usual case, the block is within the current chunk
+            self.position += size
+            return data[start:start+size]
+        parts = []
+        wanted = size
+        while wanted > 0:
+            offset = self.position - self.position % self.chunksize
+            if self._chunk[0] != offset:
+                # Python 2 has no os.pread, the descriptor is only used by the
+                # engine thread, so seeking before the read is equivalent
+                self._chunk = (offset, self.openfile.read_chunk(offset, self.chunksize))
+            start = self.position - offset
+            data = self._chunk[1][start:start+wanted]
+            if not data:
+                break
+            parts.append(data)
+            wanted -= len(data)
+            self.position += len(data)
+        return "".join(parts)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.position = position
+
+    def fileno(self):
+        return self.openfile.fd
+
+    def close(self):
+        if self.openfile is not None:
+            self.openfile.release()
+            self.openfile = None
+            self._chunk = (None, "")
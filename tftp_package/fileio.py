@@ -0,0 +1,514 @@
+####### TFTPgui #######
+#
+# fileio.py  - disc input and output for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+fileio.py - disc input and output for the TFTP engine
+
+The engine loop runs in a single thread, so any slow disc operation
+holds up every transfer. This module moves that work off the engine
+thread.
+
+Provides classes:
+ThreadPool - threads which run Jobs, calls which may block
+Job - a call passed to a ThreadPool, and its result
+WriterPool - threads which write received data to disc
+FileWriter - queues the data received on one connection for a WriterPool
+AtomicFile - a file written under a temporary name, renamed when complete
+GroupSync - a thread which fsyncs completing AtomicFiles in batches
+
+and functions:
+preallocate(fd, size) - reserve disc space for a file
+fadvise(fd, offset, length, advice) - tell the kernel how a file will be read
+libc() - a ctypes handle on the C library
+"""
+
+import os, sys, threading, Queue, tempfile, time
+
+# The process umask, so files created by mkstemp, which are private,
+# can be given the permissions an ordinary open() would have given them
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# ctypes handle on the C library, used for calls the os module lacks,
+# set by libc() on first use, False if unavailable
+_LIBC = None
+
+def libc():
+    "Returns a ctypes handle on the C library, or None if unavailable"
+    global _LIBC
+    if _LIBC is None:
+        _LIBC = False
+        if os.name == "posix":
+            try:
+                import ctypes, ctypes.util
+                _LIBC = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            except Exception:
+                _LIBC = False
+    return _LIBC or None
+
+
+def preallocate(fd, size):
+    """Reserves size bytes of disc for the open file descriptor fd,
+       so a file received block by block is not fragmented.
+       Returns True if the space was reserved, in which case the file
+       may have been extended and should be truncated to its real
+       length before closing. Returns False if not supported"""
+    if size <= 0:
+        return False
+    clib = libc()
+    if clib is not None and sys.platform.startswith("linux"):
+        # fallocate with FALLOC_FL_KEEP_SIZE reserves without changing the length
+        try:
+            import ctypes
+            func = getattr(clib, "fallocate64", None) or clib.fallocate
+            func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+            if func(fd, 1, 0, size) == 0:
+                return True
+        except Exception:
+            pass
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return True
+        except Exception:
+            pass
+    return False
+
+
+# advice values for fadvise, as in the Linux fcntl.h
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_WILLNEED = 3
+
+def fadvise(fd, offset, length, advice):
+    """Advises the kernel how length bytes of the open file descriptor fd,
+       from offset, are to be read, a length of 0 means to the end of the
+       file. Python 2 has no os.posix_fadvise, so it is called through
+       ctypes. Returns False if not supported"""
+    clib = libc()
+    if clib is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        import ctypes
+        func = getattr(clib, "posix_fadvise64", None) or clib.posix_fadvise
+        func.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+        # posix_fadvise returns the error number rather than setting errno
+        return func(fd, offset, length, advice) == 0
+    except Exception:
+        return False
+
+
+def _syncfs(fd):
+    """Flush every file of the filesystem holding fd to disc with a single
+       call, returns False if not supported"""
+    clib = libc()
+    if clib is None or not hasattr(clib, "syncfs"):
+        return False
+    try:
+        return clib.syncfs(fd) == 0
+    except Exception:
+        return False
+
+
+def _fsync_folder(folder):
+    "Flush a folder to disc, so a rename within it is durable"
+    if os.name != "posix":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Job(object):
+    """A call to be run by a ThreadPool, the engine thread checks the
+       attribute done, and then reads result, or error if the call raised
+       an exception"""
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def run(self):
+        "Called by the pool thread"
+        try:
+            self.result = self.function(*self.args)
+        except Exception, e:
+            self.error = e
+        self.done = True
+
+
+class ThreadPool(object):
+    """A number of threads running Jobs, so calls which may block for
+       some time do not hold up the engine loop. Anything with a run()
+       method may be put on the jobs queue"""
+
+    def __init__(self, threads=1, name="tftp-worker"):
+        "Create and start the threads"
+        self.jobs = Queue.Queue()
+        self.threads = []
+        for index in range(threads):
+            thread = threading.Thread(target=self._run, name="%s-%s" % (name, index))
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, function, *args):
+        "Returns a Job which runs function(*args) in a pool thread"
+        job = Job(function, args)
+        self.jobs.put(job)
+        return job
+
+    def _run(self):
+        "Thread loop, runs each job put on the jobs queue"
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                # the pool is stopping
+                return
+            job.run()
+
+    def stop(self, timeout=0):
+        """Stops the threads once the queued jobs are done, if timeout
+           is given, waits up to timeout seconds for them to finish"""
+        for thread in self.threads:
+            self.jobs.put(None)
+        deadline = time.time() + timeout
+        for thread in self.threads:
+            if time.time() >= deadline:
+                break
+            thread.join(deadline - time.time())
+        self.threads = []
+
+
+class WriterPool(ThreadPool):
+    """A pool of threads writing FileWriter queues to disc.
+       A FileWriter is only ever queued once at a time, so
+       the blocks of a file are written in order"""
+
+    def __init__(self, threads=1):
+        ThreadPool.__init__(self, threads, "tftp-writer")
+
+    def writer(self, fp, limit):
+        """Returns a FileWriter which writes to the open file object fp,
+           limit is the number of bytes which may be queued"""
+        return FileWriter(self, fp, limit)
+
+
+class FileWriter(object):
+    """Queues data for a WriterPool thread to write to a file.
+       Blocks queued while the thread is busy are joined and written
+       together, so a slow disc receives fewer, larger writes.
+
+       The engine thread calls write() and close(), and checks the
+       attributes full, done and error, which are set by the pool thread."""
+
+    def __init__(self, pool, fp, limit):
+        self.pool = pool
+        self.fp = fp
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._pending = []
+        # True while this writer is on the pool jobs queue or being serviced
+        self._scheduled = False
+        self._closing = False
+        self._aborting = False
+        # number of bytes queued, but not yet written
+        self.queued = 0
+        # done is set True when the file has been closed
+        self.done = False
+        # error holds any exception raised writing or closing the file,
+        # once set the file is aborted rather than closed
+        self.error = None
+
+    def get_full(self):
+        "Returns True if the queue holds limit bytes or more"
+        return self.queued >= self.limit
+
+    full = property(get_full)
+
+    def write(self, data):
+        "Queue data to be written"
+        self._lock.acquire()
+        try:
+            self._pending.append(data)
+            self.queued += len(data)
+            self._schedule()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        "Queue the file to be closed after any outstanding data is written"
+        self._lock.acquire()
+        try:
+            self._closing = True
+            self._schedule()
+        finally:
+            self._lock.release()
+
+    def abort(self):
+        "Discard any queued data, and abort the file, which must have an abort method"
+        self._lock.acquire()
+        try:
+            self._aborting = True
+            self._schedule()
+        finally:
+            self._lock.release()
+
+    def _schedule(self):
+        "Put this writer on the pool jobs queue, called with the lock held"
+        if not self._scheduled:
+            self._scheduled = True
+            self.pool.jobs.put(self)
+
+    def run(self):
+        "Called by the pool thread, write all queued data, and close if requested"
+        while True:
+            self._lock.acquire()
+            try:
+                blocks = self._pending
+                self._pending = []
+                closing = self._closing or self._aborting
+                if self._aborting:
+                    self.queued = 0
+                    blocks = []
+                if not blocks and not (closing and not self.done):
+                    self._scheduled = False
+                    return
+            finally:
+                self._lock.release()
+            if blocks:
+                data = "".join(blocks)
+                if self.error is None:
+                    try:
+                        self.fp.write(data)
+                    except Exception, e:
+                        self.error = e
+                self._lock.acquire()
+                self.queued -= len(data)
+                self._lock.release()
+            elif closing:
+                try:
+                    if self._aborting or self.error is not None:
+                        # a failed write leaves the file incomplete, so it is discarded
+                        self.fp.abort()
+                    else:
+                        self.fp.close()
+                except Exception, e:
+                    if self.error is None:
+                        self.error = e
+                self.done = True
+
+
+class AtomicFile(object):
+    """A file written under a temporary name in the folder of filepath,
+       and renamed to filepath when closed. So a partly received file is
+       never visible, and an aborted one leaves nothing behind.
+
+       The temporary name starts with a '.', which TFTP clients cannot request.
+
+       fsync - if True, the file is flushed to disc before it is renamed
+       syncer - a GroupSync, if given, fsync and rename are done by it,
+                in a batch with other files
+
+       Attributes done and error are set when the rename has been done,
+       or has failed, which may be in the GroupSync thread."""
+
+    def __init__(self, filepath, mode="wb", size=0, fsync=False, syncer=None):
+        self.filepath = filepath
+        folder, name = os.path.split(filepath)
+        fd, self.temppath = tempfile.mkstemp(prefix="."+name+".", suffix=".part", dir=folder)
+        try:
+            os.chmod(self.temppath, 0666 & ~_UMASK)
+        except OSError:
+            pass
+        self.fp = os.fdopen(fd, mode)
+        # size is the expected file size, if known reserve the disc space
+        self.preallocated = preallocate(fd, size)
+        self.fsync = fsync
+        self.syncer = syncer
+        # number of bytes written
+        self.size = 0
+        self.closed = False
+        self.done = False
+        self.error = None
+
+    def write(self, data):
+        "Writes data to the temporary file"
+        self.fp.write(data)
+        self.size += len(data)
+
+    def close(self):
+        """Completes the file, flushing it if required and renaming it
+           to its final name, or passing it to the GroupSync to do so"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.fp.flush()
+            if self.preallocated:
+                # remove any space reserved beyond the data received
+                self.fp.truncate(self.size)
+            if self.syncer is not None:
+                self.syncer.add(self)
+                return
+            if self.fsync:
+                os.fsync(self.fp.fileno())
+            self.fp.close()
+            self.rename()
+            if self.fsync:
+                _fsync_folder(os.path.dirname(self.filepath))
+            self.done = True
+        except Exception, e:
+            self.fail(e)
+
+    def rename(self):
+        """Renames the temporary file to filepath, without replacing
+           any file which has appeared under that name meanwhile"""
+        if hasattr(os, "link"):
+            try:
+                os.link(self.temppath, self.filepath)
+            except OSError:
+                if os.path.exists(self.filepath):
+                    raise
+                # The filesystem may not support links, so rename instead
+            else:
+                os.remove(self.temppath)
+                return
+        if os.path.exists(self.filepath):
+            raise IOError("File already exists")
+        os.rename(self.temppath, self.filepath)
+
+    def fail(self, e):
+        "Records error e, and removes the temporary file"
+        self.error = e
+        self.abort()
+
+    def abort(self):
+        "Closes and removes the temporary file, leaving no partial file"
+        self.closed = True
+        try:
+            self.fp.close()
+        except Exception:
+            pass
+        try:
+            if os.path.exists(self.temppath):
+                os.remove(self.temppath)
+        except Exception:
+            pass
+
+
+class GroupSync(object):
+    """A thread which completes AtomicFiles in batches. Files closed within
+       delay seconds of each other are flushed to disc together, with one
+       syncfs call where available, then renamed, with each folder flushed
+       once per batch. So the durability of fsync is kept without a disc
+       flush per file"""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stopping = False
+        self.thread = threading.Thread(target=self._run, name="tftp-groupsync")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def add(self, atomicfile):
+        "Queue atomicfile to be flushed and renamed with the next batch"
+        self._condition.acquire()
+        try:
+            self._pending.append(atomicfile)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def stop(self):
+        "Stops the thread once any pending files are completed"
+        self._condition.acquire()
+        try:
+            self._stopping = True
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def _run(self):
+        "Thread loop, waits for files, then completes them as a batch"
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+            finally:
+                self._condition.release()
+            # wait a moment so other closing files join this batch
+            time.sleep(self.delay)
+            self._condition.acquire()
+            try:
+                batch = self._pending
+                self._pending = []
+            finally:
+                self._condition.release()
+            self.commit(batch)
+
+    def commit(self, batch):
+        "Flush, close and rename each AtomicFile in batch"
+        # syncfs flushes one filesystem, so is called once for each
+        # filesystem holding files of the batch
+        synced = {}
+        for atomicfile in batch:
+            try:
+                device = os.fstat(atomicfile.fp.fileno()).st_dev
+            except Exception:
+                continue
+            if device not in synced:
+                synced[device] = _syncfs(atomicfile.fp.fileno())
+        folders = set()
+        for atomicfile in batch:
+            try:
+                if not synced.get(os.fstat(atomicfile.fp.fileno()).st_dev):
+                    os.fsync(atomicfile.fp.fileno())
+                atomicfile.fp.close()
+                atomicfile.rename()
+                folders.add(os.path.dirname(atomicfile.filepath))
+            except Exception, e:
+                atomicfile.fail(e)
+        for folder in folders:
+            try:
+                _fsync_folder(folder)
+            except Exception:
+                pass
+        for atomicfile in batch:
+            if atomicfile.error is None:
+                atomicfile.done = True
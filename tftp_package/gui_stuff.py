@@ -33,11 +33,20 @@ import Tkinter, tkFileDialog, tkMessageBox, socket, os
 from tftp_package import tftpcfg
 
 
+# milliseconds between checks of the server, the text and status are only
+# redrawn if the version of the server has changed since the last check
+CHECK_INTERVAL = 200
+
+# percent the progress bar moves at each check, when the sizes of the
+# transfers are not known, or while oscillating
+BAR_STEP = 10
+
+
 class TopFrame(Tkinter.Frame):
     "The startup frame holding buttons, the status canvas and the progress bar"
 
     def __init__(self, parent, server):
-        "Create the buttons, and assign actions, check the server every 100ms"
+        "Create the buttons, and assign actions, check the server every 200ms"
         Tkinter.Frame.__init__(self, parent)
         self.server = server
         self.parent = parent
@@ -78,6 +87,11 @@ class TopFrame(Tkinter.Frame):
         BarFrame.pack(side=Tkinter.TOP, expand=Tkinter.YES, fill=Tkinter.X)
         self.Bar=ProgressBar(BarFrame)
         self.bar_value = 0
+        # the version of the server last shown
+        self.version = None
+        # a config dictionary applied by the setup frame, to be saved to
+        # the config file once the engine thread has applied it
+        self.pending_config = None
 
         # address and port status at bottom of frame
         self.StatusText = Tkinter.Label(self)
@@ -93,7 +107,7 @@ class TopFrame(Tkinter.Frame):
         self.pack()
 
         # Check server every 200 msec
-        self.parent.after(20, self.check_server,)
+        self.parent.after(CHECK_INTERVAL, self.check_server,)
 
         # Create an instance of the setup frame
         self.setup_frame = SetupFrame(parent, server, self)
@@ -109,35 +123,75 @@ class TopFrame(Tkinter.Frame):
             text="TFTP service address : " + self.server.listenipaddress + " : " + str(self.server.listenport)
         else:
             text="TFTP service port : " + str(self.server.listenport)
+        # kept, to be shown again after the progress of draining
+        self.status_line = text
         self.StatusText["text"] = text
 
     def check_server(self):
-            """Check if server available, and text messages from server"""
+            """Check if server available, and redraw the text messages
+               from the server, if its version has changed"""
             if not self.server.engine_available:
                 # attribute engine_available becomes False if the server
                 # becomes unavailable due to an error, or ctrl-c, so this exit
                 # the application
                 self.exit_app()
-            if self.server.text != self.TextArea["text"]:
-                self.TextArea["text"] = self.server.text
-            if self.server.transferring:
-                # self.server.transferring is True if the server has
-                # a current connection
-                self.bar_value += 1
-                if self.bar_value >=100:
-                    self.bar_value = 0
-                self.Bar.ShowProgress(self.bar_value)
-            elif self.server.serving:
-                # Show progress bar oscillating
-                self.Bar.ShowProgress(-1)
-            elif self.Bar.oscillating:
-                # Clear the progress bar
-                self.Bar.Clear()
-            if not self.server.serving and self.StartButton["state"] == Tkinter.DISABLED:
-                # Update the buttons
-                self.update_buttons()
+            # the version and transfers, published together by the engine thread
+            version, snapshot = self.server.state
+            if version != self.version:
+                # the text, drain_text, serving attributes or the
+                # transfers have changed since the last check
+                self.version = version
+                if self.pending_config is not None:
+                    self.check_config()
+                if self.server.text != self.TextArea["text"]:
+                    self.TextArea["text"] = self.server.text
+                # while draining, the status shows the transfers left
+                status = self.server.drain_text or self.status_line
+                if status != self.StatusText["text"]:
+                    self.StatusText["text"] = status
+                if not self.server.serving and self.StartButton["state"] == Tkinter.DISABLED:
+                    # Update the buttons
+                    self.update_buttons()
+                if snapshot:
+                    self.show_transfers(snapshot)
+                elif self.server.serving:
+                    # Show progress bar oscillating
+                    self.Bar.ShowProgress(-1, BAR_STEP)
+                elif self.Bar.oscillating:
+                    # Clear the progress bar
+                    self.Bar.Clear()
             # and call this function again, in another 200 msec
-            self.parent.after(20, self.check_server,)
+            self.parent.after(CHECK_INTERVAL, self.check_server,)
+
+    def check_config(self):
+        """Saves pending_config to the config file, and shows the new address,
+           once the engine thread has applied it, it is not saved if unable to bind"""
+        count, cfgdict, applied = self.server.reloaded
+        if cfgdict is not self.pending_config:
+            return
+        self.pending_config = None
+        if applied:
+            tftpcfg.setconfig(cfgdict)
+        self.status_text()
+
+    def show_transfers(self, snapshot):
+        """Shows the percent transferred of the transfers whose size is known,
+           or if none is known, moves the bar on, redrawn only if changed.
+           snapshot is the tuple of transfers published in server.state"""
+        done = 0
+        total = 0
+        for transfer in snapshot:
+            bytes, size = transfer[3:5]
+            if size:
+                done += bytes
+                total += size
+        if total:
+            value = min(done*100//total, 100)
+        else:
+            value = (self.bar_value + BAR_STEP) % 100
+        if value != self.bar_value or self.Bar.oscillating:
+            self.bar_value = value
+            self.Bar.ShowProgress(value)
 
     def setup_server(self):
         self.pack_forget()
@@ -148,7 +202,6 @@ class TopFrame(Tkinter.Frame):
         self.server.serving = True
         self.StartButton["state"]=Tkinter.DISABLED
         self.StopButton["state"]=Tkinter.NORMAL
-        self.SetupButton["state"]=Tkinter.DISABLED
 
     def stop_server(self):
         "Stop the server listenning"
@@ -161,7 +214,7 @@ class TopFrame(Tkinter.Frame):
         if self.server.serving:
             self.StartButton["state"]=Tkinter.DISABLED
             self.StopButton["state"]=Tkinter.NORMAL
-            self.SetupButton["state"]=Tkinter.DISABLED
+            self.SetupButton["state"]=Tkinter.NORMAL
         else:
             self.StartButton["state"]=Tkinter.NORMAL
             self.StopButton["state"]=Tkinter.DISABLED
@@ -202,12 +255,12 @@ class ProgressBar(object):
         self.SetProgressPercent(0)
         self.oscillating = False
         
-    def ShowProgress(self, barinfo):
+    def ShowProgress(self, barinfo, step=1):
         """This is the main function of the class, and is called
            with input variable barinfo set to:
            0 if the progress bar should be blank
            1 to 100 if a percent should be shown
-           -1 if the bar should oscilate"""
+           -1 if the bar should oscilate, moving step percent"""
         if barinfo >= 0:
             self.SetProgressPercent(barinfo)
             self.oscillating = False
@@ -218,7 +271,7 @@ class ProgressBar(object):
             self.shaker = -1
         if (self.Progress<4):
             self.shaker=1
-        self.Progress=self.Progress+self.shaker
+        self.Progress=min(max(self.Progress+self.shaker*step, 2), 100)
         ProgressPixel=(self.Progress/100.0)*self.Width
         self.BarCanvas.coords(self.RectangleID, ProgressPixel-2, 0, ProgressPixel, self.Height)
 
@@ -390,12 +443,17 @@ be pressed to apply the values."""
         if not status:
             tkMessageBox.showerror("Error", message)
             return
-        # Assign dictionary to the server
-        self.server.set_from_config_dict(cfgdict)
-        # Save this new configuration dictionary to the config file
-        tftpcfg.setconfig(cfgdict)
-        # Set text on top_frame, then show top_frame
-        self.server.text = "Press Start to enable the tftp server"
+        if self.server.set_config(cfgdict):
+            # Save this new configuration dictionary to the config file
+            tftpcfg.setconfig(cfgdict)
+            # Set text on top_frame
+            self.server.text = "Press Start to enable the tftp server"
+        else:
+            # serving or draining, the engine thread applies it, without stopping
+            # transfers in progress, the top_frame saves it and shows the new
+            # address once it has done so
+            self.top_frame.pending_config = cfgdict
+        # show top_frame
         self.top_frame.status_text()
         self.pack_forget()
         self.top_frame.pack()
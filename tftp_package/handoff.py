@@ -0,0 +1,235 @@
+####### TFTPgui #######
+#
+# handoff.py  - passes the listening sockets to a new process for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+handoff.py - restarts TFTPgui without unbinding its ports
+
+To restart, the old process starts a new one with the same command line,
+which inherits the bound listening sockets, so the ports are never
+unbound. The new process also inherits one end of a Unix datagram
+socketpair, the old process receiving on the other. The descriptors are
+given in the environment variable HANDOFF_ENV. (Python 2 cannot pass
+descriptors over a Unix socket, as it has no sendmsg, so they are
+inherited instead.) The socketpair has no path, so no other process can
+send to the old one, which trusts the packets it is forwarded.
+
+The new process serves on each socket it is given, and tells the old
+process it has taken over the port. The old process then stops reading
+the socket, and drains the transfers it has in progress.
+
+Both processes now hold the same socket, the new one reads every packet,
+and those from clients it does not know, other than requests, are
+forwarded to the old process, which answers them through the socket,
+until it has drained and exited.
+
+Provides class:
+Forwarder
+
+and functions:
+available() - True if a restart can be made on this system
+socket_pair() - the sockets the old and new processes talk through
+spawn(argv, sockets, peer) - starts the new process, passing it the sockets
+inherited() - in the new process, the socket to the old and those passed to it
+pack_packet(listen_port, rx_addr, rx_data) - a packet, as forwarded
+unpack_packet(datagram) - the port, client address and packet forwarded
+pack_ready(listen_port) - the message telling a port is taken over
+unpack_ready(datagram) - the port taken over
+"""
+
+import os, socket, struct, subprocess, errno
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# the environment variable passing the sockets to the new process
+HANDOFF_ENV = "TFTPGUI_HANDOFF"
+
+# the first byte of a datagram to the old process, which is either
+# a packet forwarded, or a message that a port has been taken over
+FORWARDED = "F"
+READY = "R"
+
+
+def available():
+    "Returns True if sockets can be passed to a new process on this system"
+    return os.name == "posix" and hasattr(socket, "AF_UNIX") and fcntl is not None
+
+
+def socket_pair():
+    """Returns (own, peer), a connected pair of Unix datagram sockets,
+       the old process receives on own, the new process inherits peer"""
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+
+def _open_descriptors():
+    "Returns the descriptors open in this process, above the standard three"
+    try:
+        fds = [int(name) for name in os.listdir("/proc/self/fd")]
+    except OSError:
+        fds = range(256)
+    return [fd for fd in fds if fd > 2]
+
+
+def _inherit_only(keep):
+    """Sets close on exec on every open descriptor but those in keep,
+       which are cleared of it, so only they are inherited. Returns a
+       dictionary of fd : flags before, to be given to _restore()"""
+    saved = {}
+    for fd in _open_descriptors():
+        try:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        except IOError:
+            # closed, or the directory listing itself
+            continue
+        saved[fd] = flags
+        if fd in keep:
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+        else:
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return saved
+
+
+def _restore(saved):
+    "Sets the flags of each descriptor back, saved being given by _inherit_only()"
+    for fd, flags in saved.items():
+        try:
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+        except IOError:
+            # closed since
+            continue
+
+
+def spawn(argv, sockets, peer):
+    """Starts argv as a new process, which inherits the bound sockets, and
+       peer, its end of the socket_pair(), given in HANDOFF_ENV. Returns the
+       subprocess.Popen instance, raises OSError on failure. Descriptors of
+       this process are only inherited while it starts, their close on exec
+       flags are then as they were, whether it started or not"""
+    fds = [sock.fileno() for sock in sockets]
+    saved = _inherit_only(fds + [peer.fileno()])
+    env = os.environ.copy()
+    env[HANDOFF_ENV] = "%s;%s" % (peer.fileno(), ",".join([str(fd) for fd in fds]))
+    try:
+        return subprocess.Popen(argv, env=env)
+    finally:
+        _restore(saved)
+
+
+def inherited():
+    """In a process started by spawn(), returns (peer, sockets), where peer
+       is the Unix socket to the old process, and sockets is a dictionary
+       of the (ip address, port) bound : socket, otherwise returns None.
+       The variable is removed, so is not passed on further"""
+    value = os.environ.pop(HANDOFF_ENV, None)
+    if not value:
+        return None
+    peer, fds = value.split(";", 1)
+    peer = int(peer)
+    try:
+        sock = socket.fromfd(peer, socket.AF_UNIX, socket.SOCK_DGRAM)
+    except socket.error:
+        return None
+    os.close(peer)
+    peer = sock
+    sockets = {}
+    for fd in fds.split(","):
+        if not fd:
+            continue
+        fd = int(fd)
+        try:
+            sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_DGRAM)
+        except socket.error:
+            continue
+        # fromfd duplicates the descriptor
+        os.close(fd)
+        sockets[sock.getsockname()] = sock
+    return peer, sockets
+
+
+def pack_packet(listen_port, rx_addr, rx_data):
+    "Returns the datagram forwarding rx_data, received from rx_addr on listen_port"
+    return FORWARDED + struct.pack("!H4sH", listen_port, socket.inet_aton(rx_addr[0]), rx_addr[1]) + rx_data
+
+
+def unpack_packet(datagram):
+    "Returns (listen_port, rx_addr, rx_data) from a datagram made by pack_packet"
+    listen_port, ip, port = struct.unpack("!H4sH", datagram[1:9])
+    return listen_port, (socket.inet_ntoa(ip), port), datagram[9:]
+
+
+def pack_ready(listen_port):
+    "Returns the datagram telling the old process listen_port is taken over"
+    return READY + struct.pack("!H", listen_port)
+
+
+def unpack_ready(datagram):
+    "Returns the port from a datagram made by pack_ready"
+    return struct.unpack("!H", datagram[1:3])[0]
+
+
+class Forwarder(object):
+    """In the new process, sends to the old process through sock, the
+       socket given by inherited(), the ports taken over, and the packets
+       for its connections. Once the old process has gone, closed is set,
+       and nothing more is sent"""
+
+    def __init__(self, sock):
+        self.closed = False
+        self.forwarded = 0
+        self.sock = sock
+        self.sock.setblocking(0)
+
+    def ready(self, listen_port):
+        "Tells the old process listen_port is taken over"
+        self.send(pack_ready(listen_port))
+
+    def forward(self, listen_port, rx_addr, rx_data):
+        "Passes the packet rx_data, received from rx_addr, to the old process"
+        self.forwarded += 1
+        self.send(pack_packet(listen_port, rx_addr, rx_data))
+
+    def send(self, datagram):
+        if self.closed:
+            return
+        try:
+            self.sock.send(datagram)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.ENOBUFS):
+                # the old process is busy, the client will send it again
+                return
+            # the old process has gone
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
@@ -0,0 +1,280 @@
+####### TFTPgui #######
+#
+# journal.py  - a structured record of the transfers made by TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+journal.py - a record of every transfer, and the queries made of it
+
+If the journalfile option is set, a record of each transfer is appended
+to the journal file as the transfer completes or fails. Unlike the text
+log, which is rotated every 20 KB, the journal is never rotated, and is
+compact and quick to read back with tftpjournal.py, which reports the
+files most requested, the slowest clients, and the failure rates over
+time.
+
+The engine thread only packs each record and adds it to a batch, the
+batch is written every JOURNAL_INTERVAL seconds by a thread of its own,
+so the disc never holds up the engine.
+
+The file starts with MAGIC, followed by a record for each transfer: a
+header of RECORD, (time finished as a double, duration in seconds,
+client ip address as four bytes, client port, listen port, 1 for an
+upload or 0, index in OUTCOMES, bytes transferred, block size, packets
+sent again, filename length), then the filename. Records carry no
+marker to find the next by, so a record left cut short at the end of the
+file, as the program stopped while writing it, is cut off by the writer
+before it appends further records.
+
+Provides class:
+JournalWriter
+
+and functions:
+read_journal(path) - yields a dictionary for each transfer
+outcome_counts(entries) - the number of transfers of each outcome
+top_files(entries, number) - the files most often requested
+slowest_clients(entries, number) - the clients with the lowest throughput
+failure_rates(entries, interval) - the transfers failed in each interval
+"""
+
+import os, socket, struct, time
+
+from tftp_package import fileio
+
+
+# the first bytes of a journal file
+MAGIC = "TFTPJRN1"
+
+# the header of each record
+RECORD = struct.Struct("!df4sHHBBQHHH")
+
+# the outcomes of a transfer, a record holds the index of its outcome
+OUTCOMES = ("ok",          # completed
+            "not found",   # the file requested does not exist
+            "timeout",     # the client stopped answering
+            "cancelled",   # the client sent an error
+            "failed")      # the server could not carry on, or was stopped
+
+# seconds between the batches written, and the records which
+# cause a batch to be written sooner
+JOURNAL_INTERVAL = 1.0
+JOURNAL_BATCH = 1000
+
+
+class JournalWriter(object):
+    """Appends a record of each transfer to the file at path, the records
+       are gathered by the engine thread and written in batches by a
+       thread of this writer, so a slow disc does not hold up the engine"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fp = open(path, "ab")
+        self.pool = fileio.ThreadPool(1, "tftp-journal")
+        if not os.fstat(self.fp.fileno()).st_size:
+            self.fp.write(MAGIC)
+            self.fp.flush()
+        else:
+            # the whole file is read, so this is the first job of the thread
+            self.pool.submit(self._repair)
+        # the records packed since the last batch was passed to the thread
+        self._batch = []
+        self._next_write = time.time() + JOURNAL_INTERVAL
+        # set by the thread if a write fails, read and cleared by poll()
+        self._error = None
+
+    def record(self, rx_addr, listen_port, upload, filename, bytes, blksize,
+               duration, retransmits, outcome):
+        "Adds the record of a transfer to the batch, outcome being one of OUTCOMES"
+        if self.fp is None:
+            return
+        try:
+            ip = socket.inet_aton(rx_addr[0])
+        except socket.error:
+            return
+        if isinstance(filename, unicode):
+            filename = filename.encode("utf-8")
+        header = RECORD.pack(time.time(), duration, ip, rx_addr[1], listen_port,
+                             upload and 1 or 0, OUTCOMES.index(outcome), bytes,
+                             min(blksize, 65535), min(retransmits, 65535), len(filename))
+        self._batch.append(header + filename)
+        if len(self._batch) >= JOURNAL_BATCH:
+            self.flush()
+
+    def poll(self):
+        """Called by the engine thread, passes the batch to the thread every
+           JOURNAL_INTERVAL seconds, returns the error of a failed write once,
+           or None"""
+        if self._batch and time.time() >= self._next_write:
+            self.flush()
+        error = self._error
+        self._error = None
+        return error
+
+    def flush(self):
+        "Passes the records gathered to the thread to be written"
+        self._next_write = time.time() + JOURNAL_INTERVAL
+        if not self._batch or self.fp is None:
+            return
+        batch = self._batch
+        self._batch = []
+        self.pool.submit(self._write, "".join(batch))
+
+    def _repair(self):
+        """Run by the thread before any record is written, cuts off a record
+           cut short at the end of the file, which would otherwise be read
+           with the start of the next record appended"""
+        try:
+            fp = open(self.path, "rb")
+            try:
+                if fp.read(len(MAGIC)) != MAGIC:
+                    # not a journal, left as it is
+                    return
+                end = fp.tell()
+                for record in _records(fp):
+                    end = fp.tell()
+                size = os.fstat(fp.fileno()).st_size
+            finally:
+                fp.close()
+            if end < size:
+                self.fp.truncate(end)
+        except (IOError, OSError), e:
+            self._error = e
+
+    def _write(self, data):
+        "Run by the thread, appends data to the file"
+        try:
+            self.fp.write(data)
+            self.fp.flush()
+        except (IOError, ValueError), e:
+            self._error = e
+
+    def close(self):
+        "Writes any records gathered, then stops the thread and closes the file"
+        if self.fp is None:
+            return
+        self.flush()
+        self.pool.stop(5.0)
+        self.fp.close()
+        self.fp = None
+
+
+def read_journal(path):
+    """Yields a dictionary for each transfer in the journal file at path,
+       raises ValueError if it is not one. A record cut short, as the file
+       was being written, is ignored"""
+    fp = open(path, "rb")
+    try:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a TFTPgui journal file" % path)
+        for fields, filename in _records(fp):
+            (when, duration, ip, port, listen_port, upload, outcome,
+             bytes, blksize, retransmits, length) = fields
+            if outcome < len(OUTCOMES):
+                outcome = OUTCOMES[outcome]
+            else:
+                outcome = "failed"
+            yield {"time": when,
+                   "duration": duration,
+                   "client": socket.inet_ntoa(ip),
+                   "port": port,
+                   "listenport": listen_port,
+                   "upload": bool(upload),
+                   "outcome": outcome,
+                   "bytes": bytes,
+                   "blksize": blksize,
+                   "retransmits": retransmits,
+                   "filename": filename}
+    finally:
+        fp.close()
+
+
+def _records(fp):
+    """Yields (header fields, filename) for each whole record of the journal
+       file object fp, read from after MAGIC, ending at a record cut short"""
+    while True:
+        header = fp.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        fields = RECORD.unpack(header)
+        filename = fp.read(fields[-1])
+        if len(filename) < fields[-1]:
+            return
+        yield fields, filename
+
+
+def outcome_counts(entries):
+    "Returns a dictionary of outcome : number of the entries with that outcome"
+    counts = dict.fromkeys(OUTCOMES, 0)
+    for entry in entries:
+        counts[entry["outcome"]] += 1
+    return counts
+
+
+def top_files(entries, number):
+    """Returns a list of (filename, transfers, bytes, transfers not ok)
+       of the number of files most often requested, most first"""
+    files = {}
+    for entry in entries:
+        totals = files.setdefault(entry["filename"], [0, 0, 0])
+        totals[0] += 1
+        totals[1] += entry["bytes"]
+        if entry["outcome"] != "ok":
+            totals[2] += 1
+    ranked = [(filename, totals[0], totals[1], totals[2]) for filename, totals in files.items()]
+    ranked.sort(key=lambda item: (-item[1], item[0]))
+    return ranked[:number]
+
+
+def slowest_clients(entries, number):
+    """Returns a list of (client ip address, transfers completed, median KB/s,
+       packets sent again) of the number of clients whose completed transfers
+       had the lowest median throughput, slowest first"""
+    clients = {}
+    for entry in entries:
+        if entry["outcome"] != "ok" or not entry["bytes"]:
+            continue
+        rates, retransmits = clients.setdefault(entry["client"], ([], [0]))
+        rates.append(entry["bytes"]/1024.0/max(entry["duration"], 0.000001))
+        retransmits[0] += entry["retransmits"]
+    ranked = []
+    for client, (rates, retransmits) in clients.items():
+        rates.sort()
+        ranked.append((client, len(rates), rates[len(rates)//2], retransmits[0]))
+    ranked.sort(key=lambda item: (item[2], item[0]))
+    return ranked[:number]
+
+
+def failure_rates(entries, interval):
+    """Returns a list of (start time, transfers, dictionary of outcome : number)
+       for each interval of seconds in which transfers ended, in order"""
+    buckets = {}
+    for entry in entries:
+        start = entry["time"] - entry["time"] % interval
+        bucket = buckets.setdefault(start, [0, dict.fromkeys(OUTCOMES, 0)])
+        bucket[0] += 1
+        bucket[1][entry["outcome"]] += 1
+    return [(start, buckets[start][0], buckets[start][1]) for start in sorted(buckets)]
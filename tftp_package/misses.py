@@ -0,0 +1,165 @@
+####### TFTPgui #######
+#
+# misses.py  - remembers requests for missing files for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+misses.py - answers requests for missing files from memory
+
+PXE clients probe a list of filenames, named after their MAC address,
+their ip address in hex, and so on, before the default, so most
+requests are for files which do not exist.
+
+A MissCache remembers the files recently found not to exist, so a
+repeated request is answered with the prebuilt FILE_NOT_FOUND packet,
+without creating a connection or looking at the disc. Entries expire
+after a number of seconds, and are removed as soon as the server
+learns the file, or a compressed copy or template of it, has appeared.
+
+A MissLog limits the log to one line per missing file in each
+interval, with a count of the further requests at the end of it.
+
+Provides classes:
+MissCache
+MissLog
+
+and function:
+normalise(filename) - the requested filename as a key of the MissCache
+"""
+
+import time
+
+
+# The error packet sent for a missing file
+FILE_NOT_FOUND = "\x00\x05\x00\x01File not found\x00"
+
+
+def normalise(filename):
+    """Returns the path of filename, as requested by a client, relative to
+       the tftp root folder with / separators, as used by the connections"""
+    if filename[:1] in ("/", "\\"):
+        filename = filename[1:]
+    return filename.replace("\\", "/")
+
+
+class MissCache(object):
+    """The relative paths of files found not to exist, held for ttl seconds,
+       up to maxentries, discarding the oldest"""
+
+    def __init__(self, maxentries, ttl):
+        self.maxentries = maxentries
+        self.ttl = ttl
+        # dictionary of relative path : expiry time
+        self._entries = {}
+        # list of relative paths, oldest first
+        self._order = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, relpath):
+        "Returns True if relpath is known not to exist"
+        expiry = self._entries.get(relpath)
+        if expiry is None:
+            self.misses += 1
+            return False
+        if expiry < time.time():
+            self.misses += 1
+            self.discard(relpath)
+            return False
+        self.hits += 1
+        return True
+
+    def add(self, relpath):
+        "Records that relpath does not exist"
+        if self.maxentries < 1 or self.ttl <= 0:
+            return
+        if relpath in self._entries:
+            self._order.remove(relpath)
+        self._entries[relpath] = time.time() + self.ttl
+        self._order.append(relpath)
+        while len(self._order) > self.maxentries:
+            del self._entries[self._order.pop(0)]
+
+    def discard(self, relpath):
+        """Removes relpath, which has been created or changed, this may
+           also create a file with the name less its suffix (as a compressed
+           copy or template), or if a folder, any file within it"""
+        stripped = relpath.rsplit(".", 1)[0]
+        prefix = relpath + "/"
+        for key in [key for key in self._order if key == relpath or key == stripped or key.startswith(prefix)]:
+            self._order.remove(key)
+            del self._entries[key]
+
+    def clear(self):
+        "Empties the cache"
+        self._entries = {}
+        self._order = []
+
+
+class MissLog(object):
+    """Logs requests for missing files with the function add_text, the first
+       request for each file in an interval is logged, and the number of
+       further requests at the end of the interval. An interval of 0 logs
+       every request"""
+
+    def __init__(self, add_text, interval):
+        self.add_text = add_text
+        self.interval = interval
+        self._start = time.time()
+        # set of relative paths logged in this interval
+        self._logged = set()
+        # number of requests not logged in this interval, and their clients
+        self._repeats = 0
+        self._clients = set()
+
+    def record(self, client, relpath):
+        "Called for each request from the ip address client for the missing relpath"
+        if self.interval <= 0 or relpath not in self._logged:
+            self._logged.add(relpath)
+            self.add_text("%s requested %s: file not found" % (client, relpath))
+            return
+        self._repeats += 1
+        self._clients.add(client)
+
+    def poll(self):
+        "Ends the interval if it is over, logging the number of requests not logged"
+        if time.time() - self._start < self.interval:
+            return
+        self.flush()
+
+    def flush(self):
+        "Ends the interval"
+        if self._repeats:
+            self.add_text("%s further requests for missing files from %s clients in %s seconds" % (
+                          self._repeats, len(self._clients), int(time.time() - self._start)))
+        self._start = time.time()
+        self._logged = set()
+        self._repeats = 0
+        self._clients = set()
@@ -0,0 +1,258 @@
+####### TFTPgui #######
+#
+# netascii.py  - netascii conversion for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+netascii.py - converts files to and from netascii
+
+In netascii, as sent on the wire, a line ends with CR LF, and a CR
+which is not part of a line end is sent as CR NUL. Conversion is done
+on whole chunks with str.replace, and as a CR LF or CR NUL pair may be
+split across two blocks, a trailing CR is carried over to the next chunk.
+
+Provides classes:
+Encoder - converts local text to netascii
+Decoder - converts netascii to local text
+EncodingReader - reads a file as netascii, an exact number of bytes at a time
+EncodedCache - holds the netascii form of recently sent files
+
+and functions:
+encode_file(fp) - returns the whole of a file as netascii
+encode_path(path, stat, whole) - the netascii form, or size, of a file
+"""
+
+import os
+
+
+class Encoder(object):
+    """Converts chunks of local text to netascii,
+       linesep is the local line end, normally os.linesep"""
+
+    def __init__(self, linesep=os.linesep):
+        self.linesep = linesep
+        # a CR held back from the end of the last chunk, only used
+        # where the local line end is CR LF
+        self._cr = False
+
+    def encode(self, data):
+        "Returns the netascii form of data, which may hold back a trailing CR"
+        if self.linesep == "\r\n":
+            if self._cr:
+                data = "\r" + data
+            self._cr = data.endswith("\r")
+            if self._cr:
+                data = data[:-1]
+            # local line ends become a plain LF, encoded below
+            data = data.replace("\r\n", "\n")
+        return data.replace("\r", "\r\x00").replace("\n", "\r\n")
+
+    def flush(self):
+        "Returns any held back data at the end of the file"
+        if self._cr:
+            self._cr = False
+            return "\r\x00"
+        return ""
+
+
+class Decoder(object):
+    """Converts chunks of netascii to local text,
+       linesep is the local line end, normally os.linesep"""
+
+    def __init__(self, linesep=os.linesep):
+        self.linesep = linesep
+        # a CR held back from the end of the last chunk
+        self._cr = False
+
+    def decode(self, data):
+        "Returns the local text form of data, which may hold back a trailing CR"
+        if self._cr:
+            data = "\r" + data
+        self._cr = data.endswith("\r")
+        if self._cr:
+            data = data[:-1]
+        # CR LF must be replaced first, a CR NUL pair followed by LF,
+        # (an original CR LF) then decodes correctly
+        return data.replace("\r\n", self.linesep).replace("\r\x00", "\r")
+
+    def flush(self):
+        "Returns any held back data at the end of the file"
+        if self._cr:
+            # a CR at the very end is not valid netascii, keep it as it is
+            self._cr = False
+            return "\r"
+        return ""
+
+
+class EncodingReader(object):
+    """Wraps a file object opened in binary mode, read(size) returns
+       netascii, exactly size bytes at a time until the end of the file.
+       The file is read in chunks of chunksize bytes"""
+
+    def __init__(self, fp, chunksize=65536):
+        self.fp = fp
+        self.chunksize = chunksize
+        self.encoder = Encoder()
+        self._buffer = ""
+        self._eof = False
+
+    def read(self, size):
+        "Returns size bytes of netascii, or fewer at the end of the file"
+        while len(self._buffer) < size and not self._eof:
+            data = self.fp.read(self.chunksize)
+            if not data:
+                self._eof = True
+                self._buffer += self.encoder.flush()
+            else:
+                self._buffer += self.encoder.encode(data)
+        payload = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return payload
+
+    def encoded_size(self):
+        """Returns the size of the whole file as netascii, reads the
+           file, then returns to the current position"""
+        position = self.fp.tell()
+        self.fp.seek(0)
+        encoder = Encoder()
+        size = 0
+        while True:
+            data = self.fp.read(self.chunksize)
+            if not data:
+                break
+            size += len(encoder.encode(data))
+        size += len(encoder.flush())
+        self.fp.seek(position)
+        return size
+
+    def close(self):
+        self.fp.close()
+
+    def fileno(self):
+        return self.fp.fileno()
+
+
+def encode_file(fp):
+    "Returns the whole of the file object fp, opened in binary mode, as netascii"
+    encoder = Encoder()
+    return encoder.encode(fp.read()) + encoder.flush()
+
+
+def encode_path(path, stat, whole):
+    """Opens path, whose os.stat result was stat, and returns the whole
+       of it as netascii if whole is True, or the size of its netascii
+       form. Returns None if the file has changed since. As this reads
+       the whole file, it is called in an io pool thread"""
+    fp = open(path, "rb")
+    try:
+        if _version(os.fstat(fp.fileno())) != _version(stat):
+            return None
+        if whole:
+            return encode_file(fp)
+        return EncodingReader(fp).encoded_size()
+    finally:
+        fp.close()
+
+
+def _version(stat):
+    "The details of a stat result which change if the file is changed or replaced"
+    return (stat.st_size, stat.st_mtime, stat.st_ino, stat.st_dev)
+
+
+class EncodedCache(object):
+    """Holds the netascii form of recently sent files, up to a total of
+       maxbytes, discarding the least recently used.
+
+       Entries are keyed by path, and each holds the file size,
+       modification time, inode and device numbers when it was encoded,
+       so a changed file is never served from the cache"""
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.size = 0
+        # dictionary of path : (version, encoded data)
+        self._entries = {}
+        # list of paths, least recently used first
+        self._order = []
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, stat):
+        """Returns True if a file with the os.stat result stat is small
+           enough to cache, netascii may be up to twice the size of the
+           file, so only files which leave room for others are cached"""
+        return stat.st_size*2 <= self.maxbytes//4
+
+    def lookup(self, path, stat):
+        """Returns the netascii form of path, whose os.stat result is stat,
+           or None if it is not held"""
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == _version(stat):
+            self.hits += 1
+            self._order.remove(path)
+            self._order.append(path)
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def add(self, path, stat, data):
+        "Adds data, the netascii form of path whose os.stat result is stat"
+        self.discard(path)
+        if not self.cacheable(stat):
+            return
+        self._entries[path] = (_version(stat), data)
+        self._order.append(path)
+        self.size += len(data)
+        while self.size > self.maxbytes:
+            self.discard(self._order[0])
+
+    def get(self, path, fp):
+        """Returns the netascii form of the file object fp, opened in
+           binary mode from path, or None if it is too large to cache"""
+        stat = os.fstat(fp.fileno())
+        data = self.lookup(path, stat)
+        if data is not None:
+            return data
+        self.discard(path)
+        if not self.cacheable(stat):
+            return None
+        data = encode_file(fp)
+        self.add(path, stat, data)
+        return data
+
+    def discard(self, path):
+        "Removes path from the cache"
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._order.remove(path)
+            self.size -= len(entry[1])
+
+    def clear(self):
+        "Empties the cache"
+        self._entries = {}
+        self._order = []
+        self.size = 0
@@ -0,0 +1,130 @@
+####### TFTPgui #######
+#
+# netstats.py  - socket buffers and kernel drop counts for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+netstats.py - sizes the socket buffers, and reads the kernel drop counts
+
+If many clients send requests and acknowledgements at once, and the
+receive buffer of the socket fills before the server reads them, the
+kernel drops the packets, and the clients see this as loss.
+
+The buffer sizes may be given, or calculated from the expected number
+of clients. The kernel may limit them (on Linux to net.core.rmem_max
+and net.core.wmem_max), so the sizes actually set are returned.
+
+Packets dropped as the receive buffer was full are counted by Linux for
+each socket, and given in /proc/net/udp. (SO_RXQ_OVFL gives the same
+count, but needs recvmsg, which Python 2 does not have.)
+
+Provides functions:
+auto_buffers(clients) - buffer sizes for a number of clients
+set_buffers(sock, rcvbuf, sndbuf) - sets the buffer sizes
+socket_queue(sock) - the bytes waiting, and the packets dropped, for a socket
+udp_errors() - the system wide counts of UDP packets dropped
+"""
+
+import os, sys, socket
+
+
+# Bytes the kernel counts against the buffer for each packet, a packet
+# uses its size plus the kernel's own overhead for each buffer
+_PACKET_OVERHEAD = 768
+
+# Buffer sizes calculated for the expected clients are never below this
+MIN_BUFFER = 262144
+
+
+def auto_buffers(clients, blksize=4096):
+    """Returns (rcvbuf, sndbuf) for the expected number of clients,
+       allowing for a burst of four received packets, requests and
+       acknowledgements, and two data packets of blksize, for each"""
+    rcvbuf = clients * 4 * (512 + _PACKET_OVERHEAD)
+    sndbuf = clients * 2 * (blksize + 4 + _PACKET_OVERHEAD)
+    return max(rcvbuf, MIN_BUFFER), max(sndbuf, MIN_BUFFER)
+
+
+def set_buffers(sock, rcvbuf, sndbuf):
+    """Sets the receive and send buffer sizes of sock, in bytes, a size of
+       0 leaves the system default. Returns the sizes then in use"""
+    for option, size in ((socket.SO_RCVBUF, rcvbuf), (socket.SO_SNDBUF, sndbuf)):
+        if size > 0:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, size)
+            except socket.error:
+                # refused, so the default remains
+                pass
+    actual = []
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        size = sock.getsockopt(socket.SOL_SOCKET, option)
+        if sys.platform.startswith("linux"):
+            # Linux reports double the size set, half being its own overhead
+            size //= 2
+        actual.append(size)
+    return tuple(actual)
+
+
+def socket_queue(sock):
+    """Returns (bytes waiting to be read, packets dropped) of the UDP socket
+       sock, from /proc/net/udp, or None if this is not available"""
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        fp = open("/proc/net/udp", "r")
+    except (IOError, OSError, AttributeError):
+        return None
+    try:
+        for line in fp:
+            fields = line.split()
+            # sl local_address rem_address st tx_queue:rx_queue tr tm->when
+            # retrnsmt uid timeout inode ref pointer drops
+            if len(fields) >= 13 and fields[9] == inode:
+                return int(fields[4].split(":")[1], 16), int(fields[12])
+    finally:
+        fp.close()
+    return None
+
+
+def udp_errors():
+    """Returns a dictionary of the system wide UDP error counts, from
+       /proc/net/snmp, InErrors and RcvbufErrors, or an empty dictionary"""
+    try:
+        fp = open("/proc/net/snmp", "r")
+    except IOError:
+        return {}
+    try:
+        lines = [line.split() for line in fp if line.startswith("Udp:")]
+    finally:
+        fp.close()
+    if len(lines) < 2:
+        return {}
+    counts = dict(zip(lines[0][1:], lines[1][1:]))
+    errors = {}
+    for name in ("InErrors", "RcvbufErrors"):
+        if name in counts:
+            errors[name] = int(counts[name])
+    return errors
@@ -0,0 +1,117 @@
+####### TFTPgui #######
+#
+# packetcache.py  - holds prebuilt data packets for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+packetcache.py - holds the DATA packets of the most requested files
+
+Every client fetching a bootloader or kernel is sent the same packets,
+so rather than reading and building each packet for each client, the
+PacketCache holds the packets, built by the first client to need them.
+
+Packets are held for each file version and block size, a file version
+being its path, size, modification time, inode and device, so a
+changed file is never served from the cache.
+
+Provides class:
+PacketCache
+"""
+
+
+class PacketCache(object):
+    """The DATA packets of files, up to maxbytes, discarding the least
+       recently requested files. Only files up to a quarter of maxbytes
+       are held, so one large file does not displace all the others.
+       Used only by the engine thread"""
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.size = 0
+        # dictionary of key : list of packets, where key is
+        # (path, version, blksize), and packet n is block n+1
+        self._files = {}
+        # list of keys, least recently requested first
+        self._order = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    def key(self, path, stat, blksize):
+        """Returns the key of the packets of the file path, with the
+           os.stat result stat, or None if the file is too large to hold"""
+        if stat.st_size > self.maxbytes//4:
+            return None
+        return (path, (stat.st_size, stat.st_mtime, stat.st_ino, stat.st_dev), blksize)
+
+    def get(self, key, index):
+        "Returns packet index, counting from 0, of the file key, or None"
+        packets = self._files.get(key)
+        if packets is None or index >= len(packets):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if not index:
+            # a new transfer of the file
+            self._order.remove(key)
+            self._order.append(key)
+        return packets[index]
+
+    def put(self, key, index, packet):
+        """Adds packet index of the file key, packets are added in order,
+           so one that does not follow those held is ignored"""
+        packets = self._files.get(key)
+        if packets is None:
+            if index:
+                return
+            packets = []
+            self._files[key] = packets
+            self._order.append(key)
+        if index != len(packets):
+            return
+        packets.append(packet)
+        self.size += len(packet)
+        while self.size > self.maxbytes:
+            self._remove(self._order[0])
+
+    def _remove(self, key):
+        packets = self._files.pop(key)
+        self._order.remove(key)
+        self.size -= sum([len(packet) for packet in packets])
+
+    def discard(self, path):
+        "Removes the packets of every version of path"
+        for key in [key for key in self._order if key[0] == path]:
+            self._remove(key)
+
+    def clear(self):
+        "Empties the cache"
+        self._files = {}
+        self._order = []
+        self.size = 0
@@ -0,0 +1,130 @@
+####### TFTPgui #######
+#
+# profiling.py  - profiles the running server for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+profiling.py - profiles the engine thread while it carries on serving
+
+A Profiler is created by the engine thread, when asked to by a signal,
+and profiles that thread in two ways for a number of seconds:
+
+cProfile counts the calls and time of each function, written as a
+pstats file, read with the pstats module or a viewer such as snakeviz.
+
+A StackSampler thread takes the stack of the engine thread every few
+milliseconds, and counts each distinct stack, written in the collapsed
+format read by flamegraph.pl and speedscope, one line per stack of
+the functions from outermost to innermost, separated by ;, then the
+number of samples.
+
+cProfile only profiles the thread which enables it, so the Profiler
+must be created and stopped by the thread profiled.
+
+Provides classes:
+Profiler
+StackSampler
+"""
+
+import os, sys, time, thread, threading, cProfile
+
+
+class StackSampler(threading.Thread):
+    """Counts the stacks of the thread with identity thread_id,
+       sampled every interval seconds, until stop() is called"""
+
+    def __init__(self, thread_id, interval):
+        threading.Thread.__init__(self, name="tftp-sampler")
+        self.setDaemon(True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self._stopping = False
+        # dictionary of collapsed stack : number of samples
+        self.stacks = {}
+        self.samples = 0
+
+    def run(self):
+        while not self._stopping:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+            time.sleep(self.interval)
+
+    def sample(self, frame):
+        "Counts the stack ending at frame"
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("%s (%s:%s)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        names.reverse()
+        stack = ";".join(names)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def stop(self):
+        self._stopping = True
+        self.join(1.0)
+
+    def write(self, path):
+        "Writes the stacks to path in the collapsed format"
+        fp = open(path, "w")
+        try:
+            for stack, count in sorted(self.stacks.items()):
+                fp.write("%s %s\n" % (stack, count))
+        finally:
+            fp.close()
+
+
+class Profiler(object):
+    """Profiles the thread which creates it for seconds, with cProfile,
+       and by sampling its stack every interval seconds"""
+
+    def __init__(self, seconds, interval=0.005):
+        self.started = time.time()
+        self.deadline = self.started + seconds
+        self.sampler = StackSampler(thread.get_ident(), interval)
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def expired(self):
+        "Returns True once the seconds given are over"
+        return time.time() >= self.deadline
+
+    def stop(self, folder):
+        """Stops profiling, called by the thread profiled, and writes
+           profile-<time>.pstats and profile-<time>.folded to folder,
+           returns the two paths, raises IOError if they cannot be written"""
+        self.profile.disable()
+        self.sampler.stop()
+        stamp = time.strftime("%Y%m%d%H%M%S", time.localtime(self.started))
+        pstats_path = os.path.join(folder, "profile-%s.pstats" % stamp)
+        folded_path = os.path.join(folder, "profile-%s.folded" % stamp)
+        self.profile.dump_stats(pstats_path)
+        self.sampler.write(folded_path)
+        return pstats_path, folded_path
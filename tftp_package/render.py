@@ -0,0 +1,315 @@
+####### TFTPgui #######
+#
+# render.py  - generates files per client for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+render.py - generates the content of a requested file for each client
+
+A hook is an object with two methods:
+
+handles(filename) - returns True if the hook generates filename, this is
+                    called in the engine thread, so must be quick
+render(filename, client_address) - returns the file content as a string,
+                    or None if the file should be read from disc as normal.
+                    client_address is the (ip address, port) tuple of the
+                    client. This is called in a pool thread, so may be slow.
+
+Two hooks are provided:
+
+TemplateHook - renders a file 'name' from a template 'name.template'
+               in the tftp root folder
+ModuleHook - calls the functions of a Python file given by the user,
+             which must define render(), and may define handles()
+
+A hook may also have a method scan(), which is called in a pool thread
+when the Renderer is created, and every TEMPLATE_RESCAN seconds, so
+handles() can answer from memory.
+
+A Renderer runs the hook in a pool of threads, and keeps the results
+in a RenderCache for a number of seconds.
+"""
+
+import os, string, threading, time, types
+
+from tftp_package import fileio
+
+
+# seconds between scans of the tftp root folder for templates
+TEMPLATE_RESCAN = 5.0
+
+
+def client_values(filename, client_address):
+    """Returns a dictionary of values describing the client, which a
+       template may use as $ip, $iphex, $port and $filename"""
+    ip = client_address[0]
+    try:
+        iphex = "".join(["%02X" % int(part) for part in ip.split(".")])
+    except ValueError:
+        iphex = ""
+    return { "ip": ip,
+             "iphex": iphex,
+             "port": str(client_address[1]),
+             "filename": filename }
+
+
+class TemplateHook(object):
+    """Renders a file 'name' from the template 'name.template' in the
+       tftp root folder, substituting $ip, $iphex (the ip address as
+       eight hex digits, as used by pxelinux), $port and $filename"""
+
+    def __init__(self, tftprootfolder, indexed=None):
+        self.tftprootfolder = tftprootfolder
+        # indexed(relpath) returns True or False if relpath is a file, as
+        # held in memory by the root index, or None if there is no index
+        self.indexed = indexed
+        # the set of names, relative to the tftp root folder with /
+        # separators, of the files with templates, found by scan(), replaced
+        # as a whole. None until the first scan is done
+        self.templates = None
+
+    def template_path(self, filename):
+        return os.path.join(self.tftprootfolder, *(filename + ".template").split("/"))
+
+    def scan(self):
+        "Called in a pool thread, finds the templates in the tftp root folder"
+        if self.indexed is not None and self.indexed("") is not None:
+            # the root index is used instead
+            return
+        templates = set()
+        for folder, folders, files in os.walk(self.tftprootfolder):
+            folders[:] = [name for name in folders if not name.startswith(".")]
+            relfolder = os.path.relpath(folder, self.tftprootfolder).replace(os.sep, "/")
+            for name in files:
+                if name.endswith(".template") and not name.startswith("."):
+                    name = name[:-len(".template")]
+                    if relfolder != ".":
+                        name = relfolder + "/" + name
+                    templates.add(name)
+        self.templates = frozenset(templates)
+
+    def handles(self, filename):
+        """Returns True if filename has a template, called in the engine
+           thread, so answered from the root index, or without one, from the
+           last scan. Before the first, every file is passed to render,
+           which looks for the template"""
+        if self.indexed is not None:
+            found = self.indexed(filename + ".template")
+            if found is not None:
+                return found
+        templates = self.templates
+        return templates is None or filename in templates
+
+    def render(self, filename, client_address):
+        try:
+            fp = open(self.template_path(filename), "rb")
+        except (IOError, OSError):
+            # removed since the last scan, so read the file as normal
+            return None
+        try:
+            template = string.Template(fp.read())
+        finally:
+            fp.close()
+        return template.safe_substitute(client_values(filename, client_address))
+
+
+class ModuleHook(object):
+    """Loads the Python file at path, which must define a function
+       render(filename, client_address), and may define handles(filename),
+       if it does not, every file is offered to render"""
+
+    def __init__(self, path):
+        # loaded as a module of its own, not added to sys.modules, so it
+        # cannot replace or be replaced by another module
+        fp = open(path, "rU")
+        try:
+            source = fp.read()
+        finally:
+            fp.close()
+        self.module = types.ModuleType("tftpgui_renderhook")
+        self.module.__file__ = path
+        try:
+            exec compile(source, path, "exec") in self.module.__dict__
+        except SystemExit:
+            raise ImportError("%s exited as it was loaded" % path)
+        if not hasattr(self.module, "render"):
+            raise ImportError("%s has no render function" % path)
+
+    def handles(self, filename):
+        if hasattr(self.module, "handles"):
+            return self.module.handles(filename)
+        return True
+
+    def render(self, filename, client_address):
+        return self.module.render(filename, client_address)
+
+
+def create_hook(renderhook, tftprootfolder, indexed=None):
+    """Returns the hook given by the renderhook option, either
+       'template' or the path to a Python file, indexed is passed
+       to a TemplateHook"""
+    if renderhook == "template":
+        return TemplateHook(tftprootfolder, indexed)
+    return ModuleHook(renderhook)
+
+
+class RenderCache(object):
+    """Holds rendered files for ttl seconds, keyed by filename and client
+       ip address, up to maxentries, discarding the least recently used.
+       Used by the engine thread and pool threads, so access is locked"""
+
+    def __init__(self, maxentries, ttl):
+        self.maxentries = maxentries
+        self.ttl = ttl
+        # dictionary of key : (expiry time, data)
+        self._entries = {}
+        # list of keys, least recently used first
+        self._order = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        "Returns the data for key, or None if not held or expired"
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                self._discard(key)
+                return None
+            self.hits += 1
+            self._order.remove(key)
+            self._order.append(key)
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def put(self, key, data):
+        "Adds data to the cache"
+        if self.maxentries < 1 or self.ttl <= 0:
+            return
+        self._lock.acquire()
+        try:
+            self._discard(key)
+            self._entries[key] = (time.time()+self.ttl, data)
+            self._order.append(key)
+            while len(self._order) > self.maxentries:
+                self._discard(self._order[0])
+        finally:
+            self._lock.release()
+
+    def _discard(self, key):
+        "Removes key, called with the lock held"
+        if self._entries.pop(key, None) is not None:
+            self._order.remove(key)
+
+    def discard_file(self, filename):
+        "Removes the renderings of filename for every client"
+        self._lock.acquire()
+        try:
+            for key in [key for key in self._order if key[0] == filename]:
+                self._discard(key)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        "Empties the cache"
+        self._lock.acquire()
+        try:
+            self._entries = {}
+            self._order = []
+        finally:
+            self._lock.release()
+
+
+class Renderer(object):
+    """Runs a hook in a pool of threads, caching the results.
+       Requests for the same key while a render is running share it"""
+
+    def __init__(self, hook, threads, maxentries, ttl):
+        self.hook = hook
+        self.pool = fileio.ThreadPool(threads, "tftp-render")
+        self.cache = RenderCache(maxentries, ttl)
+        # dictionary of key : Job for renders in progress
+        self._running = {}
+        # the Job of the scan of the hook in progress, and when the next is due
+        self._scan = None
+        self._scan_due = 0.0
+        self.poll()
+
+    def poll(self):
+        "Called by the engine thread, starts a scan of the hook when due"
+        if not hasattr(self.hook, "scan") or time.time() < self._scan_due:
+            return
+        if self._scan is not None and not self._scan.done:
+            return
+        self._scan = self.pool.submit(self.hook.scan)
+        self._scan_due = time.time() + TEMPLATE_RESCAN
+
+    def rescan(self):
+        "Called when the tftp root folder has changed, scans the hook again"
+        self._scan_due = 0.0
+        self.poll()
+
+    def handles(self, filename):
+        "Returns True if the hook generates filename, False if not, or on error"
+        self.poll()
+        try:
+            return bool(self.hook.handles(filename))
+        except Exception:
+            return False
+
+    def lookup(self, filename, client_address):
+        "Returns the cached rendering of filename for this client, or None"
+        return self.cache.get((filename, client_address[0]))
+
+    def submit(self, filename, client_address):
+        """Returns a fileio.Job rendering filename for this client, its
+           result is the file content, or None if the hook declines it"""
+        key = (filename, client_address[0])
+        job = self._running.get(key)
+        if job is None or job.done:
+            job = self.pool.submit(self._render, key, filename, client_address)
+            self._running[key] = job
+        return job
+
+    def _render(self, key, filename, client_address):
+        "Called in a pool thread, renders and caches the result"
+        data = self.hook.render(filename, client_address)
+        if data is not None:
+            self.cache.put(key, data)
+        return data
+
+    def finished(self, job):
+        "Called by the engine thread when job is done, to tidy up"
+        for key, running in self._running.items():
+            if running is job:
+                del self._running[key]
+
+    def stop(self):
+        self.pool.stop()
@@ -0,0 +1,384 @@
+####### TFTPgui #######
+#
+# replay.py  - replays captured traffic against a TFTP server
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+replay.py - drives the traffic of a capture file against a server
+
+The packets a client sends depend on what the server sends it, so the
+captured packets are not sent blindly. Instead the transfers are found
+in the capture, each from its request, and at the same moments, divided
+by the speed, a client sends the same request, with the same options,
+and carries the transfer through, acknowledging each block, or for an
+upload, sending the blocks captured. So the same traffic is driven
+against any build, and the time to complete each transfer, and its
+throughput, are measured.
+
+Transfers are replayed from the one thread, each client with its own
+socket, waiting for packets in select.
+
+Provides classes:
+Transfer
+ReplayClient
+Replayer
+
+and functions:
+load_transfers(path) - the transfers found in a capture file
+summarise(results, elapsed) - the distributions of the results
+compare(summary, baseline) - lines comparing two summaries
+"""
+
+import socket, select, struct, time
+
+from tftp_package import capture
+
+
+class Transfer(object):
+    """A transfer found in a capture, started at offset seconds from the
+       start of the capture by the request packet. For an upload, blocks
+       is a dictionary of block number : payload of the blocks captured"""
+
+    def __init__(self, offset, request):
+        self.offset = offset
+        self.request = request
+        self.upload = request[1:2] == "\x02"
+        self.filename = request[2:].split("\x00")[0]
+        self.blocks = {}
+
+
+def load_transfers(path):
+    """Returns the list of Transfers in the capture file at path, in order
+       of their start. A repeated request from a client, sent again as it
+       was not answered, is not a new transfer"""
+    transfers = []
+    # dictionary of client address : its current Transfer
+    current = {}
+    # client addresses which have sent packets since their request
+    answered = set()
+    start = None
+    for when, listen_port, rx_addr, packet in capture.read_capture(path):
+        if start is None:
+            start = when
+        opcode = packet[1:2]
+        if opcode in ("\x01", "\x02"):
+            transfer = current.get(rx_addr)
+            if transfer is not None and transfer.request == packet and rx_addr not in answered:
+                # the client has sent the request again
+                continue
+            transfer = Transfer(when - start, packet)
+            transfers.append(transfer)
+            current[rx_addr] = transfer
+            answered.discard(rx_addr)
+            continue
+        transfer = current.get(rx_addr)
+        if transfer is None:
+            continue
+        answered.add(rx_addr)
+        if opcode == "\x03" and transfer.upload and len(packet) >= 4:
+            block = struct.unpack("!H", packet[2:4])[0]
+            transfer.blocks.setdefault(block, packet[4:])
+    return transfers
+
+
+def _options(packet):
+    "Returns the dictionary of options of a request or option acknowledgement"
+    parts = packet[2:].split("\x00")
+    if packet[1:2] in ("\x01", "\x02"):
+        # skip the filename and mode
+        parts = parts[2:]
+    options = {}
+    for index in range(0, len(parts)-1, 2):
+        options[parts[index].lower()] = parts[index+1]
+    return options
+
+
+class ReplayClient(object):
+    """Carries out a Transfer against the server at address, sending a packet
+       again if no reply comes in timeout seconds, giving up after retries"""
+
+    def __init__(self, transfer, address, timeout, retries):
+        self.transfer = transfer
+        self.address = address
+        self.timeout = timeout
+        self.retries = retries
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        self.blksize = 512
+        # the next block expected, or for an upload, the block last sent
+        self.block = 0
+        self.bytes = 0
+        self.last_packet = ""
+        self.last_time = 0.0
+        self.tries = 0
+        self.started = 0.0
+        # None until done, then "ok", "error" or "timeout"
+        self.outcome = None
+        self.finished = 0.0
+        # the address of the server's replies
+        self.peer = address
+        # for an upload, the block after which the upload is complete
+        self.last_block = None
+        if transfer.upload:
+            self.last_block = self._last_block()
+
+    def _last_block(self):
+        "The number of the final block of an upload"
+        if not self.transfer.blocks:
+            return 1
+        last = max(self.transfer.blocks)
+        blksize = int(_options(self.transfer.request).get("blksize", 512))
+        if len(self.transfer.blocks[last]) >= blksize:
+            # the end was not captured, so end with an empty block
+            last += 1
+        return last
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, packet):
+        self.last_packet = packet
+        self.last_time = time.time()
+        try:
+            self.sock.sendto(packet, self.peer)
+        except socket.error:
+            # treated as lost, so sent again on timeout
+            pass
+
+    def start(self):
+        self.started = time.time()
+        self.send(self.transfer.request)
+
+    def done(self, outcome):
+        self.outcome = outcome
+        self.finished = time.time()
+        self.sock.close()
+
+    def handle_read(self):
+        try:
+            packet, addr = self.sock.recvfrom(65536)
+        except socket.error:
+            return
+        if len(packet) < 4 or self.outcome is not None:
+            return
+        opcode = packet[1:2]
+        if opcode == "\x05":
+            self.done("error")
+            return
+        self.peer = addr
+        self.tries = 0
+        if opcode == "\x06":
+            options = _options(packet)
+            if "blksize" in options:
+                self.blksize = int(options["blksize"])
+            if self.transfer.upload:
+                self.acknowledged(0)
+            elif self.block == 0:
+                self.block = 1
+                self.send("\x00\x04\x00\x00")
+            return
+        number = struct.unpack("!H", packet[2:4])[0]
+        if opcode == "\x04" and self.transfer.upload:
+            self.acknowledged(number)
+        elif opcode == "\x03" and not self.transfer.upload:
+            self.data(number, packet[4:])
+
+    def data(self, number, payload):
+        "Acknowledges a DATA packet of a download"
+        if not self.block:
+            self.block = 1
+        if number != self.block % 65536:
+            if number == (self.block - 1) % 65536:
+                # our acknowledgement was lost
+                self.send(self.last_packet)
+            return
+        self.bytes += len(payload)
+        self.send("\x00\x04" + packet_number(number))
+        self.block += 1
+        if len(payload) < self.blksize:
+            self.done("ok")
+
+    def acknowledged(self, number):
+        "Sends the next block of an upload"
+        if number != self.block % 65536:
+            return
+        if self.block == self.last_block:
+            self.done("ok")
+            return
+        self.block += 1
+        payload = self.transfer.blocks.get(self.block)
+        if payload is None:
+            # not captured, so send a block of the same size
+            if self.block == self.last_block:
+                payload = ""
+            else:
+                payload = "\x00" * self.blksize
+        self.bytes += len(payload)
+        self.send("\x00\x03" + packet_number(self.block) + payload)
+
+    def poll(self, now):
+        "Sends the last packet again if no reply has come in time"
+        if self.outcome is not None or now - self.last_time < self.timeout:
+            return
+        self.tries += 1
+        if self.tries > self.retries:
+            self.done("timeout")
+            return
+        self.send(self.last_packet)
+
+    def result(self):
+        "Returns a dictionary describing the transfer"
+        duration = self.finished - self.started
+        return {"filename": self.transfer.filename,
+                "upload": self.transfer.upload,
+                "offset": self.transfer.offset,
+                "duration": duration,
+                "bytes": self.bytes,
+                "outcome": self.outcome}
+
+
+def packet_number(number):
+    "Returns the two byte block number of a packet"
+    return struct.pack("!H", number % 65536)
+
+
+class Replayer(object):
+    """Replays transfers against the server at address, each starting at
+       its offset divided by speed, a speed of 0 starts every transfer at once"""
+
+    def __init__(self, transfers, address, speed=1.0, timeout=1.0, retries=5):
+        self.transfers = transfers
+        self.address = address
+        self.speed = speed
+        self.timeout = timeout
+        self.retries = retries
+        self.results = []
+        self.elapsed = 0.0
+
+    def due(self, transfer):
+        "Returns the seconds from the start of the replay the transfer starts"
+        if not self.speed:
+            return 0.0
+        return transfer.offset/self.speed
+
+    def run(self, progress=None):
+        """Replays every transfer, returns the list of their results,
+           progress, if given, is called with each result"""
+        pending = list(self.transfers)
+        pending.reverse()
+        active = []
+        start = time.time()
+        while pending or active:
+            now = time.time()
+            while pending and now - start >= self.due(pending[-1]):
+                client = ReplayClient(pending.pop(), self.address, self.timeout, self.retries)
+                client.start()
+                active.append(client)
+            wait = 0.05
+            if pending:
+                wait = max(min(wait, self.due(pending[-1]) - (now - start)), 0)
+            if active:
+                readable = select.select(active, [], [], wait)[0]
+                for client in readable:
+                    client.handle_read()
+            else:
+                time.sleep(wait)
+            now = time.time()
+            for client in active[:]:
+                client.poll(now)
+                if client.outcome is not None:
+                    active.remove(client)
+                    result = client.result()
+                    self.results.append(result)
+                    if progress is not None:
+                        progress(result)
+        self.elapsed = time.time() - start
+        return self.results
+
+
+def _percentile(values, percent):
+    "Returns the value below which percent of the sorted list values fall"
+    if not values:
+        return 0.0
+    index = int(round((len(values)-1) * percent/100.0))
+    return values[index]
+
+
+def summarise(results, elapsed):
+    """Returns a dictionary of the number of transfers by outcome, and the
+       distributions of the time to complete, and the throughput in KB/s,
+       of the transfers completed"""
+    completed = [result for result in results if result["outcome"] == "ok"]
+    durations = sorted([result["duration"] for result in completed])
+    throughputs = sorted([result["bytes"]/1024.0/max(result["duration"], 0.000001) for result in completed])
+    total = sum([result["bytes"] for result in completed])
+    summary = {"transfers": len(results),
+               "ok": len(completed),
+               "errors": len([result for result in results if result["outcome"] == "error"]),
+               "timeouts": len([result for result in results if result["outcome"] == "timeout"]),
+               "elapsed": elapsed,
+               "total_kb": total/1024.0,
+               "total_kb_per_s": total/1024.0/max(elapsed, 0.000001)}
+    for percent in (50, 90, 99, 100):
+        summary["duration_p%s" % percent] = _percentile(durations, percent)
+    # the slowest transfers have the lowest throughput
+    for percent in (50, 10, 1, 0):
+        summary["kb_per_s_p%s" % percent] = _percentile(throughputs, percent)
+    return summary
+
+
+# the order in which a summary is listed, and whether a lower value is better
+SUMMARY_ORDER = [("transfers", None), ("ok", False), ("errors", True), ("timeouts", True),
+                 ("elapsed", True), ("total_kb", None), ("total_kb_per_s", False),
+                 ("duration_p50", True), ("duration_p90", True), ("duration_p99", True),
+                 ("duration_p100", True), ("kb_per_s_p50", False), ("kb_per_s_p10", False),
+                 ("kb_per_s_p1", False), ("kb_per_s_p0", False)]
+
+
+def describe(summary):
+    "Returns lines listing a summary"
+    return ["%-16s %12.3f" % (name, summary.get(name, 0)) for name, lower in SUMMARY_ORDER]
+
+
+def compare(summary, baseline):
+    """Returns lines comparing summary with baseline, a summary of a
+       replay of the same capture against another build"""
+    lines = ["%-16s %12s %12s %8s" % ("", "baseline", "this run", "change")]
+    for name, lower in SUMMARY_ORDER:
+        old = baseline.get(name, 0)
+        new = summary.get(name, 0)
+        if old:
+            change = "%+.1f%%" % ((new - old)*100.0/old)
+        else:
+            change = ""
+        if lower is not None and old != new and old:
+            if (new < old) == lower:
+                change += " better"
+            else:
+                change += " worse"
+        lines.append("%-16s %12.3f %12.3f %8s" % (name, old, new, change))
+    return lines
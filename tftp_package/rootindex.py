@@ -0,0 +1,288 @@
+####### TFTPgui #######
+#
+# rootindex.py  - index of the tftp root folder for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+rootindex.py - an in-memory index of the tftp root folder
+
+So that a request does not need the file system to be searched, the
+index holds every file and folder under the root folder, keyed by
+path relative to the root, using / as the separator.
+
+Names starting with a '.' cannot be requested, so are not indexed,
+and linked folders are not followed.
+
+The index is kept up to date by refresh(), which checks the
+modification time of each indexed folder, and only lists the folders
+which have changed, as adding, removing or renaming a file changes
+the modification time of its folder.
+
+A file being written, noticed by its Inotify events, is flagged as
+writing, and is not found by lookup() until it has been closed, so a
+client is never sent a half written file.
+
+Provides classes:
+RootIndex
+Inotify - Linux inotify, to learn of changes without checking folders
+"""
+
+import os, stat, struct, errno
+
+from tftp_package import fileio
+
+
+# inotify event flags, from linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# events watched for in each folder
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# flags for inotify_init1, the same values as O_NONBLOCK and O_CLOEXEC
+IN_NONBLOCK = 0x800
+IN_CLOEXEC = 0x80000
+
+
+class IndexEntry(object):
+    "The details of an indexed file or folder"
+
+    def __init__(self, st):
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.inode = st.st_ino
+        self.isdir = stat.S_ISDIR(st.st_mode)
+        # True while the file is known to be being written
+        self.writing = False
+
+
+class RootIndex(object):
+    """An index of the files and folders under rootfolder,
+       lookup(relpath) returns an IndexEntry, or None"""
+
+    def __init__(self, rootfolder):
+        self.rootfolder = rootfolder
+        # dictionary of relative path : IndexEntry
+        self._entries = {}
+        # dictionary of folder relative path : (modification time, set of names)
+        # the root folder has the relative path ""
+        self._folders = {}
+
+    def fullpath(self, relpath):
+        "Returns the file system path of relpath"
+        if not relpath:
+            return self.rootfolder
+        return os.path.join(self.rootfolder, *relpath.split("/"))
+
+    def lookup(self, relpath):
+        """Returns the IndexEntry of relpath, or None if it does not exist,
+           or is being written"""
+        entry = self._entries.get(relpath)
+        if entry is None or entry.writing:
+            return None
+        return entry
+
+    def folders(self):
+        "Returns a list of the relative paths of the indexed folders"
+        return self._folders.keys()
+
+    def mark_writing(self, relpath):
+        "Flags the file relpath as being written, until update() is called"
+        self.update(relpath)
+        entry = self._entries.get(relpath)
+        if entry is not None and not entry.isdir:
+            entry.writing = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def scan(self):
+        "Indexes the whole of the root folder"
+        self._entries = {}
+        self._folders = {}
+        self._list_folder("")
+
+    def refresh(self):
+        """Checks each indexed folder, and lists again those which have
+           changed, returns the number of folders listed"""
+        listed = 0
+        for relfolder in self._folders.keys():
+            if relfolder not in self._folders:
+                # removed while refreshing a parent folder
+                continue
+            try:
+                mtime = os.stat(self.fullpath(relfolder)).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._folders[relfolder][0]:
+                listed += self._list_folder(relfolder)
+        return listed
+
+    def update(self, relpath):
+        """Checks the file or folder relpath, after it is known
+           to have been created, changed or removed"""
+        relfolder = "/".join(relpath.split("/")[:-1])
+        if relfolder not in self._folders:
+            # the folder is not indexed, so neither is relpath
+            return
+        try:
+            st = os.stat(self.fullpath(relpath))
+        except OSError:
+            self._remove(relpath)
+            return
+        name = relpath.split("/")[-1]
+        entry = IndexEntry(st)
+        if entry.isdir and os.path.islink(self.fullpath(relpath)):
+            self._remove(relpath)
+            return
+        self._entries[relpath] = entry
+        self._folders[relfolder][1].add(name)
+        if entry.isdir and relpath not in self._folders:
+            self._list_folder(relpath)
+
+    def _list_folder(self, relfolder):
+        """Lists relfolder, adding and removing entries for the files
+           and folders in it, returns the number of folders listed"""
+        path = self.fullpath(relfolder)
+        try:
+            mtime = os.stat(path).st_mtime
+            names = set([name for name in os.listdir(path) if not name.startswith(".")])
+        except OSError:
+            if relfolder:
+                self._remove(relfolder)
+            else:
+                self._entries = {}
+                self._folders = {}
+            return 1
+        listed = 1
+        if relfolder in self._folders:
+            for name in self._folders[relfolder][1] - names:
+                self._remove(self._join(relfolder, name))
+        self._folders[relfolder] = (mtime, names)
+        for name in names:
+            relpath = self._join(relfolder, name)
+            fullpath = os.path.join(path, name)
+            try:
+                entry = IndexEntry(os.stat(fullpath))
+            except OSError:
+                # a broken link, or removed while listing
+                self._remove(relpath)
+                continue
+            if entry.isdir and os.path.islink(fullpath):
+                # linked folders are not followed
+                self._remove(relpath)
+                continue
+            self._entries[relpath] = entry
+            if entry.isdir and relpath not in self._folders:
+                listed += self._list_folder(relpath)
+        return listed
+
+    def _join(self, relfolder, name):
+        if relfolder:
+            return relfolder + "/" + name
+        return name
+
+    def _remove(self, relpath):
+        "Removes relpath, and if it is a folder, everything in it"
+        entry = self._entries.pop(relpath, None)
+        if relpath in self._folders:
+            prefix = relpath + "/"
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+            for key in [key for key in self._folders if key.startswith(prefix)]:
+                del self._folders[key]
+            del self._folders[relpath]
+        return entry
+
+
+class Inotify(object):
+    """Linux inotify, called through ctypes, as Python 2 has no
+       inotify module. Raises OSError if inotify is unavailable"""
+
+    def __init__(self):
+        self.libc = fileio.libc()
+        if self.libc is None or not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self._errno(), "inotify_init1 failed")
+
+    def _errno(self):
+        import ctypes
+        return ctypes.get_errno()
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        "Watches the folder path, returns the watch descriptor"
+        if isinstance(path, unicode):
+            path = path.encode("utf-8")
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            raise OSError(self._errno(), "inotify_add_watch failed on %s" % path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Returns a list of waiting events, as (watch descriptor, mask, name)
+           tuples, name is empty for events about the watched folder itself"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            if not data:
+                return events
+            offset = 0
+            while offset + 16 <= len(data):
+                wd, mask, cookie, length = struct.unpack("iIII", data[offset:offset+16])
+                name = data[offset+16:offset+16+length].rstrip("\x00")
+                events.append((wd, mask, name))
+                offset += 16 + length
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
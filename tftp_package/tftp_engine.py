@@ -45,15 +45,34 @@ instance 'server', however loop_nogui exits if unable to bind to
 the port whereas loop(server) is intended to run with a gui in
 another thread, and keeps the loop working, so the user has the
 option to change port parameters.
+
+If the config file has listener sections, tftpgui.py instead creates
+a list of ServerState instances with create_listeners(listeners), which
+share one SharedResources, and calls loop_multiserver(server_list) to
+serve them all from one loop.
+
+Setting restart_requested on the SharedResources starts a new process,
+which takes over the listening sockets, see handoff.py, tftpgui.py calls
+take_over(server_list, inherited) in the new process.
+
+A program embedding the server creates a ServerState, subscribes to its
+events with subscribe(), see events.py, and calls start_thread(), which
+runs loop(server) in a new thread, and stop_thread() to stop it.
+get_snapshot() lists the transfers in progress.
 """
 
-import os, time, asyncore, socket, logging, logging.handlers, string
+import os, sys, time, threading, asyncore, socket, logging, logging.handlers, string, cStringIO
 
-from tftp_package import ipv4
+from tftp_package import ipv4, tftpcfg, fileio, netascii, compressed, render, rootindex, misses, filecache, packetcache, netstats, handoff, tracing, profiling, capture, journal, events
 
 
+# The handler added by create_logger, replaced if it is called again
+_loghandler = None
+
 def create_logger(logfolder):
-    "Create logger, return rootLogger on success, None on failure"
+    """Create logger, return rootLogger on success, None on failure,
+       if called again, the previous log file is no longer written"""
+    global _loghandler
     if not logfolder:
         return None
     try:
@@ -64,7 +83,11 @@ def create_logger(logfolder):
         loghandler = logging.handlers.RotatingFileHandler(logfile,
                                                 maxBytes=20000, backupCount=5)
         loghandler.setFormatter(formatter)
+        if _loghandler is not None:
+            rootLogger.removeHandler(_loghandler)
+            _loghandler.close()
         rootLogger.addHandler(loghandler)
+        _loghandler = loghandler
     except Exception:
         return None
     return rootLogger
@@ -74,12 +97,273 @@ class DropPacket(Exception):
     pass
 
 
+# The names of the ServerState counters
+COUNTERS = ("packets_sent",          # packets sent to clients
+            "bytes_sent",            # bytes of those packets
+            "timeout_retransmits",   # packets sent again as no reply came within the TTL
+            "fast_retransmits",      # DATA or ACK packets sent again at once, see fastretransmit
+            "duplicate_acks",        # ACKs received for a block already acknowledged
+            "duplicate_data")        # DATA received for a block already acknowledged
+
+
+# Seconds between checks of the packets dropped by the kernel
+DROPS_INTERVAL = 5.0
+
+# Tuning options sizing the pools and caches, a change to which
+# by ServerState.reload() only takes effect when restarted
+RESTART_OPTIONS = ("writerthreads", "fsyncdelay", "netasciicache", "decompresscache",
+                   "readahead", "packetcache", "iothreads")
+
+# Seconds between the snapshots of the transfers in progress published,
+# with the version, in ServerState.state
+SNAPSHOT_INTERVAL = 0.5
+
+# Seconds between updates of ServerState.drain_text, and between the
+# lines printed by the loops without a gui, while draining
+DRAIN_UPDATE = 1.0
+DRAIN_PRINT = 5.0
+
+# Seconds loop_multiserver waits for a packet, while there are no transfers,
+# and while there are, and the seconds before a failed listener is restarted
+IDLE_WAIT = 0.1
+TRANSFER_WAIT = 0.002
+RETRY_INTERVAL = 30.0
+
+# The most bytes of disc reserved for an upload, from the size the client
+# gives with the tsize option, which may be more than it sends
+PREALLOCATE_LIMIT = 64*1024*1024
+
+# Seconds a restart waits for the new process to take over each port, and
+# the seconds the new process holds any socket passed to it it does not use
+HANDOFF_TIMEOUT = 10.0
+
+
+class SharedResources(object):
+    """The pools and caches used by one or more ServerState listeners,
+       served by one loop, and the counters of the packets they send.
+       Caches of files are keyed by full path, so listeners serving
+       different folders may share them"""
+
+    def __init__(self):
+        # the fileio.WriterPool used by uploads, created when first needed
+        self.writer_pool = None
+        # the fileio.GroupSync used if fsyncpolicy is group
+        self.group_sync = None
+        # the netascii.EncodedCache of files sent in netascii mode
+        self.netascii_cache = None
+        # the compressed.ChunkCache of files sent from compressed copies
+        self.chunk_cache = None
+        # the filecache.OpenFileCache of files kept open
+        self.file_cache = None
+        # the packetcache.PacketCache of prebuilt data packets, if packetcache is set
+        self.packet_cache = None
+        # the fileio.ThreadPool finding, opening and closing files, if iothreads is set,
+        # and a list of (job, cleanup) for jobs whose connection has gone
+        self.io_pool = None
+        self._abandoned = []
+        # the fileio.ThreadPool reading the kernel counts of packets dropped
+        self.stats_pool = None
+        # counters of packets sent, and of retransmissions and duplicates,
+        # given by get_metrics()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # the ServerState instances using these resources
+        self.listeners = []
+        # set, with the serving attribute of each listener cleared, to
+        # have loop_multiserver drain and stop every listener
+        self.stopping = False
+        # set, by a signal handler, to start a new process taking over the
+        # listening sockets, then the HandoffReceiver while it does so
+        self.restart_requested = False
+        self.handoff = None
+        # in a process started by a restart, the handoff.Forwarder passing
+        # packets to the old process, and a dictionary of the sockets passed
+        # to it, (ip address, port) : socket, until used by a listener
+        self.forwarder = None
+        self.inherited = {}
+        self._inherited_expiry = 0.0
+        # set, by a signal handler, to start profiling the engine thread,
+        # or to stop early, and the profiling.Profiler while profiling
+        self.profile_requested = False
+        self.profiler = None
+        # the capture.CaptureWriter recording the packets received
+        # by every listener, if the capturefile option is set
+        self.capture = None
+        # the journal.JournalWriter recording the transfers of every
+        # listener, if the journalfile option is set
+        self.journal = None
+
+    def add_text(self, text_line):
+        "Logs text_line through the first listener"
+        if self.listeners:
+            self.listeners[0].add_text(text_line)
+
+    def poll(self):
+        "Called by each listener's poll(), runs a restart, and the profiler"
+        if self.profile_requested:
+            self.profile_requested = False
+            if self.profiler is None:
+                self.start_profile()
+            else:
+                self.stop_profile()
+        elif self.profiler is not None and self.profiler.expired():
+            self.stop_profile()
+        if self.restart_requested:
+            self.restart_requested = False
+            self.restart()
+        if self.handoff is not None:
+            self.handoff.poll()
+        if self.journal is not None:
+            error = self.journal.poll()
+            if error is not None:
+                self.add_text("Unable to write the journal: %s" % error)
+        if self.inherited and time.time() >= self._inherited_expiry:
+            # sockets no listener has used, as the config has changed
+            for sock in self.inherited.values():
+                sock.close()
+            self.inherited = {}
+
+    def restart(self):
+        """Starts a new process with the same command line, passing it the
+           listening sockets, each listener drains once the new process has
+           taken over its port"""
+        if self.handoff is not None:
+            self.add_text("Restart already in progress")
+            return
+        if not handoff.available():
+            self.add_text("Restart is not available on this system")
+            return
+        sockets = [listener.tftp_server.socket for listener in self.listeners
+                   if listener.listening and not listener.draining]
+        if not sockets:
+            self.add_text("Not restarted, as no listener is serving")
+            return
+        receiver = None
+        peer = None
+        try:
+            own, peer = handoff.socket_pair()
+            receiver = HandoffReceiver(self, own)
+            argv = [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:]
+            receiver.process = handoff.spawn(argv, sockets, peer)
+        except (OSError, socket.error), e:
+            if receiver is not None:
+                receiver.close()
+            self.add_text("Unable to restart: %s" % e)
+            return
+        finally:
+            # held by the new process only
+            if peer is not None:
+                peer.close()
+        self.handoff = receiver
+        self.add_text("Restarting, new process %s is taking over" % receiver.process.pid)
+
+    def start_profile(self):
+        "Profiles the engine thread for the profiletime of the first listener"
+        if not self.listeners:
+            return
+        seconds = self.listeners[0].profiletime
+        self.profiler = profiling.Profiler(seconds)
+        self.add_text("Profiling the server for %s seconds" % seconds)
+
+    def stop_profile(self, listener=None):
+        """Stops profiling, and writes the results to the log folder
+           of listener, by default the first"""
+        if listener is None:
+            listener = self.listeners[0]
+        profiler = self.profiler
+        self.profiler = None
+        try:
+            paths = profiler.stop(listener.logfolder)
+        except (IOError, OSError), e:
+            listener.add_text("Unable to write the profile: %s" % e)
+            return
+        listener.add_text("Profile written to %s and %s" % paths)
+
+    def take_over(self, inherited):
+        """In a process started by a restart, serves on the sockets passed to it,
+           inherited being the result of handoff.inherited()"""
+        peer, self.inherited = inherited
+        self._inherited_expiry = time.time() + HANDOFF_TIMEOUT
+        self.forwarder = handoff.Forwarder(peer)
+
+    def adopt_socket(self, address):
+        """Returns the socket passed to this process bound to address,
+           (ip address, port), or None"""
+        if not self.inherited:
+            return None
+        return self.inherited.pop((address[0] or "0.0.0.0", address[1]), None)
+
+    def close(self, listener):
+        "Called when the last listener, listener, has shut down"
+        if self.profiler is not None:
+            self.stop_profile(listener)
+        if self.handoff is not None:
+            self.handoff.close()
+            self.handoff = None
+        if self.forwarder is not None:
+            self.forwarder.close()
+            self.forwarder = None
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        for sock in self.inherited.values():
+            sock.close()
+        self.inherited = {}
+
+
+def _shown(name):
+    """A ServerState attribute shown by the gui, setting it to a new value
+       increments the version of the server, so the gui redraws only then.
+       As serving and text are also set by the gui thread, the version and
+       state are changed under the state lock"""
+    attribute = "_shown_" + name
+    def set_value(self, value):
+        self._state_lock.acquire()
+        try:
+            if getattr(self, attribute, None) != value:
+                setattr(self, attribute, value)
+                self.version += 1
+                self.state = (self.version, self.state[1])
+        finally:
+            self._state_lock.release()
+    return property(lambda self: getattr(self, attribute), set_value)
+
+
+def _shared(name):
+    "A ServerState attribute held by its SharedResources"
+    return property(lambda self: getattr(self.shared, name),
+                    lambda self, value: setattr(self.shared, name, value))
+
+
 class ServerState(object):
     """Defines a class which records the current server state
        and produces logs, and a text attribute for a gui"""
 
-    def __init__(self, **cfgdict):
+    # the pools and caches, held by self.shared
+    writer_pool = _shared("writer_pool")
+    group_sync = _shared("group_sync")
+    netascii_cache = _shared("netascii_cache")
+    chunk_cache = _shared("chunk_cache")
+    file_cache = _shared("file_cache")
+    packet_cache = _shared("packet_cache")
+    io_pool = _shared("io_pool")
+    stats_pool = _shared("stats_pool")
+    _abandoned = _shared("_abandoned")
+    counters = _shared("counters")
+
+    # the attributes shown by the gui
+    text = _shown("text")
+    drain_text = _shown("drain_text")
+    transferring = _shown("transferring")
+    serving = _shown("serving")
+    reloaded = _shown("reloaded")
+
+    def __init__(self, shared=None, **cfgdict):
         """Creates a class which defines the state of the server
+           shared is a SharedResources used with other listeners, if not
+           given, this server has its own.
            cfgdict is a dictionary read from the config file
              tftprootfolder  - path to a folder
              logfolder       - path to a folder
@@ -87,8 +371,21 @@ class ServerState(object):
              clientipaddress - specific subnet ip address of the client
              clientmask      - specific subnet mask of the client
              listenport      - tftp port to listen on
-             listenipaddress - address to listen on"""
-
+             listenipaddress - address to listen on
+           and optionally the tftpcfg.TUNING_OPTIONS values"""
+
+        # incremented whenever the text, drain_text, transferring or serving
+        # attributes change, or the transfers in progress, the gui redraws
+        # when it sees a new version, rather than comparing them all at every
+        # check. state is the tuple (version, snapshot), snapshot being a tuple
+        # describing each transfer in progress, see take_snapshot(), replaced
+        # as a whole, so other threads read both together without a lock,
+        # but are only changed holding _state_lock, as the attributes may be
+        # set by the gui thread while the engine thread publishes a snapshot
+        self._state_lock = threading.Lock()
+        self.version = 0
+        self.state = (0, ())
+        self._snapshot_due = 0.0
         # self.serving is a settable/readable attribute
         # and instructs the class to serve or not when poll()
         # is called
@@ -99,10 +396,78 @@ class ServerState(object):
         self._engine_available = True
         self.logging_enabled = False
         self.transferring = False
+        # the name of the listener, given in the log if there are several
+        self.name = ""
+        # TFTPserver sockets replaced by reload(), kept open until the
+        # connections made through them are done
+        self.retired_sockets = []
+        # True if drain() has been called, new requests are then dropped, with
+        # the time by which transfers must finish, and a description of the
+        # progress, read by the gui and the loops
+        self.draining = False
+        self._drain_deadline = 0.0
+        self._drain_update = 0.0
+        self.drain_text = ""
+        # the pools and caches, and the other listeners sharing them
+        if shared is None:
+            shared = SharedResources()
+        self.shared = shared
+        shared.listeners.append(self)
+        # the render.Renderer generating files, if renderhook is set
+        self.renderer = None
+        # the rootindex.RootIndex of the tftp root folder, while serving
+        # if the rootindex option is set, and the time of its next refresh.
+        # Listeners serving the same folder share the index, one of them,
+        # with owns_index set, refreshing it and watching for changes
+        self.root_index = None
+        self.owns_index = False
+        self._index_refresh = 0.0
+        # the RootWatcher reading inotify events for the root index
+        self.root_watcher = None
+        # the misses.MissCache of files not found, and the misses.MissLog
+        # limiting the logging of them, while serving
+        self.miss_cache = None
+        self.miss_log = None
+
+        # packets dropped by the kernel as the receive buffer was full,
+        # the time this is next checked, and while it is being read,
+        # the fileio.Job reading it and the TFTPserver it is read for
+        self.socket_drops = 0
+        self._drops_check = 0.0
+        self._drops_job = None
 
         # break_loop attribute is available, but not used by this class
         # it can be used by another thread to flag the loop should be brocken
         self.break_loop = False
+        # reload_requested and new_config are also available to other threads,
+        # a signal handler sets reload_requested to have the loop read the config
+        # file again, the gui sets new_config to a dictionary to be applied
+        self.reload_requested = False
+        self.new_config = None
+        # set by the loop once it has applied new_config, to the tuple
+        # (count, cfgdict, applied), applied being False if unable to bind,
+        # the gui saves cfgdict to the config file only if it was applied
+        self.reloaded = (0, None, False)
+
+        # the tracing.Tracer, if the latency or traceclient options are set,
+        # or there are packet hooks, otherwise None, so costs nothing
+        self.tracer = None
+        self.packet_hooks = []
+
+        # the journal.JournalWriter shared by every listener, while serving,
+        # if the journalfile option is set
+        self.journal = None
+
+        # the events.Subscriptions of programs embedding the server, replaced
+        # rather than altered, as other threads subscribe, the time the next
+        # progress events are due, and the thread started by start_thread()
+        self.subscribers = []
+        self._progress_due = 0.0
+        self.engine_thread = None
+
+        # tuning attributes are optional, so start with their defaults
+        for option, value in tftpcfg.get_tuning_defaults().items():
+            setattr(self, option, value)
 
         # set attributes from the dictionary, use assert to ensure
         # all attributes are present
@@ -113,8 +478,8 @@ class ServerState(object):
         # start off with an empty dictionary 
         self._connections = {}
 
-        # The attribute self.text is read by the gui at regular intervals
-        # and displayed to give server status messages
+        # The attribute self.text is read by the gui when the version
+        # changes, and displayed to give server status messages
         self.text = """TFTPgui - a free tftp Server
 
 Version\t:  TFTPgui 2.3
@@ -140,6 +505,8 @@ Press Start to enable the tftp server
            If clear is True, deletes previous lines, making text
            equal to this text_line only"""
 
+        if self.name:
+            text_line = "%s: %s" % (self.name, text_line)
         if len(text_line)>100:
             # limit to 100 characters
             text_line = text_line[:100]
@@ -212,6 +579,8 @@ Press Start to enable the tftp server
             raise DropPacket
         if rx_data[1] == "\x01":
             # Client is reading a file from the server
+            if self.miss_cache is not None and self.answer_miss(rx_data, rx_addr):
+                return
             # create a SendData connection object
             connection = SendData(self, rx_data, rx_addr)
         elif rx_data[1] == "\x02":
@@ -224,6 +593,142 @@ Press Start to enable the tftp server
         # Add it to dictionary
         self._connections[rx_addr] = connection
         self.transferring = True
+        if self.subscribers:
+            self.publish("admitted", connection)
+
+    def answer_miss(self, rx_data, rx_addr):
+        """If the file read by rx_data is known not to exist, sends
+           the error at once, without creating a connection, and
+           returns True, otherwise returns False"""
+        end = rx_data.find("\x00", 2)
+        if end < 3 or len(rx_data) > 512:
+            return False
+        filename = misses.normalise(rx_data[2:end])
+        if not self.miss_cache.get(filename):
+            return False
+        if not self.anyclient:
+            if not ipv4.address_in_subnet(rx_addr[0], self.clientipaddress, self.clientmask):
+                raise DropPacket
+        try:
+            self.tftp_server.sendto(misses.FILE_NOT_FOUND, rx_addr)
+        except socket.error:
+            # the client will ask again
+            pass
+        self.miss_log.record(rx_addr[0], filename)
+        if self.journal is not None:
+            self.journal.record(rx_addr, self.tftp_server.port, False, filename,
+                                0, 512, 0.0, 0, "not found")
+        if self.subscribers:
+            self.deliver(events.Event("failed", self.name, rx_addr, filename, False, outcome="not found"))
+        return True
+
+    def file_not_found(self, connection, cacheable=True):
+        """Called when connection requests a file which does not exist,
+           cacheable is False if the file may exist for another client"""
+        if cacheable and self.miss_cache is not None:
+            self.miss_cache.add(connection.filename)
+        connection.outcome = "not found"
+        self.miss_log.record(connection.rx_addr[0], connection.filename)
+
+    def subscribe(self, kinds=None, callback=None, maxsize=events.QUEUE_SIZE):
+        """Returns an events.Subscription to the events of the kinds given,
+           all if None, which calls callback, in the engine thread, with each
+           event, or if no callback is given, queues up to maxsize events,
+           read with its get() method. May be called from any thread"""
+        subscription = events.Subscription(kinds, callback, maxsize)
+        self.subscribers = self.subscribers + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        "Stops the events of a subscription, may be called from any thread"
+        self.subscribers = [item for item in self.subscribers if item is not subscription]
+
+    def publish(self, kind, connection):
+        "Publishes an event of kind about connection to the subscribers"
+        outcome = None
+        if kind in ("completed", "failed"):
+            outcome = connection.outcome
+        self.deliver(events.Event(kind, self.name, connection.rx_addr, connection.filename,
+                                  isinstance(connection, ReceiveData), connection.bytes_transferred(),
+                                  connection.transfer_size(), time.time() - connection.start_time,
+                                  connection.retransmits, outcome))
+
+    def deliver(self, event):
+        "Passes event to each subscriber, a callback which fails is logged"
+        for subscription in self.subscribers:
+            try:
+                subscription.deliver(event)
+            except Exception, e:
+                self.log_exception(e)
+
+    def publish_progress(self):
+        "Publishes a progress event for each transfer"
+        self._progress_due = time.time() + events.PROGRESS_INTERVAL
+        if not [subscription for subscription in self.subscribers if subscription.wants("progress")]:
+            return
+        for connection in self.get_connections_list():
+            if not connection.expired:
+                self.publish("progress", connection)
+
+    def take_snapshot(self):
+        """Called by the engine thread, publishes in state a tuple of the
+           client, filename, upload, bytes, size, blksize, start time and
+           retransmits of each transfer in progress, incrementing the
+           version if they have changed"""
+        self._snapshot_due = time.time() + SNAPSHOT_INTERVAL
+        snapshot = tuple([(connection.rx_addr, connection.filename, isinstance(connection, ReceiveData),
+                           connection.bytes_transferred(), connection.transfer_size(), connection.blksize,
+                           connection.start_time, connection.retransmits)
+                          for connection in self.get_connections_list()])
+        self._state_lock.acquire()
+        try:
+            if snapshot != self.state[1]:
+                self.version += 1
+                self.state = (self.version, snapshot)
+        finally:
+            self._state_lock.release()
+
+    def get_snapshot(self):
+        """Returns a list of dictionaries, one for each transfer in progress,
+           as last published by the engine thread, at most SNAPSHOT_INTERVAL
+           seconds ago, may be called from any thread"""
+        snapshot = []
+        now = time.time()
+        for client, filename, upload, bytes, size, blksize, start_time, retransmits in self.state[1]:
+            snapshot.append({"client": client,
+                             "filename": filename,
+                             "upload": upload,
+                             "bytes": bytes,
+                             "size": size,
+                             "blksize": blksize,
+                             "duration": now - start_time,
+                             "retransmits": retransmits})
+        return snapshot
+
+    def start_thread(self):
+        """For a program embedding the server, starts serving, running loop()
+           in a new thread, and returns the thread. If unable to bind, the loop
+           carries on, with listening False, and the reason in the text"""
+        self.serving = True
+        self.engine_thread = threading.Thread(target=loop, args=(self,), name="tftp-engine")
+        self.engine_thread.setDaemon(True)
+        self.engine_thread.start()
+        return self.engine_thread
+
+    def stop_thread(self, drain=True, timeout=None):
+        """Stops the thread started by start_thread(), if drain is True once
+           the transfers in progress finish, or draintime is up, otherwise at
+           once. Waits up to timeout seconds, for ever if None, and returns
+           True if the thread has stopped"""
+        if self.engine_thread is None:
+            return True
+        if drain:
+            self.shared.stopping = True
+            self.serving = False
+        else:
+            self.break_loop = True
+        self.engine_thread.join(timeout)
+        return not self.engine_thread.isAlive()
 
     def get_config_dict(self):
         "Returns a dictionary of the config attributes"
@@ -234,14 +739,32 @@ Press Start to enable the tftp server
                     "clientmask":self.clientmask,
                     "listenport":self.listenport,
                     "listenipaddress":self.listenipaddress}
+        for option, convert, default in tftpcfg.TUNING_OPTIONS:
+            cfgdict[option] = getattr(self, option)
         return cfgdict
 
     def set_from_config_dict(self, cfgdict):
         """Sets attributes from a given dictionary
            Returns True if all attributes supplied, or False if not"""
-        # attributes can only be changed while not serving
+        # attributes can only be changed while not serving, see reload()
         assert not self._serving
         assert not self.serving
+        return self._apply_config(cfgdict)
+
+    def set_config(self, cfgdict):
+        """Called by another thread, such as the gui, with a new config
+           dictionary. While listening, which includes draining, or asked
+           to serve, it is left in new_config for the loop to apply with
+           reload(), otherwise it is applied at once.
+           Returns True if applied at once"""
+        if self.serving or self._serving:
+            self.new_config = cfgdict
+            return False
+        self.set_from_config_dict(cfgdict)
+        return True
+
+    def _apply_config(self, cfgdict):
+        "Sets attributes from cfgdict, returns True if all were supplied"
         all_attributes = True
         if "logfolder" in cfgdict:
             self.logfolder = cfgdict["logfolder"]
@@ -272,15 +795,443 @@ Press Start to enable the tftp server
                 self.listenipaddress = cfgdict["listenipaddress"]
         else:
             all_attributes = False
+        # tuning options are not required, if absent the current values are kept
+        for option, convert, default in tftpcfg.TUNING_OPTIONS:
+            if option in cfgdict:
+                setattr(self, option, cfgdict[option])
+        self.update_tracer()
         return all_attributes
 
+    def update_tracer(self):
+        """Creates the tracer if the latency or traceclient options are set,
+           or there are packet hooks, removes it if not"""
+        if not (self.latency or self.traceclient or self.packet_hooks):
+            self.tracer = None
+        elif self.tracer is None:
+            self.tracer = tracing.Tracer(self.latency, self.packet_hooks, self.traceclient, self.logfolder)
+        else:
+            self.tracer.set_options(self.latency, self.traceclient, self.logfolder)
+
+    def add_packet_hook(self, hook):
+        """Adds hook(event, rx_addr, data, when), called in the engine thread
+           for each packet received and sent, see tracing.py"""
+        self.packet_hooks.append(hook)
+        self.update_tracer()
+
+    def remove_packet_hook(self, hook):
+        "Removes a hook added by add_packet_hook()"
+        if hook in self.packet_hooks:
+            self.packet_hooks.remove(hook)
+        self.update_tracer()
+
+    def reload(self, cfgdict):
+        """Applies cfgdict, a new config dictionary, while serving, without
+           stopping the connections in progress, which carry on with the file
+           and client checks made when they started. New requests use the new
+           values. The socket is only bound again if the listen address or port
+           has changed, the old socket stays open until its connections are done.
+           Raise NoService if unable to bind, the old values are then kept"""
+        if not self._serving:
+            self._apply_config(cfgdict)
+            return
+        old = self.get_config_dict()
+        self._apply_config(cfgdict)
+        new = self.get_config_dict()
+        changed = set([option for option in new if new[option] != old[option]])
+        if not changed:
+            return
+        if "listenipaddress" in changed or "listenport" in changed:
+            try:
+                tftp_server = TFTPserver(self)
+            except NoService:
+                self._apply_config(old)
+                raise
+            self.tftp_server.new_requests = False
+            self.retired_sockets.append(self.tftp_server)
+            self.tftp_server = tftp_server
+            self.socket_drops = 0
+        elif changed & set(["rcvbuf", "sndbuf", "expectedclients"]):
+            self.tftp_server.size_buffers()
+        if "logfolder" in changed and self.logging_enabled:
+            self.logging_enabled = create_logger(self.logfolder) is not None
+        if changed & set(["capturefile", "capturesize", "logfolder"]):
+            self.tftp_server.capture = self.get_capture()
+        if changed & set(["journalfile", "logfolder"]):
+            self.journal = self.get_journal()
+        if "logfolder" in changed and self.chunk_cache is not None:
+            self.chunk_cache.set_index(self.size_index_path())
+        if changed & set(["tftprootfolder", "rootindex", "inotify"]):
+            # index the new folder, new requests look for files in it
+            self.close_index()
+            self.open_index()
+        if changed & set(["tftprootfolder", "misscache", "missttl"]):
+            if self.misscache > 0:
+                self.miss_cache = misses.MissCache(self.misscache, self.missttl)
+            else:
+                self.miss_cache = None
+        self.miss_log.interval = self.misslog
+        if self.renderer is not None and changed & set(["tftprootfolder", "renderhook", "renderthreads",
+                                                        "rendercache", "renderttl"]):
+            # renders in progress finish, the next is made by a new renderer
+            self.renderer.stop()
+            self.renderer = None
+        if self.file_cache is not None:
+            self.file_cache.maxfiles = self.filecache
+            self.file_cache.ttl = self.statttl/1000.0
+        for option in RESTART_OPTIONS:
+            if option in changed:
+                self.add_text("A change to %s takes effect when TFTPgui is restarted" % option)
+        if self.listenipaddress:
+            self.add_text("Configuration reloaded, listenning on %s:%s" % (self.listenipaddress, self.listenport))
+        else:
+            self.add_text("Configuration reloaded, listenning on port %s" % self.listenport)
+
+    def get_writer_pool(self):
+        "Returns the fileio.WriterPool, creating it if necessary"
+        if self.writer_pool is None:
+            self.writer_pool = fileio.WriterPool(self.writerthreads)
+        return self.writer_pool
+
+    def get_group_sync(self):
+        "Returns the fileio.GroupSync, creating it if necessary"
+        if self.group_sync is None:
+            self.group_sync = fileio.GroupSync(self.fsyncdelay/1000.0)
+        return self.group_sync
+
+    def get_netascii_cache(self):
+        "Returns the netascii.EncodedCache, creating it if necessary"
+        if self.netascii_cache is None:
+            self.netascii_cache = netascii.EncodedCache(self.netasciicache*1024)
+        return self.netascii_cache
+
+    def get_chunk_cache(self):
+        "Returns the compressed.ChunkCache, creating it if necessary"
+        if self.chunk_cache is None:
+            self.chunk_cache = compressed.ChunkCache(self.decompresscache*1024, self.size_index_path())
+        return self.chunk_cache
+
+    def size_index_path(self):
+        """Returns the path of the file in the logfolder recording the
+           sizes of decompressed files, None if there is no logfolder"""
+        if not self.logfolder:
+            return None
+        return os.path.join(self.logfolder, compressed.SIZEINDEX)
+
+    def get_io_pool(self):
+        """Returns the fileio.ThreadPool used for calls which may wait on
+           the disc, creating it if necessary, or None if iothreads is 0"""
+        if self.iothreads <= 0:
+            return None
+        if self.io_pool is None:
+            self.io_pool = fileio.ThreadPool(self.iothreads, "tftp-io")
+        return self.io_pool
+
+    def abandon_job(self, job, cleanup):
+        """Called by a connection shutting down while job is still running,
+           cleanup(result) is called once it is done, to close what it opened"""
+        self._abandoned.append((job, cleanup))
+
+    def poll_abandoned(self):
+        "Cleans up after any abandoned job which is now done"
+        running = []
+        for job, cleanup in self._abandoned:
+            if not job.done:
+                running.append((job, cleanup))
+            elif job.error is None:
+                try:
+                    cleanup(job.result)
+                except Exception, e:
+                    self.log_exception(e)
+        self._abandoned = running
+
+    def get_file_cache(self):
+        "Returns the filecache.OpenFileCache, creating it if necessary"
+        if self.file_cache is None:
+            self.file_cache = filecache.OpenFileCache(self.filecache, self.statttl/1000.0,
+                                                      self.readahead*1024, self.get_io_pool())
+        return self.file_cache
+
+    def get_packet_cache(self):
+        """Returns the packetcache.PacketCache, creating it if necessary,
+           or None if the packetcache option is 0"""
+        if self.packetcache <= 0:
+            return None
+        if self.packet_cache is None:
+            self.packet_cache = packetcache.PacketCache(self.packetcache*1024)
+        return self.packet_cache
+
+    def get_capture(self):
+        """Returns the capture.CaptureWriter recording to the capturefile, a
+           path relative to the logfolder, shared by every listener, creating
+           it if necessary, or None if the option is not set"""
+        shared = self.shared
+        if not self.capturefile:
+            if shared.capture is not None:
+                shared.capture.close()
+                shared.capture = None
+            return None
+        path = os.path.join(self.logfolder, self.capturefile)
+        if shared.capture is not None:
+            if shared.capture.path == path and shared.capture.maxbytes == self.capturesize*1048576:
+                return shared.capture
+            shared.capture.close()
+            shared.capture = None
+        try:
+            shared.capture = capture.CaptureWriter(path, self.capturesize*1048576)
+        except IOError, e:
+            self.log_exception(e)
+            self.add_text("Unable to open the capture file %s" % path)
+            return None
+        self.add_text("Recording the packets received to %s" % path)
+        return shared.capture
+
+    def get_journal(self):
+        """Returns the journal.JournalWriter recording to the journalfile, a
+           path relative to the logfolder, shared by every listener, creating
+           it if necessary, or None if the option is not set"""
+        shared = self.shared
+        if not self.journalfile:
+            if shared.journal is not None:
+                shared.journal.close()
+                shared.journal = None
+            return None
+        path = os.path.join(self.logfolder, self.journalfile)
+        if shared.journal is not None:
+            if shared.journal.path == path:
+                return shared.journal
+            shared.journal.close()
+            shared.journal = None
+        try:
+            shared.journal = journal.JournalWriter(path)
+        except IOError, e:
+            self.log_exception(e)
+            self.add_text("Unable to open the journal file %s" % path)
+            return None
+        self.add_text("Recording the transfers to %s" % path)
+        return shared.journal
+
+    def get_metrics(self):
+        """Returns a dictionary of counters showing how the server is
+           performing, for monitoring"""
+        metrics = {"connections": len(self._connections),
+                   "listeners": len(self.shared.listeners)}
+        metrics.update(self.counters)
+        if self.tftp_server is not None:
+            # the socket buffers, and packets dropped as the receive buffer was full,
+            # if these are high, loss is in this server rather than the network
+            metrics["rcvbuf"] = self.tftp_server.rcvbuf
+            metrics["sndbuf"] = self.tftp_server.sndbuf
+            queue = netstats.socket_queue(self.tftp_server.socket)
+            if queue is not None:
+                metrics["socket_queue"], metrics["socket_drops"] = queue
+            for name, count in netstats.udp_errors().items():
+                metrics["udp_" + name] = count
+        caches = [("misscache", self.miss_cache),
+                  ("filecache", self.file_cache),
+                  ("packetcache", self.packet_cache),
+                  ("netasciicache", self.netascii_cache),
+                  ("decompresscache", self.chunk_cache)]
+        if self.renderer is not None:
+            caches.append(("rendercache", self.renderer.cache))
+        for name, cache in caches:
+            if cache is None:
+                continue
+            metrics[name + "_hits"] = cache.hits
+            metrics[name + "_misses"] = cache.misses
+            lookups = cache.hits + cache.misses
+            if lookups:
+                metrics[name + "_hitrate"] = float(cache.hits)/lookups
+            else:
+                metrics[name + "_hitrate"] = 0.0
+        if self.packet_cache is not None:
+            metrics["packetcache_bytes"] = self.packet_cache.size
+            metrics["packetcache_files"] = len(self.packet_cache)
+        if self.tracer is not None:
+            metrics.update(self.tracer.metrics())
+        return metrics
+
+    def get_renderer(self):
+        """Returns the render.Renderer, creating it if necessary,
+           or None if there is no renderhook, or it cannot be loaded"""
+        if not self.renderhook:
+            return None
+        if self.renderer is None:
+            try:
+                hook = render.create_hook(self.renderhook, self.tftprootfolder, self.indexed_file)
+            except Exception, e:
+                self.log_exception(e)
+                self.add_text("Unable to load render hook %s" % self.renderhook)
+                self.renderhook = ""
+                return None
+            self.renderer = render.Renderer(hook, self.renderthreads,
+                                            self.rendercache, self.renderttl)
+        return self.renderer
+
+    def lookup_path(self, relpath):
+        """Returns "file" or "folder" if relpath, a path relative to the
+           tftp root folder with / separators, exists, or None if not.
+           The root index is used if there is one"""
+        if self.root_index is not None:
+            entry = self.root_index.lookup(relpath)
+            if entry is None:
+                return None
+        else:
+            path = os.path.join(self.tftprootfolder, *relpath.split("/"))
+            if self.file_cache is not None and self.file_cache.fresh(path):
+                # open, and recently checked
+                return "file"
+            if not os.path.exists(path):
+                return None
+            entry = rootindex.IndexEntry(os.stat(path))
+        if entry.isdir:
+            return "folder"
+        return "file"
+
+    def indexed_file(self, relpath):
+        """Returns True or False if relpath is a file, from the root index
+           held in memory, or None if there is no root index"""
+        if self.root_index is None:
+            return None
+        entry = self.root_index.lookup(relpath)
+        return entry is not None and not entry.isdir
+
+    def is_file(self, relpath):
+        "Returns True if relpath is a file in the tftp root folder"
+        return self.lookup_path(relpath) == "file"
+
+    def update_path(self, relpath):
+        "Called when relpath has been created or changed by this server"
+        if self.root_index is not None:
+            self.root_index.update(relpath)
+        for listener in self.root_sharers():
+            if listener.miss_cache is not None:
+                listener.miss_cache.discard(relpath)
+
+    def root_sharers(self):
+        "Returns the listeners, including this one, serving the same tftp root folder"
+        return [listener for listener in self.shared.listeners
+                if listener.tftprootfolder == self.tftprootfolder]
+
+    def path_changed(self, relpath):
+        """Called when relpath has been changed by another program,
+           removes anything held in memory about it, by this listener
+           and any other serving the same folder"""
+        path = os.path.join(self.tftprootfolder, *relpath.split("/"))
+        for listener in self.root_sharers():
+            if listener.miss_cache is not None:
+                listener.miss_cache.discard(relpath)
+            if listener.renderer is not None:
+                listener.renderer.cache.discard_file(relpath)
+                if relpath.endswith(".template"):
+                    listener.renderer.cache.discard_file(relpath[:-len(".template")])
+                    listener.renderer.rescan()
+        if self.file_cache is not None:
+            self.file_cache.discard(path)
+        if self.packet_cache is not None:
+            self.packet_cache.discard(path)
+        if self.netascii_cache is not None:
+            self.netascii_cache.discard(path)
+        if self.chunk_cache is not None:
+            self.chunk_cache.discard(path)
+
+    def clear_caches(self):
+        "Removes everything held in memory about files"
+        for listener in self.root_sharers():
+            if listener.miss_cache is not None:
+                listener.miss_cache.clear()
+            if listener.renderer is not None:
+                listener.renderer.cache.clear()
+        if self.file_cache is not None:
+            self.file_cache.clear()
+        if self.packet_cache is not None:
+            self.packet_cache.clear()
+        if self.netascii_cache is not None:
+            self.netascii_cache.clear()
+        if self.chunk_cache is not None:
+            self.chunk_cache.clear()
+
+    def open_index(self):
+        "Indexes the tftp root folder, if the rootindex option is set"
+        if not self.rootindex:
+            return
+        for listener in self.root_sharers():
+            if listener.root_index is not None:
+                # another listener serves this folder, so share its index
+                self.root_index = listener.root_index
+                return
+        self.root_index = rootindex.RootIndex(self.tftprootfolder)
+        self.root_index.scan()
+        self.watch_index()
+
+    def close_index(self):
+        """Stops using the root index, if this listener refreshes it,
+           hands that to another listener still serving the folder"""
+        if self.root_watcher is not None:
+            self.root_watcher.close()
+            self.root_watcher = None
+        if self.owns_index:
+            self.owns_index = False
+            for listener in self.shared.listeners:
+                if listener is not self and listener.root_index is self.root_index:
+                    listener.watch_index()
+                    break
+        self.root_index = None
+
+    def watch_index(self):
+        """Takes on refreshing the root index, and watching the
+           tftp root folder for changes"""
+        self.owns_index = True
+        if self.inotify:
+            try:
+                self.root_watcher = RootWatcher(self)
+            except (OSError, IOError), e:
+                # inotify is unavailable, changes are found by checking folders
+                self.log_exception(e)
+                self.root_watcher = None
+        self.next_index_refresh()
+
+    def next_index_refresh(self):
+        """Sets the time the root index is next checked, if inotify is
+           watching for changes, this is only a fallback, so is less often"""
+        if self.root_watcher is not None:
+            self._index_refresh = time.time() + self.rescaninterval
+        else:
+            self._index_refresh = time.time() + self.indexinterval
+
     def shutdown(self):
         "Shuts down the server"
         if not self._engine_available:
             return
         self.stop_serving()
-        self.add_text("TFTPgui application stopped")
+        if self.renderer is not None:
+            self.renderer.stop()
+            self.renderer = None
         self._engine_available = False
+        if self in self.shared.listeners:
+            self.shared.listeners.remove(self)
+        if self.shared.listeners:
+            # the pools are still used by other listeners
+            return
+        self.shared.close(self)
+        if self.writer_pool is not None:
+            # the writer threads finish any outstanding writes, then stop
+            self.writer_pool.stop(5.0)
+            self.writer_pool = None
+        if self.group_sync is not None:
+            self.group_sync.stop()
+            self.group_sync = None
+        if self.io_pool is not None:
+            # close whatever the pool opens for connections which have gone
+            deadline = time.time() + 5.0
+            while self._abandoned and time.time() < deadline:
+                time.sleep(0.01)
+                self.poll_abandoned()
+            self.io_pool.stop(1.0)
+            self.io_pool = None
+        if self.stats_pool is not None:
+            self.stats_pool.stop()
+            self.stats_pool = None
+        self.add_text("TFTPgui application stopped")
 
     def start_serving(self):
         "Starts the server serving"
@@ -295,6 +1246,11 @@ Press Start to enable the tftp server
             self.stop_serving()
             # re-raise the exception
             raise
+        self.miss_log = misses.MissLog(self.add_text, self.misslog)
+        self.journal = self.get_journal()
+        if self.misscache > 0:
+            self.miss_cache = misses.MissCache(self.misscache, self.missttl)
+        self.open_index()
         # the server is now bound to the ip address and port
         self._serving = True
         self.serving = True
@@ -302,18 +1258,52 @@ Press Start to enable the tftp server
             self.add_text(("Listenning on %s:%s" % (self.listenipaddress, self.listenport)), clear=True)
         else:
             self.add_text(("Listenning on port %s" % self.listenport), clear=True)
+        if self.tftp_server.rcvbuf < self.tftp_server.wanted_rcvbuf:
+            self.add_text("Receive buffer limited to %s KB by the system" % (self.tftp_server.rcvbuf//1024))
+        if self.tftp_server.sndbuf < self.tftp_server.wanted_sndbuf:
+            self.add_text("Send buffer limited to %s KB by the system" % (self.tftp_server.sndbuf//1024))
+        self.socket_drops = 0
+        self._drops_check = time.time() + DROPS_INTERVAL
+        if self.tftp_server.adopted and self.shared.forwarder is not None:
+            # the process restarted can now stop reading the socket
+            self.add_text("Taken over from the process restarted")
+            self.shared.forwarder.ready(self.tftp_server.port)
 
     def stop_serving(self):
         "Stops the server serving"
         # server no longer running, stop listening
-        if self.tftp_server != None:
+        stopped = self.tftp_server != None
+        if stopped:
             self.tftp_server.close()
             self.tftp_server = None
             self.add_text("Server stopped")
         # remove all connections
         self.clear_all_connections()
+        for tftp_server in self.retired_sockets:
+            tftp_server.close()
+        self.retired_sockets = []
+        self.close_index()
+        self.miss_cache = None
+        if self.file_cache is not None:
+            # close the files, so the tftp root folder is not held open
+            self.file_cache.clear()
+        if self.miss_log is not None:
+            self.miss_log.flush()
+            self.miss_log = None
+        if stopped and self.tracer is not None:
+            # reported once, though stop_serving is called again on shutdown
+            for line in self.tracer.report():
+                self.add_text(line)
+        if self.shared.capture is not None:
+            self.shared.capture.flush()
+        if self.journal is not None:
+            self.journal.flush()
+            self.journal = None
+        self.draining = False
+        self.drain_text = ""
         self._serving = False
         self.serving = False
+        self.take_snapshot()
 
     def poll(self):
         """Polls asyncore if serving,
@@ -321,11 +1311,38 @@ Press Start to enable the tftp server
            if True, or off if false"""
         if not self._engine_available:
             return
+        if self._abandoned:
+            self.poll_abandoned()
+        self.shared.poll()
         if self._serving:
             # The server is listenning
-            if not self.serving:
-                # A request has been made to turn off the server
-                self.stop_serving()
+            if not self.serving and not self.draining:
+                # A request has been made to turn off the server, the
+                # transfers in progress are given draintime to finish
+                self.drain()
+                if not self._serving:
+                    return
+            elif self.serving and self.draining:
+                # asked to serve again while draining
+                self.resume()
+            if self.owns_index and time.time() >= self._index_refresh:
+                # check for changes to the tftp root folder, any change may
+                # create a file which was missing
+                if self.root_index.refresh():
+                    for listener in self.root_sharers():
+                        if listener.miss_cache is not None:
+                            listener.miss_cache.clear()
+                if self.root_watcher is not None:
+                    self.root_watcher.watch_folders()
+                self.next_index_refresh()
+            self.miss_log.poll()
+            if self._drops_job is not None or time.time() >= self._drops_check:
+                self.check_drops()
+            if self.subscribers and time.time() >= self._progress_due:
+                self.publish_progress()
+            if self.retired_sockets:
+                self.close_retired()
+            if self.draining and self.check_drain():
                 return
             # poll asyncore and the connections
             asyncore.poll()
@@ -334,6 +1351,8 @@ Press Start to enable the tftp server
             for connection in connection_list:
                 connection.poll()
                 asyncore.poll()
+            if time.time() >= self._snapshot_due or len(self._connections) != len(self.state[1]):
+                self.take_snapshot()
             return
         # self._serving must be False, but maybe self.serving has been set
         if self.serving:
@@ -342,12 +1361,108 @@ Press Start to enable the tftp server
             # has been made to turn on the server
             self.start_serving()
 
+    def close_retired(self):
+        "Closes any socket replaced by reload() once its connections are done"
+        in_use = set([connection.tftp_server for connection in self._connections.values()])
+        for tftp_server in self.retired_sockets[:]:
+            if tftp_server not in in_use:
+                tftp_server.close()
+                self.retired_sockets.remove(tftp_server)
+
+    def drain(self, seconds=None):
+        """Stops accepting new requests, and stops serving once the
+           transfers in progress are done, or after seconds, by default
+           the draintime option. Setting serving to False calls this"""
+        self.serving = False
+        if not self._serving:
+            return
+        if seconds is None:
+            seconds = self.draintime
+        if seconds <= 0 or not self._connections:
+            self.stop_serving()
+            return
+        if not self.draining:
+            self.add_text("Draining %s transfers, new requests are dropped" % len(self._connections))
+        self.draining = True
+        self._drain_deadline = time.time() + seconds
+        self.tftp_server.new_requests = False
+        self.update_drain_text()
+
+    def resume(self):
+        "Takes new requests again, after drain()"
+        if not self.tftp_server.reading:
+            # the socket has been taken over by a new process
+            self.serving = False
+            return
+        self.draining = False
+        self.drain_text = ""
+        self.serving = True
+        self.tftp_server.new_requests = True
+        self.add_text("Draining cancelled, taking new requests")
+
+    def drain_progress(self):
+        """Returns (transfers in progress, bytes known to remain), the size of
+           an upload is only known if the client gave the tsize option"""
+        remaining = 0
+        for connection in self._connections.values():
+            remaining += connection.bytes_remaining() or 0
+        return len(self._connections), remaining
+
+    def update_drain_text(self):
+        "Sets drain_text, describing the progress of draining"
+        transfers, remaining = self.drain_progress()
+        self._drain_update = time.time() + DRAIN_UPDATE
+        self.drain_text = "Draining: %s transfers, %s KB left, stopping in %s seconds" % (
+                          transfers, (remaining+1023)//1024, max(int(self._drain_deadline - time.time()), 0))
+
+    def check_drain(self):
+        """Stops serving once draining is done, or its time is up,
+           returns True if stopped"""
+        now = time.time()
+        if self._connections and now < self._drain_deadline:
+            if now >= self._drain_update:
+                self.update_drain_text()
+            return False
+        if self._connections:
+            self.add_text("Drain time is up, %s transfers stopped" % len(self._connections))
+        self.stop_serving()
+        return True
+
+    def check_drops(self):
+        """Reads the count of packets dropped by the kernel, as the receive
+           buffer was full, every DROPS_INTERVAL seconds, and reports any
+           new drops. As this reads /proc/net/udp, which lists every UDP
+           socket, it is read by a thread of its own"""
+        if self._drops_job is not None:
+            job, tftp_server = self._drops_job
+            if not job.done:
+                return
+            self._drops_job = None
+            # ignored if read for a socket since replaced
+            if job.error is None and job.result is not None and tftp_server is self.tftp_server:
+                drops = job.result[1]
+                if drops > self.socket_drops:
+                    self.add_text("%s packets dropped as the receive buffer was full, see rcvbuf" % (drops - self.socket_drops))
+                self.socket_drops = drops
+        if time.time() < self._drops_check:
+            return
+        self._drops_check = time.time() + DROPS_INTERVAL
+        if self.stats_pool is None:
+            self.stats_pool = fileio.ThreadPool(1, "tftp-netstats")
+        self._drops_job = (self.stats_pool.submit(netstats.socket_queue, self.tftp_server.socket), self.tftp_server)
+
     def get_engine_available(self):
         """returns the value of self._engine_available"""
         return self._engine_available
 
     engine_available = property(get_engine_available)
 
+    def get_listening(self):
+        """returns True if bound to the port, serving or draining"""
+        return self._serving
+
+    listening = property(get_listening)
+
 
 class STOPWATCH_ERROR(Exception):
     """time_it should only be called if start has been called first."""
@@ -460,11 +1575,29 @@ class TFTPserver(asyncore.dispatcher):
            and port given in server.listenport"""
         asyncore.dispatcher.__init__(self)
         self.server = server
-        self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # False once replaced by another socket, or draining, new requests
+        # are then dropped, packets of existing connections are still handled
+        self.new_requests = True
+        # False once a new process has taken over the socket, it is then
+        # only used to send, packets are forwarded by the new process
+        self.reading = True
         # list of connections to test for sending data
         self.connection_list = []
         # current connection sending data
         self.connection = None
+        # the capture.CaptureWriter recording each packet read, or None
+        self.capture = server.get_capture()
+        sock = server.shared.adopt_socket((server.listenipaddress, server.listenport))
+        # True if passed, already bound, from the process restarted
+        self.adopted = sock is not None
+        if self.adopted:
+            sock.setblocking(0)
+            self.set_socket(sock)
+            self.size_buffers()
+            self.port = server.listenport
+            return
+        self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.size_buffers()
         try:
             self.bind((server.listenipaddress, server.listenport))
         except Exception, e:
@@ -487,7 +1620,23 @@ socket on this port."""
             if os.name == "posix" and server.listenport<1000 and os.geteuid() != 0:
                 server.text += "\n(Ports below 1000 may need root or administrator privileges.)"
             server.text += "\nFurther error details will be given in the logs file."
+            # remove the unbound socket from the asyncore map
+            self.close()
             raise NoService, "Unable to bind to given address and port"
+        self.port = self.socket.getsockname()[1]
+
+    def size_buffers(self):
+        """Sizes the socket buffers, if not given, from the expected number
+           of clients, if neither is set, the system defaults are left"""
+        server = self.server
+        self.wanted_rcvbuf, self.wanted_sndbuf = 0, 0
+        if server.expectedclients:
+            self.wanted_rcvbuf, self.wanted_sndbuf = netstats.auto_buffers(server.expectedclients)
+        if server.rcvbuf:
+            self.wanted_rcvbuf = server.rcvbuf*1024
+        if server.sndbuf:
+            self.wanted_sndbuf = server.sndbuf*1024
+        self.rcvbuf, self.sndbuf = netstats.set_buffers(self.socket, self.wanted_rcvbuf, self.wanted_sndbuf)
 
     def handle_read(self):
         """Handle incoming data - Checks if this is an existing connection,
@@ -500,11 +1649,31 @@ socket on this port."""
         rx_data, rx_addr = self.recvfrom(4100)
         if len(rx_data)>4100:
             raise DropPacket
+        if self.capture is not None:
+            self.capture.record(self.port, rx_addr, rx_data)
+        self.packet_received(rx_data, rx_addr)
+
+    def packet_received(self, rx_data, rx_addr):
+        "Handles rx_data from rx_addr, read from the socket, or forwarded to it"
+        tracer = self.server.tracer
+        if tracer is not None:
+            tracer.received(self.server._connections, rx_data, rx_addr)
         try:
             if rx_addr not in self.server:
                 # This is not an existing connection, so must be
                 # a new first packet from a client.
+                forwarder = self.server.shared.forwarder
+                if forwarder is not None and not forwarder.closed and rx_data[:2] not in ("\x00\x01", "\x00\x02"):
+                    # not a request, so may be for a connection of the
+                    # process restarted, which is still draining
+                    forwarder.forward(self.port, rx_addr, rx_data)
+                    raise DropPacket
+                if not self.new_requests:
+                    raise DropPacket
                 self.server.create_connection(rx_data, rx_addr)
+            elif self.server[rx_addr].tftp_server is not self:
+                # the client's connection is through another socket
+                raise DropPacket
             else:
                 # This is an existing connection
                 # let the appropriate connection class handle it
@@ -515,30 +1684,34 @@ socket on this port."""
             pass
 
 
+    def readable(self):
+        "False once a new process has taken over the socket"
+        return self.reading
+
     def writable(self):
         "If data available to write, return True"
         # self.connection is the current connection sending data
-        # self.connection_list is a list of the connections,
-        # test each in turn, popping the connection from the list
-        # until none are left, then renew self.connection_list from
-        # self.server.get_connections_list() - this is done to ensure
-        # each connection is handled in turn
         if self.connection:
             if (not self.connection.expired) and self.connection.tx_data:
                 # there is a current connection, and it has data to send
                 return True
             else:
                 # the current connection has no data to send
-                # go to next connection on the list
+                # go to next connection
                 self.connection = None
-        # there is no current connection, check if one is available
-        # get the next connection in the list
+        if not len(self.server):
+            # No connections available
+            return False
+        # self.connection_list is a list of the connections,
+        # test each in turn, popping the connection from the list
+        # until none are left, then renew self.connection_list from
+        # self.server.get_connections_list() - this is done to ensure
+        # each connection is handled in turn
         if not self.connection_list:
-            # but if no list, renew it now
-            if not len(self.server):
-                # No connections available
+            # if no list, renew it now
+            self.connection_list = self.connections()
+            if not self.connection_list:
                 return False
-            self.connection_list = self.server.get_connections_list()
         # so one or more connections exist in the list
         # get a connection, and remove it from the list
         self.connection = self.connection_list.pop()
@@ -547,6 +1720,11 @@ socket on this port."""
         else:
             return False
 
+    def connections(self):
+        "Returns a list of the connections made through this socket"
+        return [connection for connection in self.server.get_connections_list()
+                if connection.tftp_server is self]
+
     def handle_write(self):
         """Send any data on the current connection"""
         if not self.connection:
@@ -566,6 +1744,178 @@ socket on this port."""
         pass
 
 
+class HandoffReceiver(asyncore.dispatcher):
+    """In a process being restarted, receives on sock, its end of a
+       handoff.socket_pair(), the ports taken over by the new process,
+       and the packets it forwards for the connections of this process"""
+
+    def __init__(self, shared, sock):
+        asyncore.dispatcher.__init__(self, sock)
+        self.shared = shared
+        # the subprocess.Popen of the new process, set once started
+        self.process = None
+        # the ports taken over
+        self.ports = set()
+        self.deadline = time.time() + HANDOFF_TIMEOUT
+
+    def writable(self):
+        return False
+
+    def tftp_server(self, port):
+        "Returns the TFTPserver bound to port, or None"
+        for listener in self.shared.listeners:
+            for tftp_server in [listener.tftp_server] + listener.retired_sockets:
+                if tftp_server is not None and tftp_server.port == port:
+                    return tftp_server
+        return None
+
+    def handle_read(self):
+        datagram = self.recv(8192)
+        if datagram[:1] == handoff.FORWARDED:
+            listen_port, rx_addr, rx_data = handoff.unpack_packet(datagram)
+            tftp_server = self.tftp_server(listen_port)
+            if tftp_server is not None:
+                tftp_server.packet_received(rx_data, rx_addr)
+        elif datagram[:1] == handoff.READY:
+            self.taken_over(handoff.unpack_ready(datagram))
+
+    def taken_over(self, port):
+        "The new process serves port, so this process drains its listener"
+        self.ports.add(port)
+        for listener in self.shared.listeners:
+            if listener.listening and listener.tftp_server.port == port:
+                listener.tftp_server.reading = False
+                self.shared.stopping = True
+                listener.add_text("Port %s taken over by the new process" % port)
+                listener.drain()
+
+    def poll(self):
+        "Checks the new process is running, and has taken over each port in time"
+        if self.process.poll() is not None:
+            self.failed("New process exited with code %s" % self.process.returncode)
+            return
+        if self.deadline is None or time.time() < self.deadline:
+            return
+        self.deadline = None
+        if not self.ports:
+            self.process.terminate()
+            self.failed("New process has not taken over in %s seconds" % int(HANDOFF_TIMEOUT))
+            return
+        # the new process serves other ports, as its config has changed
+        for listener in self.shared.listeners:
+            if listener.listening and not listener.draining:
+                listener.add_text("Port %s not taken over by the new process" % listener.tftp_server.port)
+                listener.drain()
+
+    def failed(self, reason):
+        "The restart has failed, the listeners taken over serve again"
+        self.shared.add_text("%s, restart abandoned" % reason)
+        self.shared.handoff = None
+        self.shared.stopping = False
+        for listener in self.shared.listeners:
+            if listener.listening and not listener.tftp_server.reading:
+                listener.tftp_server.reading = True
+                listener.serving = True
+        self.close()
+
+    def handle_error(self):
+        pass
+
+
+class RootWatcher(asyncore.file_dispatcher):
+    """Reads the inotify events for the tftp root folder and its subfolders
+       as part of the asyncore loop. Updates the root index, and removes
+       changed files from the caches, as soon as a change is made"""
+
+    def __init__(self, server):
+        self.inotify = rootindex.Inotify()
+        asyncore.file_dispatcher.__init__(self, self.inotify.fileno())
+        self.server = server
+        self.index = server.root_index
+        # dictionaries of watch descriptor : folder, and folder : watch descriptor
+        self._folders = {}
+        self._watches = {}
+        self.watch_folders()
+
+    def watch_folders(self):
+        "Adds a watch to each indexed folder not yet watched"
+        for relfolder in self.index.folders():
+            if relfolder in self._watches:
+                continue
+            try:
+                wd = self.inotify.add_watch(self.index.fullpath(relfolder))
+            except OSError:
+                # Most likely the limit of watches has been reached, changes
+                # in this folder are found by the periodic index refresh
+                continue
+            self._watches[relfolder] = wd
+            self._folders[wd] = relfolder
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        "Apply each waiting event to the root index"
+        rescan = False
+        new_folders = False
+        for wd, mask, name in self.inotify.read_events():
+            if mask & rootindex.IN_Q_OVERFLOW:
+                # events have been lost
+                rescan = True
+                continue
+            relfolder = self._folders.get(wd)
+            if relfolder is None:
+                continue
+            if mask & rootindex.IN_IGNORED:
+                # the watch has gone, as the folder has been removed
+                del self._folders[wd]
+                self._watches.pop(relfolder, None)
+                continue
+            # events about the folder itself are also given, with its name, to its parent
+            if not name or name.startswith("."):
+                continue
+            if relfolder:
+                relpath = relfolder + "/" + name
+            else:
+                relpath = name
+            if mask & rootindex.IN_ISDIR:
+                self.index.update(relpath)
+                new_folders = True
+            elif mask & rootindex.IN_MODIFY or (mask & rootindex.IN_CREATE and self.is_new_file(relpath)):
+                # not found by requests until IN_CLOSE_WRITE
+                self.index.mark_writing(relpath)
+            else:
+                self.index.update(relpath)
+            self.server.path_changed(relpath)
+        if rescan:
+            self.index.scan()
+            self.server.clear_caches()
+            new_folders = True
+        if new_folders:
+            self.watch_folders()
+
+    def is_new_file(self, relpath):
+        """Returns True if relpath is an empty file, just created, so
+           probably about to be written, rather than linked or renamed"""
+        path = self.index.fullpath(relpath)
+        try:
+            return (not os.path.islink(path)) and os.path.getsize(path) == 0
+        except OSError:
+            return False
+
+    def handle_error(self):
+        "On an error, stop watching, changes are then found by checking folders"
+        self.server.add_text("Stopped watching the tftp root folder for changes")
+        self.close()
+        if self.server.root_watcher is self:
+            self.server.root_watcher = None
+            self.server.next_index_refresh()
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        self.inotify.close()
+
+
 # opcode   operation
 # 1         Read request           (RRQ)
 # 2         Write request          (WRQ)
@@ -580,6 +1930,8 @@ class Connection(object):
 
     def __init__(self, server, rx_data, rx_addr):
         "New connection, check header"
+        # the TFTPserver socket the connection is made through
+        self.tftp_server = server.tftp_server
         # check if the caller is from an allowed address
         if not server.anyclient :
             if not ipv4.address_in_subnet(rx_addr[0],
@@ -616,23 +1968,35 @@ class Connection(object):
             if len(self.filename) == 1:
                 raise DropPacket
             self.filename=self.filename[1:]
-        # filename must not start with a . character
-        if self.filename[0] == ".":
-            raise DropPacket    
-        # The filename should only contain the printable characters, A-Z a-z 0-9 -_ or .
-        # Temporarily replace any instances of the ._- characters with "x"
-        temp_filename=self.filename.replace(".", "x")
-        temp_filename=temp_filename.replace("-", "x")
-        temp_filename=temp_filename.replace("_", "x")
-        # Check all characters are alphanumeric
-        if not temp_filename.isalnum():
+        # The filename may give a path to a file in a subfolder of the tftp
+        # root folder, split it into its parts, accepting / or \ separators
+        filename_parts = self.filename.replace("\\", "/").split("/")
+        if len(filename_parts) > 1 and not server.subfolders:
             raise DropPacket
+        for part in filename_parts:
+            # each part must be at least one character, this rejects //
+            if not part:
+                raise DropPacket
+            # each part must not start with a . character, this rejects
+            # hidden files and folders, and the parent folder ..
+            if part[0] == ".":
+                raise DropPacket
+            # Each part should only contain the printable characters, A-Z a-z 0-9 -_ or .
+            # Temporarily replace any instances of the ._- characters with "x"
+            temp_part=part.replace(".", "x")
+            temp_part=temp_part.replace("-", "x")
+            temp_part=temp_part.replace("_", "x")
+            # Check all characters are alphanumeric
+            if not temp_part.isalnum():
+                raise DropPacket
+        # self.filename is the path relative to the tftp root folder, with / separators
+        self.filename = "/".join(filename_parts)
         # Check this filename is not being altered by a ReceiveData connection
         for conn in server.get_connections_list():
             if self.filename == conn.filename and isinstance(conn, ReceiveData):
                 raise DropPacket
         # so self.filename is the file to be acted upon, set the filepath
-        self.filepath=os.path.join(server.tftprootfolder,self.filename)
+        self.filepath=os.path.join(server.tftprootfolder, *filename_parts)
 
         # check header for options
         self.request_options = {}
@@ -641,6 +2005,8 @@ class Connection(object):
 
         # Set block size
         self.blksize = 512
+        # tsize is the transfer size option, None if not requested
+        self.tsize = None
 
         try:
             # Get any tftp options
@@ -671,15 +2037,25 @@ class Connection(object):
                         self.blksize = blksize
                         self.tx_data += "blksize\x00" + str(blksize) + "\x00"
                         self.options["blksize"] = str(blksize)
-                # elif "nextoption" in self.options:
-                    # for each further option to be implemented, use an elif chain here
-                    # and add the option name and value to tx_data
+                # check if tsize is in there
+                if "tsize" in self.request_options:
+                    tsize = int(self.request_options["tsize"])
+                    if tsize >= 0:
+                        self.tsize = tsize
+                        if rx_data[1] == "\x02":
+                            # The client is sending a file of this size, acknowledge it,
+                            # for a read request SendData replies with the file size
+                            self.tx_data += "tsize\x00" + str(tsize) + "\x00"
+                            self.options["tsize"] = str(tsize)
+                # for each further option to be implemented, add a test here
+                # and add the option name and value to tx_data
                 if not self.options:
                     # No options recognised
                     self.tx_data = None
         except Exception:
             # On any failure, ignore all options
             self.blksize = 512
+            self.tsize = None
             self.options = {}
             self.tx_data = None
  
@@ -687,6 +2063,12 @@ class Connection(object):
         # sent or received, if it goes over 30 seconds, something is wrong
         # and so the connection is terminated
         self.connection_time=time.time()
+        # the time the request was received, for the journal, with the number
+        # of packets sent again, and the outcome, one of journal.OUTCOMES,
+        # set as the transfer ends, "failed" if not set when shut down
+        self.start_time = self.connection_time
+        self.retransmits = 0
+        self.outcome = None
         # The second value in this blockcount is incremented for each packet
         self.blkcount=[0, "\x00\x00", 0]
         # fp is the file pointer used to read/write to disc
@@ -705,7 +2087,72 @@ class Connection(object):
         self.timer = Stopwatch()
         self.timeouts = 0
         self.last_packet = False
+        # the number of duplicate packets received for the current block,
+        # and whether the fast retransmit of it has been done
+        self.duplicates = 0
+        self.fast_retransmitted = False
+        # used by the tracer, the time the request was read, until the first
+        # packet is sent, the time the last packet was read, until answered,
+        # and the list of timeline events, if this client is traced
+        self.trace_admitted = None
+        self.trace_received = None
+        self.timeline = None
+        if server.tracer is not None:
+            server.tracer.admitted(self)
+
+    def add_option(self, option, value):
+        """Adds option and value to the option acknowledgement in tx_data,
+           creating the acknowledgement if there is none"""
+        if not self.tx_data:
+            self.tx_data = "\x00\x06"
+        self.tx_data += option + "\x00" + value + "\x00"
+        self.options[option] = value
+        self.re_tx_data = self.tx_data
+
+    def bytes_remaining(self):
+        "Returns the bytes still to be transferred, or None if unknown"
+        return None
 
+    def bytes_transferred(self):
+        "Returns the bytes of the file transferred so far, for the journal"
+        return 0
+
+    def transfer_size(self):
+        "Returns the size of the file, or None if not known"
+        return self.tsize
+
+    def previous_blockcount(self):
+        "Returns the two byte string of the block before the current one"
+        blkcount_int = self.blkcount[0]-1
+        if blkcount_int<0: blkcount_int=65535
+        return chr(blkcount_int//256) + chr(blkcount_int%256)
+
+    def duplicate_received(self, counter):
+        """Called when a duplicate of the packet which the last packet sent
+           answered is received, so that packet may have been lost.
+           The Sorcerer's Apprentice rule is kept - the last packet is never
+           sent again just because a duplicate arrived, but if the
+           fastretransmit option is set, once that many duplicates have
+           arrived it is sent again at once, only once for each block,
+           rather than waiting for the TTL to expire"""
+        self.server.counters[counter] += 1
+        self.duplicates += 1
+        if self.fast_retransmitted or not self.server.fastretransmit:
+            return
+        if self.duplicates < self.server.fastretransmit:
+            return
+        if self.tx_data or not self.timer.started or not self.re_tx_data:
+            # not waiting for a reply to a sent packet
+            return
+        self.fast_retransmitted = True
+        self.server.counters["fast_retransmits"] += 1
+        self.retransmits += 1
+        self.tx_data = self.re_tx_data
+
+    def new_block(self):
+        "Called as a packet for a new block is received, resets duplicate counting"
+        self.duplicates = 0
+        self.fast_retransmitted = False
 
     def increment_blockcount(self):
         """blkcount is a list, index 0 is blkcount_int holding
@@ -733,6 +2180,12 @@ class Connection(object):
             # Problem has ocurred, drop the connection
             self.shutdown()
             return
+        tracer = self.server.tracer
+        if tracer is not None:
+            tracer.sent(self, self.tx_data, self.connection_time, time.time())
+        counters = self.server.counters
+        counters["packets_sent"] += 1
+        counters["bytes_sent"] += sent
         self.tx_data=self.tx_data[sent:]
         if not self.tx_data:
             # All data has been sent
@@ -752,6 +2205,8 @@ class Connection(object):
             # connection time has been greater than 30 seconds
             # without a packet sent or received, something is wrong
             self.server.add_text("Connection from %s:%s timed out" % self.rx_addr)
+            if self.outcome is None:
+                self.outcome = "timeout"
             self.shutdown()
             return
         if self.expired:
@@ -768,11 +2223,15 @@ class Connection(object):
         self.timeouts += 1
         if self.timeouts <= 3:
             # send a re-try
+            self.server.counters["timeout_retransmits"] += 1
+            self.retransmits += 1
             self.tx_data=self.re_tx_data
             return
         # Tried four times, give up and set data to be an error value
         self.tx_data="\x00\x05\x00\x00Terminated due to timeout\x00"
         self.server.add_text("Connection to %s:%s terminated due to timeout" % self.rx_addr)
+        if self.outcome is None:
+            self.outcome = "timeout"
         # send and shutdown, don't wait for anything further
         self.last_packet = True
 
@@ -780,11 +2239,44 @@ class Connection(object):
         """Shuts down the connection by closing the file pointer and
            setting the expired flag to True.  Removes the connection from
            the servers connections dictionary"""            
-        if self.fp:
-            self.fp.close()
+        # the outcome is recorded only the first time
+        recorded = self.expired
+        self.close_file()
         self.expired = True
         self.tx_data=""
         self.server.del_connection(self)
+        if not recorded:
+            self.record_outcome()
+        if self.timeline is not None and self.server.tracer is not None:
+            self.server.tracer.finished(self, self.server.io_pool)
+
+    def record_outcome(self):
+        """Records the outcome of the transfer, as it ends, in the journal,
+           and publishes it to the subscribers to events"""
+        if self.outcome is None:
+            self.outcome = "failed"
+        server = self.server
+        if server.journal is not None:
+            server.journal.record(self.rx_addr, self.tftp_server.port, isinstance(self, ReceiveData),
+                                  self.filename, self.bytes_transferred(), self.blksize,
+                                  time.time() - self.start_time, self.retransmits, self.outcome)
+        if server.subscribers:
+            if self.outcome == "ok":
+                server.publish("completed", self)
+            else:
+                server.publish("failed", self)
+
+    def close_file(self):
+        """Closes self.fp, a file object is closed in the io pool
+           if there is one, as closing may wait on the disc"""
+        fp = self.fp
+        self.fp = None
+        if not fp:
+            return
+        if isinstance(fp, file) and self.server.io_pool is not None:
+            self.server.io_pool.submit(fp.close)
+        else:
+            fp.close()
 
     def __str__(self):
         "String value of connection, for diagnostic purposes"
@@ -800,31 +2292,213 @@ class SendData(Connection):
         Connection.__init__(self, server, rx_data, rx_addr)
         if rx_data[1] != "\x01" :
             raise DropPacket
-        if not os.path.exists(self.filepath) or os.path.isdir(self.filepath):
-            server.add_text("%s requested %s: file not found" % (rx_addr[0], self.filename))
+        if (self.mode != "octet") and (self.mode != "netascii"):
+            raise DropPacket
+        # If True this flag indicates shutdown on the next received packet 
+        self.last_receive = False
+        # the size of the file sent, once the last block is read,
+        # and the size of the file, once open
+        self.sent = 0
+        self.filesize = None
+        # The option acknowledgement, if any, is held back until the file
+        # is open, which may be done by a pool thread
+        self.oack = self.tx_data
+        self.tx_data = None
+        self.re_tx_data = None
+        # render_job is a fileio.Job while the file is being generated by the render hook
+        self.render_job = None
+        # open_job is a fileio.Job while the file is being opened by the io pool
+        self.open_job = None
+        # encode_job is a fileio.Job while the io pool reads a file sent as
+        # netascii, to encode it or to find its netascii size
+        self.encode_job = None
+        # the packetcache.PacketCache holding the packets of this file, and their key
+        self.packet_cache = None
+        self.packet_key = None
+        # rendered is True if the render hook handles this file, which may
+        # then exist for some clients and not others
+        self.rendered = False
+        renderer = server.get_renderer()
+        if renderer is not None and renderer.handles(self.filename):
+            self.rendered = True
+            data = renderer.lookup(self.filename, rx_addr)
+            if data is not None:
+                self.open_rendered(data)
+                return
+            # poll() carries on with the request once the file is rendered
+            self.render_job = renderer.submit(self.filename, rx_addr)
+            return
+        self.open_file()
+
+    def open_file(self):
+        """Opens the requested file, and starts sending it. If finding or
+           opening the file may wait on the disc, and there is an io pool,
+           this is done in a pool thread, and poll() carries on when done"""
+        if self.server.filecache > 0:
+            # created here, as the pool thread uses it
+            self.server.get_file_cache()
+        pool = self.server.get_io_pool()
+        if pool is None or self.opens_from_memory():
+            try:
+                prepared = self.prepare_open()
+            except (IOError, OSError), e:
+                self.unable_to_open(e)
+                return
+            self.file_prepared(prepared)
+            return
+        self.open_job = pool.submit(self.prepare_open)
+
+    def opens_from_memory(self):
+        """Returns True if prepare_open will not wait on the disc, as the
+           root index and file cache hold all it needs"""
+        server = self.server
+        if server.root_index is None:
+            return False
+        if server.lookup_path(self.filename) == "file":
+            return server.file_cache is not None and server.file_cache.fresh(self.filepath)
+        # not found, unless there is a compressed copy
+        return not (server.decompress and compressed.find_compressed(self.filename, server.is_file))
+
+    def prepare_open(self):
+        """Finds and opens the file, doing everything which may wait on the
+           disc, so it may be called in a pool thread. Returns None if the
+           file is not found, or a tuple of (compressed_path, opened, stat),
+           which is passed to file_prepared"""
+        server = self.server
+        # If the file does not exist, it may be served from a compressed copy
+        found = server.lookup_path(self.filename)
+        if server.decompress and found is None:
+            compressed_name = compressed.find_compressed(self.filename, server.is_file)
+            if compressed_name is not None:
+                compressed_path = os.path.join(server.tftprootfolder, *compressed_name.split("/"))
+                return (compressed_path, None, os.stat(compressed_path))
+        if found != "file":
+            return None
+        if server.file_cache is not None:
+            # share a descriptor kept open for recently served files
+            return (None, server.file_cache.prepare(self.filepath), None)
+        fp = open(self.filepath, "rb", server.readahead*1024)
+        fileio.fadvise(fp.fileno(), 0, 0, fileio.POSIX_FADV_SEQUENTIAL)
+        return (None, fp, os.fstat(fp.fileno()))
+
+    def unable_to_open(self, e):
+        "Sends an error, as the file could not be opened"
+        self.server.add_text("%s requested %s: unable to open file" % (self.rx_addr[0], self.filename))
+        # Send an error value
+        self.tx_data="\x00\x05\x00\x02Unable to open file\x00"
+        # send and shutdown, don't wait for anything further
+        self.last_packet = True
+
+    def file_prepared(self, prepared):
+        """Called with the result of prepare_open, in the engine thread,
+           and starts sending the file"""
+        if prepared is None:
+            self.server.file_not_found(self, cacheable=not self.rendered)
             # Send an error value
-            self.tx_data="\x00\x05\x00\x01File not found\x00"
+            self.tx_data=misses.FILE_NOT_FOUND
             # send and shutdown, don't wait for anything further
             self.last_packet = True
             return
-        # Open file for reading
+        compressed_path, opened, stat = prepared
+        # Open file for reading, netascii files are converted as they are read
         try:
-            if self.mode == "octet":
-                self.fp=open(self.filepath, "rb")
-            elif self.mode == "netascii":
-                self.fp=open(self.filepath, "r")
+            if compressed_path is not None:
+                self.fp=self.server.get_chunk_cache().open(compressed_path, stat)
+            elif stat is None:
+                self.fp=self.server.file_cache.open(self.filepath, opened)
+                stat = self.fp.stat
             else:
-                raise DropPacket
-        except IOError, e:
-            server.add_text("%s requested %s: unable to open file" % (rx_addr[0], self.filename))
-            # Send an error value
-            self.tx_data="\x00\x05\x00\x02Unable to open file\x00"
-            # send and shutdown, don't wait for anything further
-            self.last_packet = True
+                self.fp=opened
+        except (IOError, OSError), e:
+            self.unable_to_open(e)
             return
-        server.add_text("Sending %s to %s" % (self.filename, rx_addr[0]))
-        # If True this flag indicates shutdown on the next received packet 
-        self.last_receive = False
+        # The file size, used to show the progress of the transfer,
+        # and to answer the tsize option
+        size_known = True
+        if compressed_path is not None:
+            self.filesize = self.fp.size
+            if self.filesize is None or self.mode == "netascii":
+                # Not known until the file has been decompressed, so
+                # estimate it from the compressed size for the progress shown
+                size_known = False
+                self.filesize = stat.st_size
+            if self.mode == "netascii":
+                self.fp = netascii.EncodingReader(self.fp)
+        else:
+            self.filesize = stat.st_size
+            if self.mode == "octet":
+                # the packets of the file may be held, or built, in the packet cache
+                self.packet_cache = self.server.get_packet_cache()
+                if self.packet_cache is not None:
+                    self.packet_key = self.packet_cache.key(self.filepath, stat, self.blksize)
+            if self.mode == "netascii":
+                # use the cached netascii form of the file, if it is small enough to be cached
+                cache = self.server.get_netascii_cache()
+                data = cache.lookup(self.filepath, stat)
+                if data is None:
+                    whole = cache.cacheable(stat)
+                    pool = self.server.get_io_pool()
+                    if pool is not None and (whole or self.tsize is not None):
+                        # the whole file is read to encode it, or to find its
+                        # netascii size, in the io pool, poll() carries on when done
+                        self.encode_job = pool.submit(netascii.encode_path, self.filepath, stat, whole)
+                        self.encode_stat = stat
+                        return
+                    if whole:
+                        data = netascii.encode_file(self.fp)
+                        cache.add(self.filepath, stat, data)
+                if data is not None:
+                    self.send_encoded(data)
+                else:
+                    self.fp = netascii.EncodingReader(self.fp)
+                    # the netascii size is only found by reading the whole
+                    # file, which is left to the io pool, so tsize is not answered
+                    size_known = False
+        self.start_sending(size_known)
+
+    def send_encoded(self, data):
+        "Sends data, the whole of the file in netascii, in place of the file"
+        self.close_file()
+        self.fp = cStringIO.StringIO(data)
+        self.filesize = len(data)
+
+    def file_encoded(self, job):
+        """Called once the io pool has read the file sent as netascii, with
+           the encode_job, and starts sending the file"""
+        if job.error is not None:
+            self.unable_to_open(job.error)
+            return
+        size_known = True
+        if isinstance(job.result, str):
+            self.server.get_netascii_cache().add(self.filepath, self.encode_stat, job.result)
+            self.send_encoded(job.result)
+        else:
+            self.fp = netascii.EncodingReader(self.fp)
+            if job.result is None:
+                # the file has changed since it was opened
+                size_known = False
+            else:
+                self.filesize = job.result
+        self.start_sending(size_known)
+
+    def open_rendered(self, data):
+        "Starts sending data, generated by the render hook, as the file"
+        if self.mode == "netascii":
+            encoder = netascii.Encoder()
+            data = encoder.encode(data) + encoder.flush()
+        self.fp = cStringIO.StringIO(data)
+        self.filesize = len(data)
+        self.start_sending(True)
+
+    def start_sending(self, size_known):
+        """Called once the file is open, sends the first packet,
+           size_known is True if self.filesize is exact"""
+        self.tx_data = self.oack
+        self.re_tx_data = self.oack
+        if self.tsize is not None and size_known:
+            # The client has asked for the file size
+            self.add_option("tsize", str(self.filesize))
+        self.server.add_text("Sending %s to %s" % (self.filename, self.rx_addr[0]))
         # If self.tx_data has contents, this will be because the parent Connections
         # class is acknowledging an option
         # If there is nothing in self.tx_data, get the first payload
@@ -832,23 +2506,129 @@ class SendData(Connection):
             # Make the first packet, call get_payload to put the data into tx_data
             self.get_payload()
 
+    def poll(self):
+        """Carries on with the request once any render or open job is done,
+           then checks timers"""
+        if self.open_job is not None and self.open_job.done and not self.expired:
+            job = self.open_job
+            self.open_job = None
+            if job.error is not None:
+                self.unable_to_open(job.error)
+            else:
+                self.file_prepared(job.result)
+        if self.encode_job is not None and self.encode_job.done and not self.expired:
+            job = self.encode_job
+            self.encode_job = None
+            self.file_encoded(job)
+        if self.render_job is not None and self.render_job.done and not self.expired:
+            job = self.render_job
+            self.render_job = None
+            if self.server.renderer is not None:
+                self.server.renderer.finished(job)
+            if job.error is not None:
+                self.server.log_exception(job.error)
+                self.server.add_text("%s requested %s: unable to render file" % (self.rx_addr[0], self.filename))
+                self.tx_data="\x00\x05\x00\x00Unable to render file\x00"
+                # send and shutdown, don't wait for anything further
+                self.last_packet = True
+            elif job.result is None:
+                # the hook has declined to render it, so read the file as normal
+                self.open_file()
+            else:
+                self.open_rendered(job.result)
+        Connection.poll(self)
+
+    def bytes_remaining(self):
+        "Returns the bytes still to be sent"
+        if self.fp is None:
+            return 0
+        return max(self.filesize - self.blksize*self.blkcount[2], 0)
+
+    def bytes_transferred(self):
+        "Returns the bytes of the file acknowledged by the client"
+        if self.outcome == "ok":
+            return self.sent
+        return self.blksize*max(self.blkcount[2]-1, 0)
+
+    def transfer_size(self):
+        "Returns the size of the file, or None if not yet open"
+        return self.filesize
+
     def get_payload(self):
         """Read file, a block of self.blksize bytes at a time which is put
-           into re_tx_data and tx_data."""
+           into re_tx_data and tx_data. If the packet cache holds the
+           packet, it is used instead of reading the file"""
         assert not self.last_receive
-        payload=self.fp.read(self.blksize)
-        if len(payload) < self.blksize:
+        index = self.blkcount[2]
+        packet = None
+        if self.packet_key is not None:
+            packet = self.packet_cache.get(self.packet_key, index)
+        if packet is not None:
+            payload_length = len(packet) - 4
+        else:
+            payload = self.read_payload()
+            if payload is None:
+                return
+            payload_length = len(payload)
+        if payload_length < self.blksize:
             # The file is read, and no further data is available
-            self.fp.close()
-            self.fp = None
-            bytes = self.blksize*self.blkcount[2] + len(payload)
+            self.close_file()
+            bytes = self.blksize*self.blkcount[2] + payload_length
             self.server.add_text("%s bytes of %s sent to %s" % (bytes, self.filename, self.rx_addr[0]))
+            self.sent = bytes
             # shutdown on receiving the next ack
             self.last_receive = True
         self.increment_blockcount()
-        self.re_tx_data="\x00\x03"+self.blkcount[1]+payload
+        if packet is None:
+            packet = "\x00\x03"+self.blkcount[1]+payload
+            if self.packet_key is not None:
+                self.packet_cache.put(self.packet_key, index, packet)
+        self.re_tx_data=packet
         self.tx_data=self.re_tx_data
 
+    def read_payload(self):
+        """Reads the next block from the file, returns None on
+           failure, having set an error to be sent"""
+        try:
+            if self.packet_key is not None:
+                position = self.blksize*self.blkcount[2]
+                if self.fp.tell() != position:
+                    # earlier packets were taken from the packet cache
+                    self.fp.seek(position)
+            tracer = self.server.tracer
+            if tracer is None:
+                return self.fp.read(self.blksize)
+            start = time.time()
+            payload = self.fp.read(self.blksize)
+            tracer.disk_read(self, start, time.time())
+            return payload
+        except Exception, e:
+            # a read error, or a corrupt compressed file
+            self.server.log_exception(e)
+            self.server.add_text("%s requested %s: unable to read file" % (self.rx_addr[0], self.filename))
+            self.tx_data="\x00\x05\x00\x00Unable to read file\x00"
+            # send and shutdown, don't wait for anything further
+            self.last_packet = True
+            return None
+
+    def shutdown(self):
+        """Shuts down the connection, a file still being opened
+           by the io pool is closed when the pool is done with it"""
+        if self.open_job is not None:
+            self.server.abandon_job(self.open_job, self.close_prepared)
+            self.open_job = None
+        Connection.shutdown(self)
+
+    def close_prepared(self, prepared):
+        "Closes the file opened by prepare_open, which is no longer wanted"
+        if prepared is None:
+            return
+        compressed_path, opened, stat = prepared
+        if stat is None:
+            self.server.file_cache.release_prepared(opened)
+        elif opened is not None:
+            opened.close()
+
     def incoming_data(self, rx_data):
         """Handles incoming data - these should be acks from the client
            for each data packet sent"""
@@ -879,6 +2659,7 @@ class SendData(Connection):
             except Exception:
                 # If error trying to read error type, just ignore
                 pass
+            self.outcome = "cancelled"
             self.shutdown()
             return
         if rx_data[1] != "\x04" :
@@ -888,8 +2669,13 @@ class SendData(Connection):
         # Check blockcount is ok
         rx_blkcount=rx_data[2:4]
         if self.blkcount[1] != rx_blkcount:
+            if rx_blkcount == self.previous_blockcount():
+                # a duplicate ack for the block before, the client may
+                # not have received the last data packet
+                self.duplicate_received("duplicate_acks")
             # wrong blockcount, ignore it
             return
+        self.new_block()
         # Received ack packet ok
         # re-set connection time to current time
         self.connection_time=time.time()
@@ -898,6 +2684,7 @@ class SendData(Connection):
         self.timer.stop()
         if self.last_receive:
             # file is fully read and sent, so shutdown
+            self.outcome = "ok"
             self.shutdown()
             return
         # Must create another packet to send
@@ -911,36 +2698,106 @@ class ReceiveData(Connection):
         Connection.__init__(self, server, rx_data, rx_addr)
         if rx_data[1] != "\x02" :
             raise DropPacket
-        if os.path.exists(self.filepath):
-            server.add_text("%s trying to send %s: file already exists" % (rx_addr[0], self.filename))
-            # Send an error value
-            self.tx_data="\x00\x05\x00\x06File already exists\x00"
-            # send and shutdown, don't wait for anything further
-            self.last_packet = True
+        # upload is the fileio.AtomicFile being written, and if writebehind
+        # is set, writer is a fileio.FileWriter writing it in another thread
+        self.upload = None
+        self.writer = None
+        # ack_pending is True while an acknowledgement is held back
+        # waiting for the writer, and final_block when the last has arrived
+        self.ack_pending = False
+        self.final_block = False
+        # the size of the file, once the last block has arrived
+        self.received = 0
+        if self.mode == "octet":
+            self.decoder = None
+        elif self.mode == "netascii":
+            # netascii is converted to local text as it is received
+            self.decoder = netascii.Decoder()
+        else:
+            raise DropPacket
+        if server.fsyncpolicy == "group":
+            # created here, as the pool thread uses it
+            server.get_group_sync()
+        # The option acknowledgement, if any, is held back until the file is open
+        self.oack = self.tx_data
+        self.tx_data = None
+        self.re_tx_data = None
+        # open_job is a fileio.Job while the file is being opened by the io pool
+        self.open_job = None
+        pool = server.get_io_pool()
+        if pool is None or (server.root_index is not None and server.lookup_path(self.filename) is not None):
+            # without a pool, or if the file already exists, no need to wait for the pool
+            try:
+                prepared = self.prepare_upload()
+            except (IOError, OSError), e:
+                self.unable_to_open(e)
+                return
+            self.upload_prepared(prepared)
             return
-        # Open filename for writing
-        try:
-            if self.mode == "octet":
-                self.fp=open(self.filepath, "wb")
-            elif self.mode == "netascii":
-                self.fp=open(self.filepath, "w")
+        self.open_job = pool.submit(self.prepare_upload)
+
+    def prepare_upload(self):
+        """Checks the file may be written, and opens a temporary file for
+           it, doing everything which may wait on the disc, so it may be
+           called in a pool thread. Returns a fileio.AtomicFile, or the
+           error packet to send"""
+        server = self.server
+        if server.lookup_path(self.filename) is not None:
+            return "\x00\x05\x00\x06File already exists\x00"
+        folder = "/".join(self.filename.split("/")[:-1])
+        if folder and server.lookup_path(folder) != "folder":
+            return "\x00\x05\x00\x01Folder not found\x00"
+        # Open a temporary file for writing, renamed to filename when complete
+        return fileio.AtomicFile(self.filepath, "wb", min(self.tsize or 0, PREALLOCATE_LIMIT),
+                                 fsync=(server.fsyncpolicy == "file"), syncer=server.group_sync)
+
+    def unable_to_open(self, e):
+        "Sends an error, as the file could not be opened"
+        self.server.add_text("%s trying to send %s: unable to open file" % (self.rx_addr[0], self.filename))
+        # Send an error value
+        self.tx_data="\x00\x05\x00\x02Unable to open file\x00"
+        # send and shutdown, don't wait for anything further
+        self.last_packet = True
+
+    def upload_prepared(self, prepared):
+        """Called with the result of prepare_upload, in the engine thread,
+           and acknowledges the request"""
+        server = self.server
+        if not isinstance(prepared, fileio.AtomicFile):
+            if "exists" in prepared:
+                server.add_text("%s trying to send %s: file already exists" % (self.rx_addr[0], self.filename))
             else:
-                raise DropPacket
-        except IOError, e:
-            server.add_text("%s trying to send %s: unable to open file" % (rx_addr[0], self.filename))
-            # Send an error value
-            self.tx_data="\x00\x05\x00\x02Unable to open file\x00"
+                server.add_text("%s trying to send %s: folder not found" % (self.rx_addr[0], self.filename))
+            # Send the error
+            self.tx_data=prepared
             # send and shutdown, don't wait for anything further
             self.last_packet = True
             return
-        server.add_text("Receiving %s from %s" % (self.filename, rx_addr[0]))
+        self.upload = prepared
+        server.add_text("Receiving %s from %s" % (self.filename, self.rx_addr[0]))
+        if server.writebehind:
+            self.writer = server.get_writer_pool().writer(self.upload, server.writequeue*1024)
         # Create next packet
-        # If self.tx_data has contents, this will be because the parent Connections
+        # If self.oack has contents, this will be because the parent Connections
         # class is acknowledging an option
-        # If there is nothing in self.tx_data, create an acknowledgement
-        if not self.tx_data:
+        # If there is nothing in self.oack, create an acknowledgement
+        if self.oack:
+            self.re_tx_data=self.oack
+        else:
             self.re_tx_data="\x00\x04"+self.blkcount[1]
-            self.tx_data=self.re_tx_data
+        self.tx_data=self.re_tx_data
+
+    def bytes_remaining(self):
+        "Returns the bytes still to be received, or None if the client did not give tsize"
+        if not self.tsize:
+            return None
+        return max(self.tsize - self.blksize*self.blkcount[2], 0)
+
+    def bytes_transferred(self):
+        "Returns the bytes of the file received"
+        if self.final_block:
+            return self.received
+        return self.blksize*self.blkcount[2]
 
     def incoming_data(self, rx_data):
         """Handles incoming data, these should contain the data to be saved to a file"""
@@ -971,6 +2828,7 @@ class ReceiveData(Connection):
             except Exception:
                 # If error trying to read error type, just ignore
                 pass
+            self.outcome = "cancelled"
             self.shutdown()
             return
         if rx_data[1] != "\x03":
@@ -983,7 +2841,12 @@ class ReceiveData(Connection):
         if self.blkcount[1] != rx_blkcount:
             # Blockcount mismatch, ignore it
             self.blkcount = old_blockcount
+            if rx_blkcount == self.blkcount[1] and not self.ack_pending:
+                # data already acknowledged, the client may not have
+                # received the acknowledgement
+                self.duplicate_received("duplicate_data")
             return
+        self.new_block()
         # re-set any timouts
         self.timeouts = 0
         self.timer.stop()
@@ -997,27 +2860,123 @@ class ReceiveData(Connection):
         # Received packet ok
         # Make an acknowledgement packet
         self.re_tx_data="\x00\x04"+self.blkcount[1]
-        self.tx_data=self.re_tx_data
-        # Write the received data to file
-        if len(payload)>0:
-            self.fp.write(payload)
         if len(payload)<self.blksize:
-            # flag all data is written and this ack is the last packet
+            self.final_block = True
+            self.received = self.blksize*old_blockcount[2] + len(payload)
+        if self.decoder is not None:
+            payload = self.decoder.decode(payload)
+            if self.final_block:
+                payload += self.decoder.flush()
+        if self.writer is not None:
+            # Pass the data to the writer thread
+            if len(payload)>0:
+                self.writer.write(payload)
+            if self.final_block:
+                self.writer.close()
+        else:
+            # Write the received data to file
+            try:
+                if len(payload)>0:
+                    self.upload.write(payload)
+                if self.final_block:
+                    self.upload.close()
+            except (IOError, OSError), e:
+                self.upload.fail(e)
+        # the acknowledgement is sent by release_ack
+        self.ack_pending = True
+        self.release_ack()
+
+    def release_ack(self):
+        """Sends a held back acknowledgement once the writer queue is no
+           longer full, or for the final block, once the file is complete.
+           So a slow disc only slows down the client sending to it"""
+        if not self.ack_pending:
+            return
+        error = self.upload.error
+        if error is None and self.writer is not None:
+            error = self.writer.error
+        if error is not None:
+            self.ack_pending = False
+            self.server.log_exception(error)
+            self.server.add_text("%s sending %s: unable to write file" % (self.rx_addr[0], self.filename))
+            self.tx_data="\x00\x05\x00\x03Unable to write file\x00"
+            # send and shutdown, don't wait for anything further
+            self.last_packet = True
+            return
+        if self.final_block:
+            if not self.upload.done:
+                return
+            self.ack_pending = False
+            self.server.update_path(self.filename)
+            self.tx_data=self.re_tx_data
+            # this ack is the last packet
             self.last_packet = True
-            self.fp.close()
-            self.fp=None
-            bytes = self.blksize*old_blockcount[2] + len(payload)
-            self.server.add_text("%s bytes of %s received from %s" % (bytes, self.filename, self.rx_addr[0]))
+            self.server.add_text("%s bytes of %s received from %s" % (self.received, self.filename, self.rx_addr[0]))
+            self.outcome = "ok"
+            return
+        if self.writer is not None and self.writer.full:
+            return
+        self.ack_pending = False
+        self.tx_data=self.re_tx_data
+
+    def poll(self):
+        """Carries on with the request once any open job is done, sends
+           any held back acknowledgement, then checks timers"""
+        if self.open_job is not None and self.open_job.done and not self.expired:
+            job = self.open_job
+            self.open_job = None
+            if job.error is not None:
+                self.unable_to_open(job.error)
+            else:
+                self.upload_prepared(job.result)
+        if not self.expired:
+            self.release_ack()
+        Connection.poll(self)
+
+    def shutdown(self):
+        """Shuts down the connection, if the file has not been
+           fully received, the temporary file is removed"""
+        if self.open_job is not None:
+            # the temporary file is removed when the pool has created it
+            self.server.abandon_job(self.open_job, self.abort_prepared)
+            self.open_job = None
+        if self.upload is not None and not self.final_block:
+            if self.writer is not None:
+                self.writer.abort()
+            elif self.server.io_pool is not None:
+                self.server.io_pool.submit(self.upload.abort)
+            else:
+                self.upload.abort()
+        Connection.shutdown(self)
+
+    def abort_prepared(self, prepared):
+        "Removes the temporary file opened by prepare_upload, which is no longer wanted"
+        if isinstance(prepared, fileio.AtomicFile):
+            prepared.abort()
 
 
 #### The loop ####
 
+def wait_idle(timeout=IDLE_WAIT):
+    """Waits up to timeout seconds in select for a packet, or for a socket
+       to be ready to send, which asyncore then handles. So an idle loop
+       uses no processor time, yet a packet arriving, such as one to be
+       forwarded to the old process during a restart, is handled at once.
+       If there are no sockets, as every listener has failed, sleeps"""
+    if asyncore.socket_map:
+        asyncore.poll(timeout)
+    else:
+        time.sleep(timeout)
+
 def loop_nogui(server):
     """This loop is run if there is no gui
        It sets server.serving attribute.
        Then enters loop, calling server.poll()
        If an exception
-       occurs, then exits loop
+       occurs, then exits loop.
+       If server.reload_requested is set, the config file is read again.
+       If server.serving is cleared, by a signal handler, the server
+       drains, printing its progress, and the loop exits once it stops
        """
     # create logger
     rootLogger = create_logger(server.logfolder)
@@ -1026,13 +2985,22 @@ def loop_nogui(server):
 
     # set server to listen
     server.serving = True
+    next_print = 0.0
     try:
         # This is the main loop
         while True:
             server.poll()
+            if server.reload_requested:
+                reload_listeners([server], add=False)
+            if not server.listening:
+                # stopped
+                break
+            if server.draining and time.time() >= next_print:
+                print server.drain_text
+                next_print = time.time() + DRAIN_PRINT
             if not len(server):
-                # There are no connections so put in a sleep
-                time.sleep(0.1)
+                # There are no connections so wait for a packet
+                wait_idle()
     except Exception, e:
         # log the exception and exit the main loop
         server.log_exception(e)
@@ -1051,7 +3019,11 @@ def loop(server):
        it does not exit the loop if a NoService
        exception occurs.
        If the other thread sets server.break_loop to
-       True, then the loop exists and shuts down the server"""
+       True, then the loop exists and shuts down the server.
+       If it sets server.new_config, this is applied with server.reload(),
+       and the result given in server.reloaded
+       Once a new process has taken over the port, on a restart, the
+       loop exits when the server has drained"""
 
     # create logger
     rootLogger = create_logger(server.logfolder)
@@ -1063,11 +3035,28 @@ def loop(server):
         while not server.break_loop:
             try:
                 server.poll()
-                if server.serving:
+                if server.new_config is not None:
+                    cfgdict = server.new_config
+                    server.new_config = None
+                    count = server.reloaded[0] + 1
+                    try:
+                        server.reload(cfgdict)
+                    except NoService:
+                        server.add_text("Unable to bind to %s:%s, configuration not changed" % (
+                                        cfgdict["listenipaddress"], cfgdict["listenport"]))
+                        server.reloaded = (count, cfgdict, False)
+                        raise
+                    server.reloaded = (count, cfgdict, True)
+                if server.reload_requested:
+                    reload_listeners([server], add=False)
+                if server.shared.stopping and not server.listening:
+                    # taken over by a new process, and drained
+                    break
+                if server.serving or server.draining:
                     if not len(server):
                         # The server is serving, but there are no
-                        # connections so put in a sleep
-                        time.sleep(0.1)
+                        # connections so wait for a packet
+                        wait_idle()
                 else:
                     # if the server is not serving, put a sleep in the loop
                     time.sleep(0.25)
@@ -1087,12 +3076,78 @@ def loop(server):
     return 0
 
 
-def loop_multiserver(server_list):
-    """This loop is run with a list of servers
+def reload_listeners(server_list, add=True):
+    """Reads the config file again, and applies it to server_list, a list of
+       ServerState instances sharing one SharedResources, without stopping
+       transfers in progress. Returns the new list of servers, if add is True,
+       a listener new to the config file is added, and one removed from it is
+       drained, and shut down once stopped by the loop"""
+    for server in server_list:
+        server.reload_requested = False
+    try:
+        cfgdict = tftpcfg.getconfigstrict(tftpcfg.SCRIPTDIRECTORY, tftpcfg.CONFIGFILE)
+        listeners = tftpcfg.getlisteners(cfgdict)
+    except tftpcfg.ConfigError, e:
+        server_list[0].add_text("Config file not reloaded: %s" % e)
+        return server_list
+    if not add:
+        listeners = listeners[:len(server_list)]
+    # dictionary of name : server, the first is always named main
+    current = {}
+    for server in server_list:
+        current[server.name or "main"] = server
+    new_list = []
+    for name, cfgdict in listeners:
+        server = current.pop(name, None)
+        if server is None:
+            server = ServerState(server_list[0].shared, **cfgdict)
+            server.name = name
+            server.logging_enabled = server_list[0].logging_enabled
+            server.serving = True
+            server.add_text("Listener added")
+        elif not server.draining:
+            try:
+                server.reload(cfgdict)
+            except NoService, e:
+                server.log_exception(e)
+                server.add_text("Unable to bind to %s:%s, configuration not changed" % (
+                                cfgdict["listenipaddress"], cfgdict["listenport"]))
+        new_list.append(server)
+    for server in current.values():
+        # removed from the config file
+        if not server.draining:
+            server.drain()
+        new_list.append(server)
+    return new_list
+
+
+def create_listeners(listeners):
+    """Returns a list of ServerState instances sharing one SharedResources,
+       listeners is a list of (name, cfgdict) as given by tftpcfg.getlisteners()"""
+    shared = SharedResources()
+    server_list = []
+    for name, cfgdict in listeners:
+        server = ServerState(shared, **cfgdict)
+        if len(listeners) > 1:
+            server.name = name
+        server_list.append(server)
+    return server_list
+
 
-       This is an experimental loop, showing that if multiple servers
-       are given (each with different ports) - then multiple tftp servers
-       can operate
+def loop_multiserver(server_list):
+    """This loop is run with a list of servers, each listening on its
+       own address and port, normally created by create_listeners()
+
+       A server which is unable to bind, or raises an exception, is stopped
+       and started again after RETRY_INTERVAL seconds, the others carry on.
+       The loop exits only if no server can be started at all.
+       If reload_requested is set on any server, the config file is read
+       again, and listeners added or removed. If shared.stopping is set,
+       and serving cleared, each server drains, and the loop exits once
+       every server has stopped, as it does once a new process has taken
+       over each port, on a restart.
+       While there are no transfers, the loop waits in select until a
+       packet arrives, so uses no processor time
        """
 
     # create logger, using logfolder given by the
@@ -1106,20 +3161,74 @@ def loop_multiserver(server_list):
     for server in server_list:
         server.serving = True
 
+    # dictionary of failed server : time to start it again
+    failed = {}
+    started = False
+    next_print = 0.0
     try:
         # This is the main loop
-        while True:
+        while server_list:
+            now = time.time()
+            for server in server_list[:]:
+                if server in failed:
+                    if server.shared.stopping:
+                        # not started again
+                        del failed[server]
+                        server.shutdown()
+                        server_list.remove(server)
+                        continue
+                    if now < failed[server]:
+                        continue
+                    del failed[server]
+                    server.serving = True
+                try:
+                    server.poll()
+                    if not server.listening:
+                        # drained, on stopping or removal from the config file
+                        server.shutdown()
+                        server_list.remove(server)
+                except Exception, e:
+                    server.log_exception(e)
+                    if isinstance(e, NoService):
+                        server.add_text("Unable to bind to %s:%s" % (server.listenipaddress or "0.0.0.0",
+                                                                      server.listenport))
+                    else:
+                        server.add_text("Listener failed with error %s" % e)
+                    try:
+                        server.stop_serving()
+                    except Exception, e:
+                        server.log_exception(e)
+                    server.add_text("Listener restarts in %s seconds" % int(RETRY_INTERVAL))
+                    failed[server] = now + RETRY_INTERVAL
             for server in server_list:
-                server.poll()
-    except Exception, e:
-        # log the exception and exit the main loop
-        server.log_exception(e)
-        print server.text
-        return 1
+                if server.reload_requested and not server.shared.stopping:
+                    server_list[:] = reload_listeners(server_list)
+                    break
+            if now >= next_print:
+                draining = [server.drain_text for server in server_list if server.draining]
+                if draining:
+                    print "\n".join(draining)
+                    next_print = now + DRAIN_PRINT
+            if not server_list:
+                break
+            if not started:
+                if len(failed) == len(server_list):
+                    # no server could be started
+                    for server in server_list:
+                        print server.text
+                    return 1
+                started = True
+            # wait for a packet, or for a socket to be ready to send
+            for server in server_list:
+                if len(server):
+                    wait_idle(TRANSFER_WAIT)
+                    break
+            else:
+                wait_idle()
     except KeyboardInterrupt:
         return 0
     finally:
         # shutdown the servers
         for server in server_list:
-            server.shutdown()   
+            server.shutdown()
     return 0
@@ -41,6 +41,13 @@ the setup values, these being:
  clientmask      - specific subnet mask of the client
  listenport      - tftp port to listen on
  listenipaddress - address to listen on
+
+together with the optional values of the [Tuning] section, which are
+not set via the GUI and are listed in TUNING_OPTIONS below.
+
+Further listeners may be given by sections named [Listener name], each
+giving the LISTENER_OPTIONS which differ from those above, these are
+returned by getlisteners().
 """
 
 from __future__ import with_statement
@@ -61,6 +68,150 @@ class ConfigError(Exception):
     """The configuration has an error"""
     pass
 
+
+def _to_bool(value):
+    "Converts a config file string of 0 or 1 to a boolean"
+    return bool(int(value))
+
+# Optional settings held in the [Tuning] section of the config file.
+# None of these are set via the GUI, and if the section or an option
+# is absent the default given here is used, so older config files
+# remain valid. Each entry is (option, conversion function, default),
+# the defaults keep the behaviour of versions without the option
+TUNING_OPTIONS = [
+    # writebehind - 1 to write received files from a background thread,
+    # so a slow disc does not hold up other transfers, 0 to write directly
+    ("writebehind", _to_bool, False),
+    # writequeue - KB of received data which may wait to be written for
+    # each upload, when full, acknowledgements to that client are delayed
+    ("writequeue", int, 1024),
+    # writerthreads - number of background threads writing to disc
+    ("writerthreads", int, 1),
+    # fsyncpolicy - "none" leaves received files to be flushed to disc by
+    # the operating system, "file" flushes each before it is acknowledged,
+    # "group" flushes files completing together as a batch
+    ("fsyncpolicy", str, "none"),
+    # fsyncdelay - milliseconds the group policy waits to collect a batch
+    ("fsyncdelay", int, 20),
+    # netasciicache - KB of memory holding the netascii form of files
+    # sent in netascii mode, so repeated requests need no conversion
+    ("netasciicache", int, 4096),
+    # decompress - 1 to serve a requested file from a .gz or .xz
+    # compressed copy if the file itself does not exist
+    ("decompress", _to_bool, False),
+    # decompresscache - KB of memory holding decompressed data, shared
+    # by clients reading the same compressed file
+    ("decompresscache", int, 32768),
+    # renderhook - empty for none, "template" to generate a file 'name'
+    # from 'name.template' for each client, or the path of a Python file
+    # defining render(filename, client_address), see render.py
+    ("renderhook", str, ""),
+    # renderthreads - number of threads running the render hook
+    ("renderthreads", int, 2),
+    # rendercache - number of rendered files held in memory
+    ("rendercache", int, 256),
+    # renderttl - seconds a rendered file is held before rendering again
+    ("renderttl", int, 60),
+    # subfolders - 1 to allow files in subfolders of the tftp root folder
+    # to be requested, as folder/filename
+    ("subfolders", _to_bool, False),
+    # rootindex - 1 to hold an index of the tftp root folder in memory,
+    # so requests do not search the file system
+    ("rootindex", _to_bool, False),
+    # indexinterval - seconds between checks of the root folder for changes
+    ("indexinterval", int, 2),
+    # inotify - 1 to learn of changes to the root folder from Linux inotify
+    # as they happen, rather than every indexinterval seconds
+    ("inotify", _to_bool, False),
+    # rescaninterval - with inotify, seconds between checks of the root
+    # folder, in case a change was missed
+    ("rescaninterval", int, 60),
+    # misscache - number of missing files remembered, so repeated requests
+    # for them are answered without looking at the disc, 0 for none
+    ("misscache", int, 0),
+    # missttl - seconds a missing file is remembered
+    ("missttl", int, 10),
+    # misslog - seconds over which repeated requests for a missing file
+    # are counted rather than logged, 0 logs every request
+    ("misslog", int, 10),
+    # filecache - number of recently served files kept open, and shared
+    # by the clients reading them, 0 to open the file for each request
+    ("filecache", int, 0),
+    # statttl - milliseconds before a file kept open is checked for changes
+    ("statttl", int, 1000),
+    # readahead - KB read from a file at a time, from which blocks are sent
+    ("readahead", int, 256),
+    # packetcache - KB of memory holding the data packets of the most
+    # requested files, built once and sent to every client, 0 for none
+    ("packetcache", int, 0),
+    # iothreads - number of threads finding, opening and closing files, so
+    # a slow disc or network share does not hold up other transfers, 0 to
+    # do this in the engine thread
+    ("iothreads", int, 0),
+    # fastretransmit - the number of duplicates of the packet last answered
+    # after which the answer is sent again at once, rather than when its
+    # TTL expires, 0 to only send again when the TTL expires
+    ("fastretransmit", int, 0),
+    # rcvbuf, sndbuf - KB of the socket receive and send buffers, 0 to
+    # size them from expectedclients
+    ("rcvbuf", int, 0),
+    ("sndbuf", int, 0),
+    # expectedclients - the number of clients which may be served at once,
+    # used to size the buffers, 0 to leave the system default sizes
+    ("expectedclients", int, 0),
+    # draintime - seconds transfers in progress are given to finish when
+    # the server is stopped, new requests being refused, 0 to stop at once
+    ("draintime", int, 120),
+    # latency - 1 to measure the latencies of serving each packet in
+    # histograms, given in the metrics and logged as the server stops
+    ("latency", _to_bool, False),
+    # traceclient - an ip address, the transfers of which are written to the
+    # logfolder as timelines in the Chrome trace format, empty for none
+    ("traceclient", str, ""),
+    # profiletime - seconds the engine is profiled for when asked to, by a
+    # SIGUSR1 signal, the results being written to the logfolder
+    ("profiletime", int, 30),
+    # capturefile - a file, relative to the logfolder, to which every packet
+    # received is recorded, for tftpreplay.py, empty for none
+    ("capturefile", str, ""),
+    # capturesize - MB the capture file may grow to, recording then stops
+    ("capturesize", int, 100),
+    # journalfile - a file, relative to the logfolder, to which a record of
+    # each transfer is appended, read by tftpjournal.py, empty for none
+    ("journalfile", str, ""),
+    ]
+
+
+# Options which may be given in a [Listener name] section, each listener
+# takes the values of the Folders and IPsetup sections, unless given here.
+# Each entry is (option, conversion function)
+LISTENER_OPTIONS = [
+    ("tftprootfolder", os.path.abspath),
+    ("anyclient", _to_bool),
+    ("clientipaddress", str),
+    ("clientmask", int),
+    ("listenipaddress", str),
+    ("listenport", int),
+    ]
+
+
+def get_tuning_defaults():
+    "Returns a dictionary of the default tuning values"
+    return dict((option, default) for option, convert, default in TUNING_OPTIONS)
+
+
+def read_tuning(cfg, cfgdict):
+    """Reads any options in the Tuning section of the ConfigParser
+       object cfg into cfgdict, raise ConfigError if any are invalid"""
+    if not cfg.has_section("Tuning"):
+        return
+    for option, convert, default in TUNING_OPTIONS:
+        if cfg.has_option("Tuning", option):
+            try:
+                cfgdict[option]=convert(cfg.get("Tuning", option))
+            except Exception:
+                raise ConfigError, "Option %s in the config file is in error" % option
+
 def get_defaults():
     "Returns a dictionary of default values"
     cfgdict = { "anyclient": True,
@@ -68,6 +219,7 @@ def get_defaults():
                 "clientmask": 16,
                 "listenport": 69,
                 "listenipaddress": "0.0.0.0"  }
+    cfgdict.update(get_tuning_defaults())
     if SCRIPTDIRECTORY:
         cfgdict["tftprootfolder"]=os.path.join(SCRIPTDIRECTORY,'tftproot')
         cfgdict["logfolder"]=os.path.join(SCRIPTDIRECTORY,'tftplogs')
@@ -82,7 +234,7 @@ def getconfigstrict(scriptdirectory, configfile):
     global SCRIPTDIRECTORY, CONFIGFILE
     SCRIPTDIRECTORY = scriptdirectory
     CONFIGFILE = configfile
-    cfgdict = {}
+    cfgdict = get_tuning_defaults()
 
     if not os.path.isfile(configfile):
         CONFIGFILE = ""
@@ -154,6 +306,9 @@ def getconfigstrict(scriptdirectory, configfile):
             raise ConfigError, "Option listenport in the config file is in error"
     else:
         raise ConfigError, "listenport missing from configuration file"
+    # optional tuning values
+    read_tuning(cfg, cfgdict)
+
     # cfgdict now filled, check it
     status, message = validate(cfgdict)
     if not status:
@@ -284,6 +439,9 @@ def getconfig(scriptdirectory, configfile):
             cfg.remove_option("IPsetup", "port")
         cfg.set("IPsetup", "listenport", str(cfgdict["listenport"]))
 
+    # optional tuning values
+    read_tuning(cfg, cfgdict)
+
     # cfgdict now filled, check it
     status, message = validate(cfgdict)
     if not status:
@@ -303,6 +461,47 @@ def getconfig(scriptdirectory, configfile):
     return cfgdict
 
 
+def getlisteners(cfgdict):
+    """Returns a list of (name, cfgdict) for each listener, the first
+       being cfgdict itself, named "main", followed by one for each
+       [Listener name] section of the config file, whose options replace
+       those of cfgdict. If any are invalid, raise ConfigError"""
+    listeners = [("main", cfgdict)]
+    if not CONFIGFILE or not os.path.isfile(CONFIGFILE):
+        return listeners
+    cfg=ConfigParser.ConfigParser()
+    try:
+        cfg.read(CONFIGFILE)
+    except Exception:
+        raise ConfigError, "Unable to read the configuration file"
+    for section in cfg.sections():
+        if not section.startswith("Listener "):
+            continue
+        name = section[len("Listener "):].strip()
+        if not name or name in [other_name for other_name, other in listeners]:
+            # the main listener is named main, and listeners are reloaded by name
+            raise ConfigError, "Listener name %s is missing or already used" % name
+        listener = cfgdict.copy()
+        for option, convert in LISTENER_OPTIONS:
+            if cfg.has_option(section, option):
+                try:
+                    listener[option]=convert(cfg.get(section, option))
+                except Exception:
+                    raise ConfigError, "Option %s of listener %s in the config file is in error" % (option, name)
+        status, message = validate(listener)
+        if not status:
+            raise ConfigError, "Listener %s: %s" % (name, message)
+        # no two listeners can bind to the same address and port
+        address = listener["listenipaddress"]
+        for other_name, other in listeners:
+            if other["listenport"] != listener["listenport"]:
+                continue
+            if address in ("", "0.0.0.0") or other["listenipaddress"] in ("", "0.0.0.0", address):
+                raise ConfigError, "Listeners %s and %s use the same port" % (other_name, name)
+        listeners.append((name, listener))
+    return listeners
+
+
 def setconfig(cfgdict):
     """Writes cfgdict to the configuration file, only
        writes if there are changes, returns True on success
@@ -416,6 +615,9 @@ def validate(cfgdict):
     if not status:
         return status, message
     status,message = validate_listenipaddress(cfgdict["listenipaddress"])
+    if not status:
+        return status, message
+    status,message = validate_tuning(cfgdict)
     if not status:
         return status, message
     return True, None
@@ -472,6 +674,67 @@ def validate_listenipaddress(listenipaddress):
         return False, "Server listen ip address is not valid"
     return True, None
 
+def validate_tuning(cfgdict):
+    """Check any tuning values present in cfgdict"""
+    if "writequeue" in cfgdict and cfgdict["writequeue"] < 1:
+        return False, "writequeue must be at least 1"
+    if "writerthreads" in cfgdict and cfgdict["writerthreads"] < 1:
+        return False, "writerthreads must be at least 1"
+    if "fsyncpolicy" in cfgdict and cfgdict["fsyncpolicy"] not in ("none", "file", "group"):
+        return False, "fsyncpolicy must be none, file or group"
+    if "fsyncdelay" in cfgdict and cfgdict["fsyncdelay"] < 0:
+        return False, "fsyncdelay must not be negative"
+    if "netasciicache" in cfgdict and cfgdict["netasciicache"] < 0:
+        return False, "netasciicache must not be negative"
+    if "decompresscache" in cfgdict and cfgdict["decompresscache"] < 0:
+        return False, "decompresscache must not be negative"
+    if "renderhook" in cfgdict and cfgdict["renderhook"] not in ("", "template") \
+            and not os.path.isfile(cfgdict["renderhook"]):
+        return False, "renderhook must be template, or the path of a Python file"
+    if "renderthreads" in cfgdict and cfgdict["renderthreads"] < 1:
+        return False, "renderthreads must be at least 1"
+    if "rendercache" in cfgdict and cfgdict["rendercache"] < 0:
+        return False, "rendercache must not be negative"
+    if "indexinterval" in cfgdict and cfgdict["indexinterval"] < 1:
+        return False, "indexinterval must be at least 1"
+    if "rescaninterval" in cfgdict and cfgdict["rescaninterval"] < 1:
+        return False, "rescaninterval must be at least 1"
+    if "misscache" in cfgdict and cfgdict["misscache"] < 0:
+        return False, "misscache must not be negative"
+    if "missttl" in cfgdict and cfgdict["missttl"] < 0:
+        return False, "missttl must not be negative"
+    if "misslog" in cfgdict and cfgdict["misslog"] < 0:
+        return False, "misslog must not be negative"
+    if "filecache" in cfgdict and cfgdict["filecache"] < 0:
+        return False, "filecache must not be negative"
+    if "statttl" in cfgdict and cfgdict["statttl"] < 0:
+        return False, "statttl must not be negative"
+    if "readahead" in cfgdict and cfgdict["readahead"] < 1:
+        return False, "readahead must be at least 1"
+    if "packetcache" in cfgdict and cfgdict["packetcache"] < 0:
+        return False, "packetcache must not be negative"
+    if "iothreads" in cfgdict and cfgdict["iothreads"] < 0:
+        return False, "iothreads must not be negative"
+    if "fastretransmit" in cfgdict and cfgdict["fastretransmit"] < 0:
+        return False, "fastretransmit must not be negative"
+    if "rcvbuf" in cfgdict and cfgdict["rcvbuf"] < 0:
+        return False, "rcvbuf must not be negative"
+    if "sndbuf" in cfgdict and cfgdict["sndbuf"] < 0:
+        return False, "sndbuf must not be negative"
+    if "expectedclients" in cfgdict and cfgdict["expectedclients"] < 0:
+        return False, "expectedclients must not be negative"
+    if "draintime" in cfgdict and cfgdict["draintime"] < 0:
+        return False, "draintime must not be negative"
+    if "traceclient" in cfgdict and cfgdict["traceclient"]:
+        broadcast_address, network_address = ipv4.parse(cfgdict["traceclient"], 32)
+        if not broadcast_address:
+            return False, "traceclient must be an ip address"
+    if "profiletime" in cfgdict and cfgdict["profiletime"] < 1:
+        return False, "profiletime must be at least 1"
+    if "capturesize" in cfgdict and cfgdict["capturesize"] < 1:
+        return False, "capturesize must be at least 1"
+    return True, None
+
 def make_subnet(clientipaddress, clientmask):
     "Returns a subnet string"
     if clientmask != "32":
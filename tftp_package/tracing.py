@@ -0,0 +1,291 @@
+####### TFTPgui #######
+#
+# tracing.py  - latency histograms and packet tracing for TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+tracing.py - measures where the time goes in serving a transfer
+
+A Tracer is created by the ServerState only if the latency or
+traceclient options are set, or a packet hook is added, otherwise the
+engine's only cost is testing that it has no tracer.
+
+It keeps a Histogram of each of these, in microseconds:
+
+admission - from reading a request to sending its first packet
+ack_to_data - from reading a packet to sending the DATA packet it
+              asks for, the time the server adds to each round trip
+disk_read - reading a block from the file
+send - each call to sendto
+
+Packet hooks are functions hook(event, rx_addr, data, when), called
+for each packet, event being "received" or "sent", rx_addr the client's
+(ip address, port), data the packet, and when its time.time().
+
+The transfers of the client given by traceclient are recorded as
+timelines, written at the end of each transfer to the logfolder as
+trace-<ip>-<port>-<time>.json, in the Chrome trace event format, which
+chrome://tracing and Perfetto display. This needs the json module,
+Python 2.6 or later.
+
+Provides classes:
+Histogram
+Tracer
+"""
+
+import os, time, math
+
+try:
+    import json
+except ImportError:
+    json = None
+
+
+# the names of the packet types, by the second byte of the opcode
+_OPCODES = {"\x01": "RRQ", "\x02": "WRQ", "\x03": "DATA",
+            "\x04": "ACK", "\x05": "ERROR", "\x06": "OACK"}
+
+# the histograms kept by a Tracer
+HISTOGRAMS = ("admission", "ack_to_data", "disk_read", "send")
+
+
+def packet_name(data):
+    "Returns a description of the packet data, such as 'ACK 5'"
+    name = _OPCODES.get(data[1:2], "unknown")
+    if name in ("DATA", "ACK") and len(data) >= 4:
+        return "%s %s" % (name, ord(data[2])*256 + ord(data[3]))
+    return name
+
+
+class Histogram(object):
+    """Counts values in buckets whose width grows with the value, as HDR
+       histograms do, each power of two is split into subbuckets buckets,
+       so a value is held to within 1/subbuckets of itself, whatever its
+       size, subbuckets must be a power of two"""
+
+    def __init__(self, subbuckets=32):
+        self.subbuckets = subbuckets
+        self._shift = int(math.log(subbuckets, 2))
+        # dictionary of bucket index : count
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, value):
+        "Returns the bucket of the non-negative integer value"
+        if value < 2*self.subbuckets:
+            return value
+        # frexp gives the number of bits of value
+        shift = math.frexp(value)[1] - self._shift - 1
+        return shift*self.subbuckets + (value >> shift)
+
+    def lowest(self, index):
+        "Returns the lowest value of bucket index"
+        if index < 2*self.subbuckets:
+            return index
+        shift = index//self.subbuckets - 1
+        return (index - shift*self.subbuckets) << shift
+
+    def record(self, value):
+        "Counts value, an integer, negative values are counted as 0"
+        if value < 0:
+            value = 0
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Returns the value below which percent of the values fall,
+           to the precision of the buckets, or 0 if none are counted"""
+        wanted = self.count*percent/100.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                # the highest value the bucket holds
+                return min(self.lowest(index+1) - 1, self.max)
+        return self.max
+
+    def mean(self):
+        if not self.count:
+            return 0
+        return self.total//self.count
+
+    def clear(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class Tracer(object):
+    """Used by the engine thread to record latencies in histograms, if
+       latency is True, to call the packet hooks, a list, and to write the
+       timelines of the transfers of the ip address traceclient, if given,
+       to logfolder"""
+
+    def __init__(self, latency, hooks, traceclient="", logfolder=""):
+        self.histograms = None
+        self.hooks = hooks
+        self.set_options(latency, traceclient, logfolder)
+        # the time the packet being handled was read
+        self.last_received = 0.0
+
+    def set_options(self, latency, traceclient, logfolder):
+        "Changes the options, the histograms are kept while latency is True"
+        if not latency:
+            self.histograms = None
+        elif self.histograms is None:
+            self.histograms = dict([(name, Histogram()) for name in HISTOGRAMS])
+        self.traceclient = traceclient
+        self.logfolder = logfolder
+
+    def record(self, name, seconds):
+        "Records a latency, in seconds"
+        if self.histograms is not None:
+            self.histograms[name].record(int(seconds*1000000))
+
+    def received(self, connections, rx_data, rx_addr):
+        """Called as a packet is read, connections being the dictionary of
+           rx_addr : connection of the server"""
+        now = time.time()
+        self.last_received = now
+        for hook in self.hooks:
+            hook("received", rx_addr, rx_data, now)
+        connection = connections.get(rx_addr)
+        if connection is None:
+            return
+        connection.trace_received = now
+        if connection.timeline is not None:
+            self.instant(connection, "received " + packet_name(rx_data), now)
+
+    def admitted(self, connection):
+        "Called as the request for a new connection is accepted"
+        connection.trace_admitted = self.last_received
+        if self.traceclient and connection.rx_addr[0] == self.traceclient and json is not None:
+            connection.timeline = []
+            self.instant(connection, "received " + packet_name(connection.rx_data), self.last_received)
+
+    def sent(self, connection, data, start, end):
+        "Called as connection sends data, sendto being called at start, returning at end"
+        for hook in self.hooks:
+            hook("sent", connection.rx_addr, data, start)
+        self.record("send", end - start)
+        timeline = connection.timeline
+        if connection.trace_admitted is not None:
+            self.record("admission", start - connection.trace_admitted)
+            if timeline is not None:
+                self.span(connection, "admission", connection.trace_admitted, start)
+            connection.trace_admitted = None
+        elif data[1:2] == "\x03" and connection.trace_received is not None:
+            self.record("ack_to_data", start - connection.trace_received)
+            if timeline is not None:
+                self.span(connection, "ack to data", connection.trace_received, start)
+        connection.trace_received = None
+        if timeline is not None:
+            self.span(connection, "sent " + packet_name(data), start, end)
+
+    def disk_read(self, connection, start, end):
+        "Called as connection has read a block from its file"
+        self.record("disk_read", end - start)
+        if connection.timeline is not None:
+            self.span(connection, "disk read", start, end)
+
+    def span(self, connection, name, start, end):
+        "Adds an event lasting from start to end to the timeline of connection"
+        connection.timeline.append({"name": name, "ph": "X", "pid": connection.rx_addr[1],
+                                    "tid": 1, "ts": int(start*1000000),
+                                    "dur": int((end-start)*1000000)})
+
+    def instant(self, connection, name, when):
+        "Adds an event at time when to the timeline of connection"
+        connection.timeline.append({"name": name, "ph": "i", "s": "t", "pid": connection.rx_addr[1],
+                                    "tid": 1, "ts": int(when*1000000)})
+
+    def finished(self, connection, pool=None):
+        """Called as connection shuts down, writes its timeline, in
+           pool, a fileio.ThreadPool, if given"""
+        timeline = connection.timeline
+        if timeline is None or not self.logfolder:
+            return
+        connection.timeline = None
+        path = os.path.join(self.logfolder, "trace-%s-%s-%s.json" % (
+                            connection.rx_addr[0], connection.rx_addr[1],
+                            time.strftime("%Y%m%d%H%M%S")))
+        trace = {"traceEvents": timeline,
+                 "displayTimeUnit": "ms",
+                 "otherData": {"client": "%s:%s" % connection.rx_addr,
+                               "filename": connection.filename}}
+        if pool is not None:
+            pool.submit(write_trace, path, trace)
+            return
+        try:
+            write_trace(path, trace)
+        except IOError:
+            # the timeline is lost, but the transfer is not affected
+            pass
+
+    def report(self):
+        "Returns a list of lines describing the histograms"
+        lines = []
+        if self.histograms is None:
+            return lines
+        for name in HISTOGRAMS:
+            histogram = self.histograms[name]
+            if histogram.count:
+                lines.append("Latency %s: %s measured, median %s us, 99%% %s us, max %s us" % (
+                             name, histogram.count, histogram.percentile(50),
+                             histogram.percentile(99), histogram.max))
+        return lines
+
+    def metrics(self):
+        "Returns a dictionary of the histogram percentiles, in microseconds"
+        metrics = {}
+        if self.histograms is None:
+            return metrics
+        for name, histogram in self.histograms.items():
+            prefix = "latency_" + name
+            metrics[prefix + "_count"] = histogram.count
+            metrics[prefix + "_mean"] = histogram.mean()
+            metrics[prefix + "_p50"] = histogram.percentile(50)
+            metrics[prefix + "_p90"] = histogram.percentile(90)
+            metrics[prefix + "_p99"] = histogram.percentile(99)
+            metrics[prefix + "_max"] = histogram.max
+        return metrics
+
+
+def write_trace(path, trace):
+    "Writes trace, a dictionary, as JSON to path"
+    fp = open(path, "w")
+    try:
+        json.dump(trace, fp)
+    finally:
+        fp.close()
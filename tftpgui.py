@@ -63,6 +63,19 @@ If 'listenipaddress' is set to a specific IP address of the computer
 (only applicable for a computer with multiple ip addresses), then it will
 only listen on the address given.
 
+With the --nogui option, further addresses or ports may be served by
+adding [Listener name] sections to the config file, see README.TXT.
+
+On Gnu/Linux, sending the program a SIGHUP signal reads the configuration
+file again, without stopping transfers in progress.
+
+Sending it a SIGUSR1 signal profiles it for a number of seconds, writing
+the results to the log folder, see README.TXT.
+
+Sending it a SIGUSR2 signal restarts it, a new process is started with
+the same command line, which takes over the bound ports, while this
+process finishes its transfers in progress, and exits.
+
 If run with the --nogui option then the program has no dependencies other
 than standard Python (versions 2.5 to 2.7).  If run with a GUI then the
 script imports the Tkinter module, and some Gnu/Linux distributions may
@@ -73,11 +86,11 @@ under Gnu/Linux the program must be run with administrator pivileges
 (ie using sudo) - as the OS requires this.
 """
 
-import os, sys, thread, time
+import os, sys, thread, time, signal
 
 from optparse import OptionParser
 
-from tftp_package import tftpcfg, tftp_engine
+from tftp_package import tftpcfg, tftp_engine, handoff
 
 # Check the python version
 if not sys.version_info[0] == 2 and sys.version_info[1] >= 5:
@@ -124,6 +137,49 @@ if not os.path.isfile(default_configfile):
         configdirectory = os.getenv("HOME", os.getenv("HOMEPATH", scriptdirectory))
         default_configfile = os.path.join(configdirectory, '.tftpgui.cfg')
 
+def reload_on_sighup(server_list):
+    "Sets a SIGHUP handler, asking the loop to read the config file again"
+    if not hasattr(signal, "SIGHUP"):
+        return
+    def request_reload(signum, frame):
+        for server in server_list:
+            server.reload_requested = True
+    signal.signal(signal.SIGHUP, request_reload)
+
+def restart_on_sigusr2(server_list):
+    "Sets a SIGUSR2 handler, asking the loop to restart in a new process"
+    if not hasattr(signal, "SIGUSR2"):
+        return
+    def request_restart(signum, frame):
+        if server_list:
+            server_list[0].shared.restart_requested = True
+    signal.signal(signal.SIGUSR2, request_restart)
+
+def profile_on_sigusr1(server_list):
+    """Sets a SIGUSR1 handler, asking the loop to profile the engine for
+       profiletime seconds, or if profiling, to stop early"""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    def request_profile(signum, frame):
+        if server_list:
+            server_list[0].shared.profile_requested = True
+    signal.signal(signal.SIGUSR1, request_profile)
+
+def drain_on_signals(server_list):
+    """Sets CTRL-c and SIGTERM handlers, the first asks the servers to drain,
+       finishing the transfers in progress, a second CTRL-c stops at once"""
+    def request_drain(signum, frame):
+        if server_list and server_list[0].shared.stopping:
+            if signum == signal.SIGINT:
+                raise KeyboardInterrupt
+            return
+        print "Draining, new requests are dropped, press CTRL-c again to stop at once"
+        for server in server_list:
+            server.shared.stopping = True
+            server.serving = False
+    signal.signal(signal.SIGINT, request_drain)
+    signal.signal(signal.SIGTERM, request_drain)
+
 # However if a config file is given on command line, this overrides
 if args:
     configfile = args[0]
@@ -158,9 +214,50 @@ else:
 # tftp_engine.loop_nogui(server)
 # or
 # tftp_engine.loop(server)
+# or, with several listeners,
+# tftp_engine.loop_multiserver(server_list)
 ##################################################
 
+# If started by a restart, the sockets bound by the process restarted
+inherited = handoff.inherited()
+
+if options.nogui:
+    # with listener sections in the config file, several servers are run
+    try:
+        listeners = tftpcfg.getlisteners(cfgdict)
+    except tftpcfg.ConfigError, e:
+        print "Error in config file:"
+        print e
+        sys.exit(1)
+    if len(listeners) > 1:
+        # serve every listener from one loop, sharing caches and pools
+        server_list = tftp_engine.create_listeners(listeners)
+        if inherited is not None:
+            server_list[0].shared.take_over(inherited)
+        reload_on_sighup(server_list)
+        restart_on_sigusr2(server_list)
+        profile_on_sigusr1(server_list)
+        drain_on_signals(server_list)
+        for server in server_list:
+            print "TFTP listener %s on %s:%s serving %s" % (server.name,
+                                                           server.listenipaddress or "0.0.0.0",
+                                                           server.listenport,
+                                                           server.tftprootfolder)
+        print "See logs at:\n%s" % server_list[0].logfolder
+        print "Press CTRL-c to stop"
+        # loop_multiserver exits only if no listener can be started, or
+        # once drained after a CTRL-C, or at once after a second CTRL-C
+        result = tftp_engine.loop_multiserver(server_list)
+        sys.exit(result)
+
 server = tftp_engine.ServerState(**cfgdict)
+if inherited is not None:
+    # serve at once on the sockets taken over
+    server.shared.take_over(inherited)
+    server.serving = True
+reload_on_sighup([server])
+restart_on_sigusr2([server])
+profile_on_sigusr1([server])
 
 
 if options.nogui:
@@ -174,9 +271,10 @@ if options.nogui:
     print "Press CTRL-c to stop"
     # loop_nogui runs the server loop,
     # which exits if the the server cannot listen on the port given
-    # otherwise it exits on a CTRL-C keyboard interrupt
-    # returns 0 if terminated with CTRL-c
+    # otherwise it exits once drained after a CTRL-C, or at once
+    # after a second CTRL-c, returns 0 if terminated with CTRL-c
     # or 1 if an error occurs
+    drain_on_signals([server])
     result = tftp_engine.loop_nogui(server)
     sys.exit(result)
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+####### TFTPgui #######
+#
+# tftpjournal.py  - reports on the transfers recorded by TFTPgui
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+tftpjournal.py - reports on the transfers in a journal file
+
+The program is run with:
+
+python tftpjournal.py [options] <journal-file>
+
+The journal file is written by TFTPgui when the journalfile option is
+set, with a record of each transfer. The reports are:
+
+summary - the number of transfers of each outcome
+files - the files most often requested
+clients - the clients whose completed transfers were slowest
+failures - the transfers of each outcome in each interval of time
+"""
+
+import sys, time
+
+from optparse import OptionParser
+
+from tftp_package import journal
+
+
+REPORTS = ("summary", "files", "clients", "failures")
+
+usage = """usage: %prog [options] <journal-file>
+
+Reports on the transfers recorded in the journal file, written
+by TFTPgui with the journalfile option set"""
+
+parser = OptionParser(usage=usage, version="2.3")
+parser.add_option("-r", "--report", dest="report", default="summary",
+                  help="summary, files, clients or failures, default summary")
+parser.add_option("-n", "--number", dest="number", type="int", default=10,
+                  help="the number of files or clients listed, default 10")
+parser.add_option("-i", "--interval", dest="interval", type="int", default=60,
+                  help="minutes in each line of the failures report, default 60")
+parser.add_option("-s", "--since", dest="since", type="float", default=0,
+                  help="only the transfers of the last hours given")
+parser.add_option("-c", "--client", dest="client", default="",
+                  help="only the transfers of this client ip address")
+parser.add_option("-f", "--file", dest="filename", default="",
+                  help="only the transfers of this file")
+(options, args) = parser.parse_args()
+
+if len(args) != 1:
+    parser.error("a journal file must be given")
+
+if options.report not in REPORTS:
+    parser.error("the report must be one of %s" % ", ".join(REPORTS))
+
+if options.number < 1 or options.interval < 1:
+    parser.error("the number and interval must be at least 1")
+
+def selected(entries):
+    "Yields the entries chosen by the options"
+    since = 0
+    if options.since:
+        since = time.time() - options.since*3600
+    for entry in entries:
+        if entry["time"] < since:
+            continue
+        if options.client and entry["client"] != options.client:
+            continue
+        if options.filename and entry["filename"] != options.filename:
+            continue
+        yield entry
+
+try:
+    entries = list(selected(journal.read_journal(args[0])))
+except (IOError, ValueError), e:
+    print "Unable to read the journal file: %s" % e
+    sys.exit(1)
+
+if not entries:
+    print "No transfers recorded"
+    sys.exit(0)
+
+def when(seconds):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(seconds))
+
+if options.report == "summary":
+    print "%s transfers from %s to %s" % (len(entries), when(entries[0]["time"]), when(entries[-1]["time"]))
+    counts = journal.outcome_counts(entries)
+    for outcome in journal.OUTCOMES:
+        print "%-10s %8s %6.1f%%" % (outcome, counts[outcome], counts[outcome]*100.0/len(entries))
+    print "%-10s %8s KB" % ("sent", sum([entry["bytes"] for entry in entries if not entry["upload"]])//1024)
+    print "%-10s %8s KB" % ("received", sum([entry["bytes"] for entry in entries if entry["upload"]])//1024)
+
+elif options.report == "files":
+    print "%10s %12s %8s  %s" % ("transfers", "KB", "not ok", "file")
+    for filename, transfers, bytes, failed in journal.top_files(entries, options.number):
+        print "%10s %12s %8s  %s" % (transfers, bytes//1024, failed, filename)
+
+elif options.report == "clients":
+    print "%-16s %10s %10s %12s" % ("client", "transfers", "KB/s", "resent")
+    for client, transfers, rate, retransmits in journal.slowest_clients(entries, options.number):
+        print "%-16s %10s %10.1f %12s" % (client, transfers, rate, retransmits)
+
+else:
+    print "%-16s %10s %8s  %s" % ("from", "transfers", "not ok", " ".join(journal.OUTCOMES[1:]))
+    for start, transfers, counts in journal.failure_rates(entries, options.interval*60):
+        failed = transfers - counts["ok"]
+        print "%-16s %10s %7.1f%%  %s" % (when(start), transfers, failed*100.0/transfers,
+                                        " ".join([str(counts[outcome]) for outcome in journal.OUTCOMES[1:]]))
+
+sys.exit(0)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+####### TFTPgui #######
+#
+# tftpreplay.py  - replays captured traffic against a TFTP server
+#
+# Version : 2.3
+# Date : 20261019
+#
+# Author : Bernard Czenkusz
+# Email  : bernie@skipole.co.uk
+#
+#
+# Copyright (c) 2007,2008,2009,2010,2011 Bernard Czenkusz
+#
+# This file is part of TFTPgui.
+#
+#    TFTPgui is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    TFTPgui is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with TFTPgui.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+tftpreplay.py - replays a capture file against a TFTP server
+
+The program is run with:
+
+python tftpreplay.py [options] <capture-file>
+
+The capture file is written by TFTPgui when the capturefile option is
+set. The transfers in it are replayed against the server given, at the
+same moments, or faster, and the distributions of the time to complete
+each transfer, and of their throughput, are printed. The results may be
+saved, and compared with those of a replay against another build.
+
+Uploads in the capture are replayed too, so replay against a server
+whose tftp root folder is a scratch copy.
+"""
+
+import os, sys
+
+from optparse import OptionParser
+
+from tftp_package import replay
+
+try:
+    import json
+except ImportError:
+    print "tftpreplay.py requires Python 2.6 or 2.7"
+    sys.exit(1)
+
+
+usage = """usage: %prog [options] <capture-file>
+
+Replays the transfers in the capture file, written by TFTPgui
+with the capturefile option set, against a TFTP server"""
+
+parser = OptionParser(usage=usage, version="2.3")
+parser.add_option("-s", "--server", dest="server", default="127.0.0.1:69",
+                  help="address:port of the server, default 127.0.0.1:69")
+parser.add_option("-x", "--speed", dest="speed", type="float", default=1.0,
+                  help="speed of the replay, 1 as captured, 10 ten times faster, 0 starts every transfer at once")
+parser.add_option("-t", "--timeout", dest="timeout", type="float", default=1.0,
+                  help="seconds before a packet is sent again, default 1")
+parser.add_option("-o", "--output", dest="output", default="",
+                  help="file to save the results in, to compare with later")
+parser.add_option("-c", "--compare", dest="compare", default="",
+                  help="results saved by an earlier replay, to compare with")
+parser.add_option("-q", "--quiet", action="store_true", dest="quiet", default=False,
+                  help="do not print each transfer as it completes")
+(options, args) = parser.parse_args()
+
+if len(args) != 1:
+    parser.error("a capture file must be given")
+
+try:
+    host, port = options.server.rsplit(":", 1)
+    address = (host, int(port))
+except ValueError:
+    parser.error("the server must be given as address:port")
+
+if options.speed < 0:
+    parser.error("the speed must not be negative")
+
+try:
+    transfers = replay.load_transfers(args[0])
+except (IOError, ValueError), e:
+    print "Unable to read the capture file: %s" % e
+    sys.exit(1)
+
+if not transfers:
+    print "The capture file holds no transfers"
+    sys.exit(1)
+
+baseline = None
+if options.compare:
+    try:
+        fp = open(options.compare, "r")
+        try:
+            baseline = json.load(fp)["summary"]
+        finally:
+            fp.close()
+    except (IOError, ValueError, KeyError), e:
+        print "Unable to read the results to compare with: %s" % e
+        sys.exit(1)
+
+def print_result(result):
+    print "%-5s %-8s %8.3fs %10s bytes  %s" % (result["upload"] and "put" or "get",
+                                               result["outcome"], result["duration"],
+                                               result["bytes"], result["filename"])
+
+print "Replaying %s transfers against %s:%s" % (len(transfers), address[0], address[1])
+replayer = replay.Replayer(transfers, address, options.speed, options.timeout)
+if options.quiet:
+    results = replayer.run()
+else:
+    results = replayer.run(print_result)
+summary = replay.summarise(results, replayer.elapsed)
+
+print
+if baseline is None:
+    print "\n".join(replay.describe(summary))
+else:
+    print "\n".join(replay.compare(summary, baseline))
+
+if options.output:
+    fp = open(options.output, "w")
+    try:
+        json.dump({"capture": os.path.abspath(args[0]),
+                   "server": options.server,
+                   "speed": options.speed,
+                   "summary": summary,
+                   "results": results}, fp, indent=1)
+    finally:
+        fp.close()
+    print "Results saved to %s" % options.output
+
+if summary["ok"] < summary["transfers"]:
+    sys.exit(1)
+sys.exit(0)